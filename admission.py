@@ -0,0 +1,135 @@
+# admission.py - DeepSeek 准入控制（全域併發上限 + 每位用戶 token bucket + 降級層級）
+import threading
+import time
+
+from ttl_cache import TTLCache
+
+# 降級層級，由輕到重
+TIER_FULL = "full"          # 正常回答
+TIER_REDUCED = "reduced"    # 縮短 max_tokens
+TIER_CASUAL = "casual"      # 專業問題也改用賣萌模式（短、便宜）
+TIER_CANNED = "canned"      # 不呼叫 DeepSeek，立刻回罐頭訊息
+TIERS = (TIER_FULL, TIER_REDUCED, TIER_CASUAL, TIER_CANNED)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class Ticket:
+    """admit() 的結果；with 區塊結束時歸還名額"""
+
+    def __init__(self, controller, tier, reason=None, held=False):
+        self.controller = controller
+        self.tier = tier
+        self.reason = reason
+        self._held = held
+
+    def release(self):
+        if self._held:
+            self._held = False
+            self.controller._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """最多 max_concurrency 個呼叫同時進行；等不到名額或用戶太頻繁就降到 canned"""
+
+    def __init__(self, max_concurrency=16, max_wait=2.0, user_rate=0.1, user_burst=3,
+                 reduced_at=0.5, casual_at=0.8, max_users=100000):
+        # user_rate: 每秒補幾個 token；reduced_at / casual_at: 進行中比例超過多少就降級
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.reduced_at = reduced_at
+        self.casual_at = casual_at
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._buckets = TTLCache(maxsize=max_users, ttl=max(user_burst / user_rate, 60) if user_rate else 3600)
+        self._lock = threading.Lock()
+
+        self.in_flight = 0
+        self.tiers = {tier: 0 for tier in TIERS}
+        self.rate_limited = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.admitted = 0
+
+    def _user_allowed(self, user_id):
+        if not user_id or not self.user_rate:
+            return True
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = TokenBucket(self.user_rate, self.user_burst)
+            allowed = bucket.take()
+            # 每次都重新 set，TTL 從最後一次請求起算；閒置超過 TTL 時 bucket 本來就補滿了，過期才不會多放行
+            self._buckets.set(user_id, bucket)
+            return allowed
+
+    def _count(self, tier):
+        with self._lock:
+            self.tiers[tier] += 1
+
+    def admit(self, user_id=None):
+        if not self._user_allowed(user_id):
+            with self._lock:
+                self.rate_limited += 1
+            self._count(TIER_CANNED)
+            return Ticket(self, TIER_CANNED, reason="user_rate")
+
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.max_wait):
+            with self._lock:
+                self.timed_out += 1
+            self._count(TIER_CANNED)
+            return Ticket(self, TIER_CANNED, reason="busy")
+
+        with self._lock:
+            self.in_flight += 1
+            self.admitted += 1
+            self.total_wait += time.monotonic() - started
+            load = self.in_flight / self.max_concurrency
+        if load > self.casual_at:
+            tier = TIER_CASUAL
+        elif load > self.reduced_at:
+            tier = TIER_REDUCED
+        else:
+            tier = TIER_FULL
+        self._count(tier)
+        return Ticket(self, tier, held=True)
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "tiers": dict(self.tiers),
+                "rate_limited": self.rate_limited,
+                "timed_out": self.timed_out,
+                "avg_wait_ms": round(self.total_wait / self.admitted * 1000, 1) if self.admitted else 0.0,
+                "tracked_users": len(self._buckets),
+            }
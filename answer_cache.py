@@ -0,0 +1,141 @@
+# answer_cache.py - 專業模式回答快取（問題正規化 + 記憶體 LRU/TTL + 可選 SQLite 持久層）
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from ttl_cache import TTLCache
+
+# 常見簡體字 -> 繁體字（植物問答常出現的字為主）
+_S2T_PAIRS = (
+    "叶葉 为為 么麼 办辦 浇澆 发發 黄黃 烂爛 虫蟲 霉黴 锈鏽 干乾 湿濕 "
+    "晒曬 伤傷 长長 养養 护護 种種 换換 质質 阳陽 风風 温溫 气氣 热熱 这這 "
+    "个個 吗嗎 没沒 还還 会會 该該 应應 样樣 觉覺 变變 软軟 茎莖 树樹 兰蘭 "
+    "龟龜 类類 观觀 莲蓮 绿綠 绒絨 财財 龙龍 罗羅 蓝藍 壳殼 虱蝨 学學 属屬 "
+    "疗療 诊診 断斷 问問 题題 里裡 后後 几幾 时時 间間 让讓 给給 对對 们們 "
+    "从從 过過 开開 关關 边邊 处處 点點 盘盤 钵缽 铺鋪 颗顆 条條 块塊 两兩 "
+    "满滿 适適 当當 须須 够夠"
+)
+S2T = str.maketrans({pair[0]: pair[1] for pair in _S2T_PAIRS.split()})
+
+# 只有語氣、不影響語意的字尾
+_TRAILING_PARTICLES = "啊呀啦喔哦耶欸嘛"
+
+
+def normalize_question(text):
+    """全形/半形、簡繁、大小寫、標點、空白都收斂成同一把 key"""
+    text = unicodedata.normalize("NFKC", text).lower().translate(S2T)
+    chars = [
+        ch for ch in text
+        if not ch.isspace() and unicodedata.category(ch)[0] not in ("P", "S")
+    ]
+    return "".join(chars).rstrip(_TRAILING_PARTICLES)
+
+
+class AnswerCache:
+    """記憶體 LRU + TTL，可選 SQLite 持久層（重啟後仍可命中）
+
+    SQLite 層每寫入 prune_every 筆清一次：刪掉過期的列，超過 disk_max_rows 就從最舊的刪
+    """
+
+    def __init__(self, maxsize=2000, ttl=7 * 86400, sqlite_path=None, disk_max_rows=20000, prune_every=100):
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.sqlite_path = sqlite_path
+        self.disk_max_rows = disk_max_rows
+        self.prune_every = prune_every
+        self._db = None
+        self._db_pid = None
+        self._db_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._since_prune = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.pruned = 0
+
+    def _conn(self):
+        # fork 之後（gunicorn --preload）不沿用 master 的連線
+        if self.sqlite_path and (self._db is None or self._db_pid != os.getpid()):
+            self._db = sqlite3.connect(self.sqlite_path, check_same_thread=False)
+            self._db_pid = os.getpid()
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answer_cache ("
+                "key TEXT PRIMARY KEY, answer TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS answer_cache_created_at ON answer_cache (created_at)")
+            self._db.commit()
+            self._prune(self._db)  # 啟動時先清一次，上次留下的過期列不用等寫滿 prune_every
+        return self._db
+
+    def _prune(self, db):
+        with self._db_lock:
+            removed = db.execute("DELETE FROM answer_cache WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+            excess = db.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0] - self.disk_max_rows
+            if excess > 0:
+                removed += db.execute(
+                    "DELETE FROM answer_cache WHERE key IN "
+                    "(SELECT key FROM answer_cache ORDER BY created_at LIMIT ?)", (excess,)
+                ).rowcount
+            db.commit()
+        with self._lock:
+            self.pruned += removed
+
+    def get(self, key):
+        answer = self.memory.get(key)
+        if answer is not None:
+            return answer
+        db = self._conn()
+        if db is not None:
+            with self._db_lock:
+                row = db.execute(
+                    "SELECT answer, created_at FROM answer_cache WHERE key = ?", (key,)
+                ).fetchone()
+            if row and time.time() - row[1] < self.ttl:
+                remaining = self.ttl - (time.time() - row[1])
+                self.memory.set(key, row[0], ttl=remaining)
+                with self._lock:
+                    self.disk_hits += 1
+                return row[0]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, answer):
+        self.memory.set(key, answer)
+        with self._lock:
+            self.stores += 1
+        db = self._conn()
+        if db is not None:
+            with self._db_lock:
+                db.execute(
+                    "INSERT OR REPLACE INTO answer_cache (key, answer, created_at) VALUES (?, ?, ?)",
+                    (key, answer, time.time())
+                )
+                db.commit()
+            with self._lock:
+                self._since_prune += 1
+                due = self._since_prune >= self.prune_every
+                if due:
+                    self._since_prune = 0
+            if due:
+                self._prune(db)
+
+    def stats(self):
+        memory = self.memory.stats()
+        with self._lock:
+            disk_hits, misses, stores, pruned = self.disk_hits, self.misses, self.stores, self.pruned
+        lookups = memory["hits"] + disk_hits + misses
+        return {
+            "size": memory["size"],
+            "maxsize": memory["maxsize"],
+            "memory_hits": memory["hits"],
+            "disk_hits": disk_hits,
+            "misses": misses,
+            "evictions": memory["evictions"],
+            "stores": stores,
+            "disk_pruned": pruned,
+            "hit_rate": round((memory["hits"] + disk_hits) / lookups, 4) if lookups else 0.0,
+            "persistent": bool(self.sqlite_path),
+        }
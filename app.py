@@ -1,25 +1,42 @@
 # app.py - 蕨積7.0 智能專業判斷版（修正推播查詢）
+import time
+IMPORT_STARTED = time.perf_counter()
 import os
 import json
-import requests
 import uuid
-import time
 import random
 import re
 from datetime import datetime, timezone, timedelta
 from flask import Flask, request, abort, jsonify, send_file
 from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
+from linebot.exceptions import InvalidSignatureError, LineBotApiError
 from linebot.models import (
     MessageEvent, TextMessage, ImageMessage, TextSendMessage, ImageSendMessage,
     FollowEvent, UnfollowEvent, PostbackEvent,
     QuickReply, QuickReplyButton, PostbackAction
 )
-from supabase import create_client, Client
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
-import pytz
 import atexit
+import functools
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from event_queue import EventQueue
+from event_dedupe import EventDeduper, SQLiteEventStore, SupabaseEventStore
+from dispatch import OrderedDispatcher
+from keyword_index import KeywordIndex
+from ttl_cache import TTLCache
+from write_behind import LastActiveBuffer
+from push_fanout import multicast_fanout
+from weather_cache import WeatherCache
+from answer_cache import AnswerCache, normalize_question
+from upstream import Upstream, make_line_http_client
+from admission import AdmissionController, TIER_CANNED, TIER_CASUAL, TIER_REDUCED
+from conversation import ConversationMemory, SQLiteConversationStore, SupabaseConversationStore
+from image_store import ImageStore, ImagePipeline
+from lazy_client import LazyClient
+from repository import UserRepository
+from llm_stream import read_stream, LatencyStats
+from push_lease import SQLiteLeaseBackend, SupabaseLeaseBackend, or_filter, run_sharded
+from metrics import Registry
+from log import setup_logging, get_logger
 
 app = Flask(__name__)
 
@@ -30,23 +47,189 @@ DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 
+# 上游網址（壓測時可以指到 bench/ 的本機假服務）
+LINE_API_ENDPOINT = os.getenv('LINE_API_ENDPOINT', 'https://api.line.me')
+LINE_DATA_ENDPOINT = os.getenv('LINE_DATA_ENDPOINT', 'https://api-data.line.me')
+DEEPSEEK_API_URL = os.getenv('DEEPSEEK_API_URL', "https://api.deepseek.com/v1/chat/completions")
+CWA_API_URL = os.getenv('CWA_API_URL', "https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-C0032-001")
+
+# Webhook 背景處理（1 = 先回 200，事件丟進佇列由 worker 處理）
+ASYNC_WEBHOOK = os.getenv('ASYNC_WEBHOOK', '0') == '1'
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+WEBHOOK_QUEUE_DB = os.getenv('WEBHOOK_QUEUE_DB')  # 設定路徑就啟用 SQLite 持久化
+# 一個 body 有多位用戶的事件時平行處理（同一用戶仍依序）；超過期限就先回 200
+WEBHOOK_DISPATCH_WORKERS = int(os.getenv('WEBHOOK_DISPATCH_WORKERS', 8))
+WEBHOOK_BODY_DEADLINE = float(os.getenv('WEBHOOK_BODY_DEADLINE', 10))
+# reply token 約 1 分鐘失效，超過這個秒數就改用 push
+REPLY_TOKEN_TTL = float(os.getenv('REPLY_TOKEN_TTL', 50))
+
+# 重送去重（webhookEventId）；backend: memory / sqlite / supabase（多台共用）
+WEBHOOK_DEDUPE_BACKEND = os.getenv('WEBHOOK_DEDUPE_BACKEND', 'memory')
+WEBHOOK_DEDUPE_DB = os.getenv('WEBHOOK_DEDUPE_DB', 'webhook_events.db')
+WEBHOOK_DEDUPE_TTL = float(os.getenv('WEBHOOK_DEDUPE_TTL', 86400))
+WEBHOOK_DEDUPE_SIZE = int(os.getenv('WEBHOOK_DEDUPE_SIZE', 100000))
+
+# 用戶資料快取
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 600))
+
+# last_active 合併寫入：累積到這麼多人或這麼多秒就 flush 一次
+LAST_ACTIVE_FLUSH_SIZE = int(os.getenv('LAST_ACTIVE_FLUSH_SIZE', 500))
+LAST_ACTIVE_FLUSH_INTERVAL = float(os.getenv('LAST_ACTIVE_FLUSH_INTERVAL', 30))
+
+# 每日推播 multicast：同時送幾批、每秒最多幾次 API 呼叫
+PUSH_CONCURRENCY = int(os.getenv('PUSH_CONCURRENCY', 4))
+PUSH_RATE_PER_SEC = float(os.getenv('PUSH_RATE_PER_SEC', 50))
+
+# 多 worker / 多機分片推播：supabase = 共用 push_leases 表；sqlite = 同一台機器共用檔案；local = 只有自己
+PUSH_LEASE_BACKEND = os.getenv('PUSH_LEASE_BACKEND', 'local')
+PUSH_LEASE_DB = os.getenv('PUSH_LEASE_DB', 'push_leases.db')
+PUSH_SHARDS = int(os.getenv('PUSH_SHARDS', 16))
+PUSH_LEASE_SECONDS = float(os.getenv('PUSH_LEASE_SECONDS', 60))
+
+# 07:30 推播預備：一次產生幾則候選知識；1 = 依用戶城市附上天氣澆水建議
+PUSH_FACT_POOL_SIZE = int(os.getenv('PUSH_FACT_POOL_SIZE', 8))
+PUSH_PER_CITY = os.getenv('PUSH_PER_CITY', '0') == '1'
+# 訂閱者以 user_id 分頁讀取（每頁 PUSH_PAGE_SIZE 筆），累積 PUSH_BATCH_SIZE 人送一次並記錄進度
+PUSH_PAGE_SIZE = int(os.getenv('PUSH_PAGE_SIZE', 1000))
+PUSH_BATCH_SIZE = int(os.getenv('PUSH_BATCH_SIZE', 10000))
+
+# 天氣快取：CWA 掛掉時，過期資料最多還能用幾秒
+WEATHER_MAX_STALE = float(os.getenv('WEATHER_MAX_STALE', 3 * 3600))
+
+# 專業模式回答快取（ANSWER_CACHE_DB 設定路徑就會寫入 SQLite，重啟也留著）
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 2000))
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', 7 * 86400))
+ANSWER_CACHE_DB = os.getenv('ANSWER_CACHE_DB')
+ANSWER_CACHE_DISK_ROWS = int(os.getenv('ANSWER_CACHE_DISK_ROWS', 20000))  # SQLite 層最多留幾筆
+
+# 對話記憶：每人最近 CONVERSATION_TURNS 輪，帶進 prompt 時依模式限制 token 數
+CONVERSATION_TURNS = int(os.getenv('CONVERSATION_TURNS', 6))
+CONVERSATION_USERS = int(os.getenv('CONVERSATION_USERS', 5000))
+CONVERSATION_TTL = float(os.getenv('CONVERSATION_TTL', 3600))
+CONVERSATION_TOKENS_CASUAL = int(os.getenv('CONVERSATION_TOKENS_CASUAL', 200))
+CONVERSATION_TOKENS_PROFESSIONAL = int(os.getenv('CONVERSATION_TOKENS_PROFESSIONAL', 600))
+# 記憶體滿了被擠出的用戶存到哪：memory（直接丟掉）/ sqlite / supabase
+CONVERSATION_BACKEND = os.getenv('CONVERSATION_BACKEND', 'memory')
+CONVERSATION_DB = os.getenv('CONVERSATION_DB', 'conversations.db')
+
+# DeepSeek 串流：1 = 邊收邊組字，字數到了就在句尾停止
+DEEPSEEK_STREAM = os.getenv('DEEPSEEK_STREAM', '0') == '1'
+CASUAL_CHAR_BUDGET = int(os.getenv('CASUAL_CHAR_BUDGET', 30))
+PROFESSIONAL_CHAR_BUDGET = int(os.getenv('PROFESSIONAL_CHAR_BUDGET', 100))
+
+# 對外連線：每個上游的併發上限
+DEEPSEEK_MAX_CONCURRENCY = int(os.getenv('DEEPSEEK_MAX_CONCURRENCY', 16))
+CWA_MAX_CONCURRENCY = int(os.getenv('CWA_MAX_CONCURRENCY', 4))
+LINE_MAX_CONCURRENCY = int(os.getenv('LINE_MAX_CONCURRENCY', 32))
+
+# 文字訊息處理時，用戶資料查詢在共用 thread pool 上跑，和分類 / DeepSeek 重疊
+IO_POOL_SIZE = int(os.getenv('IO_POOL_SIZE', 16))
+NAME_LOOKUP_TIMEOUT = float(os.getenv('NAME_LOOKUP_TIMEOUT', 0.3))  # 賣萌模式最多等名字幾秒，超過就不帶名字
+
+# 排程器（07:30 預備、08:00 推播）；多個 worker 都開也沒關係，推播靠租約表協調
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', '1') == '1'
+
+# 用戶圖片：背景分塊下載到暫存目錄（總容量 / 檔數 / 存活時間都有上限）
+IMAGE_DIR = os.getenv('IMAGE_DIR')  # 預設為系統暫存目錄下的 dpbot-images
+IMAGE_STORE_MAX_MB = float(os.getenv('IMAGE_STORE_MAX_MB', 200))
+IMAGE_STORE_MAX_FILES = int(os.getenv('IMAGE_STORE_MAX_FILES', 1000))
+IMAGE_MAX_FILE_MB = float(os.getenv('IMAGE_MAX_FILE_MB', 20))
+IMAGE_TTL = float(os.getenv('IMAGE_TTL', 3600))
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+IMAGE_QUEUE_SIZE = int(os.getenv('IMAGE_QUEUE_SIZE', 100))
+
+# DeepSeek 准入控制：等名額最多 ADMISSION_MAX_WAIT 秒；每位用戶每分鐘 USER_ASKS_PER_MIN 次（可累積 USER_ASK_BURST 次）
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', 2))
+USER_ASKS_PER_MIN = float(os.getenv('USER_ASKS_PER_MIN', 6))
+USER_ASK_BURST = int(os.getenv('USER_ASK_BURST', 3))
+# 進行中的呼叫超過上限的這個比例就降級：先縮短回答，再強制賣萌模式
+DEGRADE_REDUCED_AT = float(os.getenv('DEGRADE_REDUCED_AT', 0.5))
+DEGRADE_CASUAL_AT = float(os.getenv('DEGRADE_CASUAL_AT', 0.8))
+DEGRADE_TOKEN_RATIO = float(os.getenv('DEGRADE_TOKEN_RATIO', 0.5))
+
+# 已執行 sql/users_rpc.sql 才設 1：加好友用 follow_user RPC 一趟建立用戶 + 訂閱，其他寫入也靠該檔設定的欄位預設值只送變動欄位。
+# 沒設（或 RPC 不存在）時不依賴預設值，新建資料列自己帶 created_at / subscribed_at
+SUPABASE_RPC = os.getenv('SUPABASE_RPC', '0') == '1'
+
+# 專業 / 閒聊分流模型（選配，需要 NumPy）：權重檔用 bench/eval_classifier.py --train 產生
+CLASSIFIER_WEIGHTS = os.getenv('CLASSIFIER_WEIGHTS')  # 例如 data/classifier.npz；不設定就只用關鍵字規則
+CLASSIFIER_MIN_CONFIDENCE = float(os.getenv('CLASSIFIER_MIN_CONFIDENCE', 0.8))  # 機率落在 (1-x, x) 之間改用規則
+
+# ==================== Log ====================
+# JSON 一行一筆，背景 thread 寫出；DEBUG（逐則訊息）只取樣 LOG_DEBUG_SAMPLE 比例
+log_handler = setup_logging(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    debug_sample_rate=float(os.getenv('LOG_DEBUG_SAMPLE', 0.05)),
+    queue_size=int(os.getenv('LOG_QUEUE_SIZE', 10000))
+)
+log = get_logger('dpbot')
+
+# ==================== 指標（/metrics）====================
+METRICS = Registry()
+STAGE_SECONDS = METRICS.histogram('dpbot_stage_seconds', '各處理階段耗時（秒）', ('stage',))
+CLASSIFICATIONS = METRICS.counter('dpbot_classification_total', '文字訊息分流結果', ('route',))
+UPSTREAM_ERRORS = METRICS.counter('dpbot_upstream_errors_total', '上游錯誤次數', ('upstream', 'kind'))
+WEBHOOK_DUPLICATES = METRICS.counter('dpbot_webhook_duplicates_total', '被略過的重複 webhook 事件', ('event', 'redelivery'))
+PROFILE_TIMEOUTS = METRICS.counter('dpbot_profile_lookup_timeouts_total', '等用戶資料逾時、先不帶名字回答的次數')
+PROMPT_TOKENS = METRICS.counter('dpbot_deepseek_prompt_tokens_total', 'DeepSeek prompt token 數（是否命中 context cache）', ('mode', 'cache'))
+CLASSIFIER_DECISIONS = METRICS.counter('dpbot_classifier_decisions_total', '專業 / 閒聊分流由誰決定', ('source',))
+DUPLICATE_WORK_AVOIDED = METRICS.counter('dpbot_duplicate_work_avoided_total', '因去重而省下的昂貴呼叫', ('work',))
+
+def report_upstream_error(upstream, kind):
+    UPSTREAM_ERRORS.inc(upstream=upstream, kind=kind)
+
+# ==================== 對外 HTTP 連線池 ====================
+# 每個上游一組 keep-alive 連線池 + 斷路器；DeepSeek 掛掉時直接回罐頭訊息，不再卡 30 秒
+UPSTREAMS = {
+    "deepseek": Upstream("deepseek", max_concurrency=DEEPSEEK_MAX_CONCURRENCY, failure_threshold=5, reset_timeout=30, on_error=report_upstream_error),
+    "cwa": Upstream("cwa", max_concurrency=CWA_MAX_CONCURRENCY, retries=2, failure_threshold=3, reset_timeout=60, on_error=report_upstream_error),
+    "line": Upstream("line", max_concurrency=LINE_MAX_CONCURRENCY, failure_threshold=10, reset_timeout=15, on_error=report_upstream_error),
+}
+
 # ==================== 初始化各服務 ====================
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
+# client 都是第一次用到才建立、fork 之後各 worker 自己重建（gunicorn --preload 安全）
+def make_line_bot_api():
+    return LineBotApi(
+        LINE_CHANNEL_ACCESS_TOKEN,
+        endpoint=LINE_API_ENDPOINT,
+        data_endpoint=LINE_DATA_ENDPOINT,
+        http_client=make_line_http_client(UPSTREAMS["line"])
+    )
+
+line_bot_api = LazyClient(make_line_bot_api, name="line_bot_api")
+# 只做簽章驗證與事件分派，不連網路，匯入時就要有（handler.add 裝飾器）
 handler = WebhookHandler(LINE_CHANNEL_SECRET)
 
-# Supabase
-if SUPABASE_URL and SUPABASE_KEY:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    print("✅ Supabase 連線成功")
-else:
-    supabase = None
+# Supabase（supabase 套件本身匯入就很慢，也一起延後）
+def make_supabase():
+    from supabase import create_client
+    client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    log.info("✅ Supabase 連線成功", pid=os.getpid())
+    return client
 
-# DeepSeek
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+supabase = LazyClient(make_supabase, enabled=bool(SUPABASE_URL and SUPABASE_KEY), name="supabase")
+
+# 請求內的背景 I/O（目前是用戶資料查詢）；每個 process 各自一個
+io_pool = LazyClient(lambda: ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix='dpbot-io'), name="io_pool")
 
 # ==================== 圖片暫存區 ====================
-image_temp_store = {}
-pending_vision = {}
+# 圖片只落地到磁碟，記憶體裡只有路徑；之後接影像辨識時把 analyze_func 換成實際的分析函數
+image_store = ImageStore(
+    directory=IMAGE_DIR,
+    max_bytes=int(IMAGE_STORE_MAX_MB * 1024 * 1024),
+    max_files=IMAGE_STORE_MAX_FILES,
+    ttl=IMAGE_TTL,
+    max_file_bytes=int(IMAGE_MAX_FILE_MB * 1024 * 1024)
+)
+image_pipeline = ImagePipeline(
+    image_store,
+    lambda message_id: line_bot_api.get_message_content(message_id),
+    analyze_func=None,
+    workers=IMAGE_WORKERS,
+    maxsize=IMAGE_QUEUE_SIZE
+)
 
 # ==================== 蕨積賣萌圖片回覆庫 ====================
 SORRY_MESSAGES = [
@@ -62,6 +245,15 @@ SORRY_MESSAGES = [
     "🌿 葉子遮到眼睛了，看不到啦！"
 ]
 
+# DeepSeek 太忙或同一人問太快時，立刻回這些（不呼叫上游）
+BUSY_MESSAGES = [
+    "🌿 蕨積現在有點忙，喝口水再問我一次～",
+    "🌿 好多人在跟我聊天，等我一下下！",
+    "🌿 你問太快了啦，讓我的葉子喘口氣～",
+    "🌿 腦袋轉不過來了，晚點再問我好嗎？",
+    "🌿 光合作用中...稍等一下再來～"
+]
+
 # ==================== 天氣API設定 ====================
 CITY_MAPPING = {
     "基隆": "基隆市", "台北": "臺北市", "新北": "新北市", "桃園": "桃園市",
@@ -72,6 +264,41 @@ CITY_MAPPING = {
     "金門": "金門縣", "連江": "連江縣"
 }
 
+TAIPEI_TZ = timezone(timedelta(hours=8))
+
+def parse_cwa_time(value):
+    """CWA 時間字串（台灣時間）轉成 epoch 秒"""
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=TAIPEI_TZ).timestamp()
+
+def parse_cwa_location(location):
+    """從 F-C0032-001 的單一 location 取出目前時段天氣，以及這個時段結束的時間"""
+    weather_elements = location['weatherElement']
+    
+    weather_status = weather_elements[0]['time'][0]['parameter']['parameterName']
+    rain_prob = weather_elements[1]['time'][0]['parameter']['parameterName']
+    temp = weather_elements[2]['time'][0]['parameter']['parameterName']
+    expires_at = parse_cwa_time(weather_elements[0]['time'][0]['endTime'])
+    
+    return {
+        "success": True,
+        "city": location['locationName'],
+        "status": weather_status,
+        "temp": int(temp),
+        "rain_prob": int(rain_prob)
+    }, expires_at
+
+def fetch_cwa_weather(city_name):
+    """實際呼叫 CWA（只給 weather_cache 用）"""
+    url = f"{CWA_API_URL}?Authorization={os.getenv('CWA_API_KEY')}&format=JSON&locationName={city_name}"
+    response = UPSTREAMS["cwa"].get(url, timeout=10)
+    response.raise_for_status()
+    data = response.json()
+    return parse_cwa_location(data['records']['location'][0])
+
+# 預報每幾小時才更新一次，依時段結束時間過期；同城市同時只打一次 CWA
+weather_cache = WeatherCache(fetch_cwa_weather, max_stale=WEATHER_MAX_STALE)
+
+@STAGE_SECONDS.time(stage='get_weather')
 def get_weather(city):
     """從中央氣象局API取得天氣資料"""
     try:
@@ -108,28 +335,11 @@ def get_weather(city):
                     "rain_prob": 30
                 }
         
-        # 正式API呼叫（如果有金鑰）
-        url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-C0032-001?Authorization={os.getenv('CWA_API_KEY')}&format=JSON&locationName={city_name}"
-        response = requests.get(url, timeout=10)
-        data = response.json()
-        
-        location = data['records']['location'][0]
-        weather_elements = location['weatherElement']
-        
-        weather_status = weather_elements[0]['time'][0]['parameter']['parameterName']
-        rain_prob = weather_elements[1]['time'][0]['parameter']['parameterName']
-        temp = weather_elements[2]['time'][0]['parameter']['parameterName']
-        
-        return {
-            "success": True,
-            "city": city_name,
-            "status": weather_status,
-            "temp": int(temp),
-            "rain_prob": int(rain_prob)
-        }
+        # 正式API呼叫（如果有金鑰），走快取
+        return weather_cache.get(city_name)
         
     except Exception as e:
-        print(f"天氣API錯誤: {e}")
+        log.warning("天氣API錯誤", city=city, error=str(e))
         return {
             "success": False,
             "message": "天氣查詢失敗，可能是城市名稱不對喔"
@@ -194,55 +404,98 @@ CASUAL_PHRASES = [
     "天氣", "下雨", "熱", "冷", "颱風", "今天", "明天"
 ]
 
-def is_professional_question(text):
+QUESTION_MARKS = ["?", "？", "嗎", "呢"]
+QUESTION_WORDS = ["怎麼", "如何"]
+WEATHER_WORDS = ["天氣", "下雨", "澆水"]
+
+# 啟動時把所有關鍵字表編成同一個自動機，每則訊息只掃一遍
+KEYWORD_INDEX = KeywordIndex({
+    "weight": list(PROFESSIONAL_WEIGHTS),
+    "plant": PLANT_LIST,
+    "casual": CASUAL_PHRASES,
+    "question_mark": QUESTION_MARKS,
+    "question_word": QUESTION_WORDS,
+    "weather": WEATHER_WORDS,
+    "city": list(CITY_MAPPING)
+})
+CITY_ORDER = {c: i for i, c in enumerate(CITY_MAPPING)}
+KEYWORD_ORDER = {k: i for i, k in enumerate(PROFESSIONAL_WEIGHTS)}
+
+def scan_keywords(text):
+    """掃描一次，回傳各關鍵字表的命中結果"""
+    return KEYWORD_INDEX.scan(text)
+
+def find_city(text, hits=None):
+    """找出文字中的城市（同時命中時以 CITY_MAPPING 順序為準，例如「新竹」優先於「新竹縣」）"""
+    if hits is None:
+        hits = scan_keywords(text)
+    cities = hits.get("city")
+    if not cities:
+        return None
+    return min(cities, key=CITY_ORDER.__getitem__)
+
+def load_question_classifier():
+    if not CLASSIFIER_WEIGHTS:
+        return None
+    from classifier import load_classifier  # 只有設定權重檔時才匯入 NumPy
+    return load_classifier(CLASSIFIER_WEIGHTS)
+
+# 唯讀的小陣列，啟動時載入一次；gunicorn --preload 時各 worker 共用同一份
+question_classifier = load_question_classifier()
+
+def is_professional_by_rules(text, hits=None):
     """語意判斷：計算專業權重總分 - 隨便問也專業版"""
-    text_lower = text.lower()
+    if hits is None:
+        hits = scan_keywords(text)
     
     if len(text) <= 6:
-        for plant in PLANT_LIST:
-            if plant in text:
-                print(f"🌱 短句植物名觸發專業模式: {text}")
-                return True
+        if hits.get("plant"):
+            log.debug("🌱 短句植物名觸發專業模式", text=text)
+            return True
         return False
     
-    for phrase in CASUAL_PHRASES:
-        if phrase in text_lower and len(text) < 15:
-            return False
-    
-    total_weight = 0
-    matched_keywords = []
-    has_plant = False
+    if hits.get("casual") and len(text) < 15:
+        return False
     
-    for keyword, weight in PROFESSIONAL_WEIGHTS.items():
-        if keyword in text:
-            total_weight += weight
-            matched_keywords.append(f"{keyword}(+{weight})")
-            if weight >= 3 and keyword in PLANT_LIST:
-                has_plant = True
+    keywords = sorted(hits.get("weight", ()), key=KEYWORD_ORDER.__getitem__)
+    total_weight = sum(PROFESSIONAL_WEIGHTS[k] for k in keywords)
+    matched_keywords = [f"{k}(+{PROFESSIONAL_WEIGHTS[k]})" for k in keywords]
+    has_plant = any(PROFESSIONAL_WEIGHTS[k] >= 3 for k in hits.get("plant", ()))
     
     if matched_keywords:
-        print(f"🔍 命中關鍵字: {', '.join(matched_keywords)} | 總權重: {total_weight}")
+        log.debug("🔍 命中關鍵字", keywords=matched_keywords, total_weight=total_weight)
     
     if has_plant and total_weight >= 2:
-        print(f"✅ 專業模式 triggered (植物+症狀)")
+        log.debug("✅ 專業模式 triggered", rule="植物+症狀")
         return True
     if total_weight >= 3:
-        print(f"✅ 專業模式 triggered (權重總和: {total_weight})")
+        log.debug("✅ 專業模式 triggered", rule="權重總和", total_weight=total_weight)
         return True
-    if has_plant and total_weight >= 1 and any(q in text for q in ["?", "？", "嗎", "呢"]):
-        print(f"✅ 專業模式 triggered (植物+問句)")
+    if has_plant and total_weight >= 1 and hits.get("question_mark"):
+        log.debug("✅ 專業模式 triggered", rule="植物+問句")
         return True
-    if ("怎麼" in text or "如何" in text) and total_weight >= 1:
-        print(f"✅ 專業模式 triggered (疑問詞+關鍵字)")
+    if hits.get("question_word") and total_weight >= 1:
+        log.debug("✅ 專業模式 triggered", rule="疑問詞+關鍵字")
         return True
     
-    print(f"❌ 賣萌模式 (權重總和: {total_weight})")
+    log.debug("❌ 賣萌模式", total_weight=total_weight)
     return False
 
+def is_professional_question(text, hits=None):
+    """有分流模型就先問模型；模型沒把握（或沒載入）時照舊用關鍵字規則"""
+    if question_classifier is not None:
+        proba = float(question_classifier.predict_proba([text])[0])
+        if proba >= CLASSIFIER_MIN_CONFIDENCE or proba <= 1 - CLASSIFIER_MIN_CONFIDENCE:
+            CLASSIFIER_DECISIONS.inc(source='model')
+            log.debug("🧠 分流模型決定", proba=round(proba, 3))
+            return proba >= 0.5
+    CLASSIFIER_DECISIONS.inc(source='rules')
+    return is_professional_by_rules(text, hits)
+
 # ==================== 蕨積雙模式人設 ====================
-def get_professional_prompt(user_name=None):
-    name_part = f"用戶叫{user_name}，" if user_name else ""
-    return f"""你是「蕨積」，一位專業的植物學家。{name_part}用戶在問專業植物問題。
+# 固定的長指令在啟動時組好一次、放在最前面；名字和問題放最後。
+# 所有用戶送出的前綴一模一樣，DeepSeek 的 context cache 才能命中（命中的 token 便宜又快）
+PROFESSIONAL_PROMPT = """你是「蕨積」，一位專業的植物學家。用戶在問專業植物問題。
 
 【⚠️ 非常重要 - 必須遵守】
 🔥 1. 你現在是「植物學博士」，不是搞笑藝人
@@ -264,11 +517,11 @@ def get_professional_prompt(user_name=None):
 【鐵則】
 ❌ 禁止：哈哈、喔喔、耶、啦、吧、～、🌿、💚 等任何語氣詞和表情符號
 ✅ 必須：專業、冷靜、準確、有用
+
+【重要】你現在是植物學博士，請用極度專業、冷靜、準確的方式回答。禁止使用任何語氣詞、表情符號。回答必須包含原因、解法、預防。
 """
 
-def get_casual_prompt(user_name=None):
-    name_part = f"用戶叫{user_name}，" if user_name else ""
-    return f"""你是「蕨積」，一個幽默風趣的植物好朋友！{name_part}用戶在閒聊或問非專業問題。
+CASUAL_PROMPT = """你是「蕨積」，一個幽默風趣的植物好朋友！用戶在閒聊或問非專業問題。
 
 【核心指令】
 🔥 1. 字數「嚴格控制在30字內」！
@@ -278,147 +531,268 @@ def get_casual_prompt(user_name=None):
 
 【範例】
 用戶：今天好累
-蕨積：{f'{user_name}，' if user_name else ''}我也是，光合作用一整天了🌿
+蕨積：我也是，光合作用一整天了🌿
 """
 
+def build_messages(question, is_professional, user_name=None, history=None):
+    """[固定指令] → [用戶名字] → [前幾輪對話] → [本次問題]，越後面越常變"""
+    messages = [{"role": "system", "content": PROFESSIONAL_PROMPT if is_professional else CASUAL_PROMPT}]
+    if user_name:
+        messages.append({"role": "system", "content": f"用戶叫{user_name}。"})
+    messages.extend(history or [])
+    messages.append({"role": "user", "content": question})
+    return messages
+
 # ==================== DeepSeek 呼叫 ====================
-def ask_deepseek(question, user_name=None, is_professional=False):
+DEEPSEEK_ERROR_REPLY = "🌿 葉子被風吹亂了"
+
+# 專業模式 temperature 很低，同一題答案幾乎一樣 → 以正規化後的問題快取（不含名字）
+answer_cache = AnswerCache(maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, sqlite_path=ANSWER_CACHE_DB,
+                           disk_max_rows=ANSWER_CACHE_DISK_ROWS)
+deepseek_latency = LatencyStats()
+
+def make_conversation_store():
+    if CONVERSATION_BACKEND == 'supabase' and supabase:
+        return SupabaseConversationStore(supabase)
+    if CONVERSATION_BACKEND == 'sqlite':
+        return SQLiteConversationStore(CONVERSATION_DB)
+    return None
+
+conversation = ConversationMemory(
+    max_turns=CONVERSATION_TURNS,
+    maxsize=CONVERSATION_USERS,
+    ttl=CONVERSATION_TTL,
+    store=make_conversation_store()
+)
+
+# 全域名額與 DeepSeek 連線池同大小；一個人狂刷或流量暴增時，其他人的延遲仍有上限
+admission = AdmissionController(
+    max_concurrency=DEEPSEEK_MAX_CONCURRENCY,
+    max_wait=ADMISSION_MAX_WAIT,
+    user_rate=USER_ASKS_PER_MIN / 60,
+    user_burst=USER_ASK_BURST,
+    reduced_at=DEGRADE_REDUCED_AT,
+    casual_at=DEGRADE_CASUAL_AT
+)
+
+def ask_deepseek(question, user_name=None, is_professional=False, user_id=None):
+    stage = 'ask_deepseek_professional' if is_professional else 'ask_deepseek_casual'
+    with STAGE_SECONDS.time(stage=stage):
+        return _ask_deepseek(question, user_name, is_professional, user_id)
+
+def _ask_deepseek(question, user_name, is_professional, user_id=None):
+    """user_name 也可以傳函數：賣萌模式送出前才呼叫，專業模式等答案回來才呼叫（查名字和 DeepSeek 重疊）"""
+    resolve_name = user_name if callable(user_name) else (lambda: user_name)
     if not DEEPSEEK_API_KEY:
         return "🌿 蕨積去曬太陽了"
     
+    history = conversation.history(user_id, CONVERSATION_TOKENS_PROFESSIONAL if is_professional else CONVERSATION_TOKENS_CASUAL)
+    # 有前文時答案取決於上下文，只有沒有歷史的專業問題才查快取；快取命中不佔名額
+    key = normalize_question(question) if is_professional and not history else None
+    answer = answer_cache.get(key) if key else None
+    if answer is not None:
+        log.debug("💾 專業回答快取命中", key=key[:30])
+    else:
+        with admission.admit(user_id) as ticket:
+            if ticket.tier == TIER_CANNED:
+                log.info("🚦 DeepSeek 忙碌，回罐頭訊息", user_id=user_id, reason=ticket.reason)
+                return random.choice(BUSY_MESSAGES)
+            if ticket.tier == TIER_CASUAL and is_professional:
+                log.info("🚦 負載高，專業問題改用賣萌模式", user_id=user_id)
+                is_professional, key = False, None
+                history = conversation.history(user_id, CONVERSATION_TOKENS_CASUAL)
+            ratio = DEGRADE_TOKEN_RATIO if ticket.tier in (TIER_REDUCED, TIER_CASUAL) else 1
+            
+            if is_professional:
+                answer = call_deepseek(question, None, True, max_tokens=int(400 * ratio), history=history)
+            else:
+                answer = call_deepseek(question, resolve_name(), False, max_tokens=int(100 * ratio), history=history)
+            if answer is None:
+                return DEEPSEEK_ERROR_REPLY
+            if key and ratio == 1:
+                answer_cache.set(key, answer)
+    conversation.append(user_id, question, answer)
+    if not is_professional:
+        return answer
+    # 名字在查完快取之後才加上
+    user_name = resolve_name()
+    return f"{user_name}，{answer}" if user_name else answer
+
+def record_prompt_cache(mode, usage):
+    """記錄 DeepSeek 回傳的 prompt_cache_hit_tokens / prompt_cache_miss_tokens"""
+    if not usage:
+        return
+    PROMPT_TOKENS.inc(usage.get('prompt_cache_hit_tokens') or 0, mode=mode, cache='hit')
+    PROMPT_TOKENS.inc(usage.get('prompt_cache_miss_tokens') or 0, mode=mode, cache='miss')
+
+def call_deepseek(question, user_name=None, is_professional=False, max_tokens=None, history=None):
+    """實際呼叫 DeepSeek；history 是先前幾輪的 messages；失敗回傳 None"""
     headers = {
         'Authorization': f'Bearer {DEEPSEEK_API_KEY}',
         'Content-Type': 'application/json'
     }
     
     if is_professional:
-        forced_question = f"""【重要】你現在是植物學博士，請用極度專業、冷靜、準確的方式回答。禁止使用任何語氣詞、表情符號。回答必須包含原因、解法、預防。
-
-問題：{question}"""
-        system_prompt = get_professional_prompt(user_name)
         data = {
             "model": "deepseek-chat",
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": forced_question}
-            ],
-            "max_tokens": 400,
+            "messages": build_messages(question, True, user_name, history),
+            "max_tokens": max_tokens or 400,
             "temperature": 0.1,
             "top_p": 0.1
         }
-        print(f"🔬 專業模式 - 問題: {question[:30]}...")
+        log.debug("🔬 專業模式", question=question[:30])
     else:
-        system_prompt = get_casual_prompt(user_name)
         data = {
             "model": "deepseek-chat",
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": question}
-            ],
-            "max_tokens": 100,
+            "messages": build_messages(question, False, user_name, history),
+            "max_tokens": max_tokens or 100,
             "temperature": 0.9
         }
-        print(f"😊 賣萌模式 - 問題: {question[:30]}...")
+        log.debug("😊 賣萌模式", question=question[:30])
     
+    mode = "professional" if is_professional else "casual"
+    started_at = time.monotonic()
     try:
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, json=data, timeout=30)
+        if DEEPSEEK_STREAM:
+            data["stream"] = True
+            data["stream_options"] = {"include_usage": True}
+            budget = PROFESSIONAL_CHAR_BUDGET if is_professional else CASUAL_CHAR_BUDGET
+            usage = {}
+            response = UPSTREAMS["deepseek"].post(DEEPSEEK_API_URL, headers=headers, json=data, timeout=30, stream=True)
+            try:
+                response.raise_for_status()
+                answer, ttft, cut_early = read_stream(response, budget, started_at=started_at, usage=usage)
+            finally:
+                # 提前切斷時關掉連線，上游就不會繼續生成（這時拿不到 usage）
+                response.close()
+            deepseek_latency.record(mode, ttft, time.monotonic() - started_at, cut_early)
+            record_prompt_cache(mode, usage)
+            return answer or None
+        response = UPSTREAMS["deepseek"].post(DEEPSEEK_API_URL, headers=headers, json=data, timeout=30)
         response.raise_for_status()
         result = response.json()
+        total = time.monotonic() - started_at
+        deepseek_latency.record(mode, total, total)
+        record_prompt_cache(mode, result.get('usage'))
         return result['choices'][0]['message']['content'].strip()
     except Exception as e:
-        print(f"DeepSeek錯誤: {e}")
-        return "🌿 葉子被風吹亂了"
+        log.warning("DeepSeek錯誤", error=str(e), mode=mode)
+        UPSTREAM_ERRORS.inc(upstream='deepseek', kind=type(e).__name__)
+        return None
 
 # ==================== 用戶管理（含名字）====================
+# users / subscribers 每個操作都是一個 upsert（或 RPC），不先查再寫
+users_repo = UserRepository(supabase, use_rpc=SUPABASE_RPC)
+
+# user_id -> users 資料列；名字、城市寫入時同步更新（write-through）
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+@STAGE_SECONDS.time(stage='get_or_create_user')
 def get_or_create_user(user_id):
     if not supabase:
         return None
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return dict(cached)
     try:
-        result = supabase.table('users').select('*').eq('user_id', user_id).execute()
-        if result.data:
-            return result.data[0]
-        else:
-            new_user = {
-                'user_id': user_id,
-                'user_name': None,
-                'city': None,
-                'created_at': datetime.now(timezone.utc).isoformat(),
-                'last_active': datetime.now(timezone.utc).isoformat()
-            }
-            supabase.table('users').insert(new_user).execute()
-            return new_user
+        user = users_repo.get_or_create(user_id)
+        if user is None:
+            return None
+        user_cache.set(user_id, user)
+        return dict(user)
     except Exception as e:
-        print(f"用戶查詢失敗: {e}")
+        log.warning("用戶查詢失敗", user_id=user_id, error=str(e))
         return None
 
 def update_user_name(user_id, name):
     if not supabase:
         return False
     try:
-        supabase.table('users').update({'user_name': name}).eq('user_id', user_id).execute()
+        users_repo.update(user_id, {'user_name': name})
+        user_cache.update(user_id, {'user_name': name})
         return True
     except Exception as e:
-        print(f"更新名字失敗: {e}")
+        user_cache.pop(user_id)
+        log.warning("更新名字失敗", user_id=user_id, error=str(e))
         return False
 
 def update_user_city(user_id, city):
     if not supabase:
         return False
     try:
-        supabase.table('users').update({'city': city}).eq('user_id', user_id).execute()
+        users_repo.update(user_id, {'city': city})
+        user_cache.update(user_id, {'city': city})
         return True
     except Exception as e:
-        print(f"更新城市失敗: {e}")
+        user_cache.pop(user_id)
+        log.warning("更新城市失敗", user_id=user_id, error=str(e))
         return False
 
+@STAGE_SECONDS.time(stage='flush_last_active')
+def flush_last_active(rows):
+    """一次寫回多位用戶的 last_active（只更新已存在的用戶）"""
+    users_repo.touch_many(rows)
+
+last_active_buffer = LastActiveBuffer(
+    flush_last_active,
+    max_pending=LAST_ACTIVE_FLUSH_SIZE,
+    interval=LAST_ACTIVE_FLUSH_INTERVAL
+)
+atexit.register(last_active_buffer.close)
+
+@STAGE_SECONDS.time(stage='update_last_active')
 def update_last_active(user_id):
+    """只記在記憶體，由 last_active_buffer 定期批次寫回"""
     if not supabase:
         return
-    try:
-        supabase.table('users').update({
-            'last_active': datetime.now(timezone.utc).isoformat()
-        }).eq('user_id', user_id).execute()
-    except:
-        pass
+    now = datetime.now(timezone.utc).isoformat()
+    last_active_buffer.touch(user_id, now)
+    user_cache.update(user_id, {'last_active': now})
 
 # ==================== 訂閱管理 ====================
 def subscribe_user(user_id):
     if not supabase: return False
     try:
-        existing = supabase.table('subscribers').select('*').eq('user_id', user_id).execute()
-        if not existing.data:
-            data = {
-                'user_id': user_id,
-                'subscribed_at': datetime.now(timezone.utc).isoformat(),
-                'last_push_date': None,
-                'is_active': True
-            }
-            supabase.table('subscribers').insert(data).execute()
-            print(f"✅ 新訂閱: {user_id}")
-        else:
-            supabase.table('subscribers').update({'is_active': True}).eq('user_id', user_id).execute()
-            print(f"✅ 重新訂閱: {user_id}")
+        users_repo.subscribe(user_id)
+        log.info("✅ 訂閱", user_id=user_id)
+        return True
+    except Exception as e:
+        log.warning("訂閱失敗", user_id=user_id, error=str(e))
+        return False
+
+def follow_user(user_id):
+    """加好友：建立用戶 + 訂閱（RPC 一趟或兩個 upsert），順便把用戶資料放進快取"""
+    if not supabase: return False
+    try:
+        # 快取裡已有資料列（例如封鎖後再加回）就不必再建用戶
+        user = users_repo.follow(user_id, create_user=user_cache.get(user_id) is None)
+        if user:
+            user_cache.set(user_id, user)
+        log.info("✅ 新好友訂閱", user_id=user_id)
         return True
     except Exception as e:
-        print(f"訂閱失敗: {e}")
+        log.warning("加好友訂閱失敗", user_id=user_id, error=str(e))
         return False
 
 def unsubscribe_user(user_id):
     if not supabase: return False
     try:
-        supabase.table('subscribers').update({'is_active': False}).eq('user_id', user_id).execute()
-        print(f"❌ 取消訂閱: {user_id}")
+        users_repo.unsubscribe(user_id)
+        log.info("❌ 取消訂閱", user_id=user_id)
         return True
     except Exception as e:
-        print(f"取消訂閱失敗: {e}")
+        log.warning("取消訂閱失敗", user_id=user_id, error=str(e))
         return False
 
 # ==================== 每日小知識 ====================
-def get_daily_plant_fact():
-    fact_prompt = """給一則「20字內」的搞笑植物知識。
+DEFAULT_PLANT_FACT = "香蕉是莓果，草莓不是。植物界也搞詐欺🍌"
+
+def get_plant_fact_pool(count=PUSH_FACT_POOL_SIZE):
+    """一次請 DeepSeek 產生多則候選知識，過濾掉格式不對的"""
+    fact_prompt = f"""給{count}則「20字內」的搞笑植物知識，一行一則，不要編號。
 範例：
-「香蕉是莓果，草莓不是。植物界也搞詐欺🍌」
-「蘆薈晚上吐氧氣，比咖啡提神🌵」"""
+香蕉是莓果，草莓不是。植物界也搞詐欺🍌
+蘆薈晚上吐氧氣，比咖啡提神🌵"""
     headers = {
         'Authorization': f'Bearer {DEEPSEEK_API_KEY}',
         'Content-Type': 'application/json'
@@ -426,145 +800,417 @@ def get_daily_plant_fact():
     data = {
         "model": "deepseek-chat",
         "messages": [{"role": "user", "content": fact_prompt}],
-        "max_tokens": 100,
+        "max_tokens": 60 * count,
         "temperature": 0.9
     }
     try:
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, json=data, timeout=30)
-        return response.json()['choices'][0]['message']['content'].strip()
-    except:
-        return "香蕉是莓果，草莓不是。植物界也搞詐欺🍌"
+        response = UPSTREAMS["deepseek"].post(DEEPSEEK_API_URL, headers=headers, json=data, timeout=30)
+        content = response.json()['choices'][0]['message']['content']
+    except Exception as e:
+        log.warning("⚠️ 產生每日知識失敗", error=str(e))
+        return []
+    facts = []
+    for line in content.splitlines():
+        fact = re.sub(r"^\s*(\d+[.、)）]|[-•*])\s*", "", line).strip().strip("「」\"")
+        # 太短、太長、沒有中文的都不要
+        if 5 <= len(fact) <= 40 and re.search(r"[\u4e00-\u9fff]", fact) and fact not in facts:
+            facts.append(fact)
+    return facts
+
+# ==================== 推播預備（07:30 先把內容準備好）====================
+def fetch_all_weather():
+    """一次取得所有城市天氣（CWA 不帶 locationName 會回傳全部縣市），順便填進 weather_cache"""
+    if not os.getenv('CWA_API_KEY'):
+        return {city: get_weather(city) for city in CITY_MAPPING}
+    url = f"{CWA_API_URL}?Authorization={os.getenv('CWA_API_KEY')}&format=JSON"
+    response = UPSTREAMS["cwa"].get(url, timeout=20)
+    response.raise_for_status()
+    short_names = {full: short for short, full in CITY_MAPPING.items()}
+    result = {}
+    for location in response.json()['records']['location']:
+        data, expires_at = parse_cwa_location(location)
+        weather_cache.put(location['locationName'], data, expires_at)
+        short = short_names.get(location['locationName'])
+        if short:
+            result[short] = data
+    return result
+
+def build_push_payload():
+    """產生今天要推播的內容（JSON 字串）：一則知識 + 各城市版本"""
+    facts = get_plant_fact_pool()
+    fact = random.choice(facts) if facts else DEFAULT_PLANT_FACT
+    default_text = f"🌱 **蕨積早安**\n\n{fact}"
+    cities = {}
+    if PUSH_PER_CITY:
+        try:
+            for city, weather in fetch_all_weather().items():
+                if weather.get('success'):
+                    cities[city] = f"{default_text}\n\n{city}今天{weather['status']}，{weather['temp']}度，降雨機率{weather['rain_prob']}%\n{get_watering_advice(weather)}"
+        except Exception as e:
+            log.warning("⚠️ 推播天氣預備失敗，改用不含天氣的版本", error=str(e))
+    log.info("🌱 今日知識", fact=fact, candidates=len(facts), city_variants=len(cities))
+    return json.dumps({
+        "fact": fact,
+        "facts": facts,
+        "default": default_text,
+        "cities": cities,
+        "staged_at": datetime.now(timezone.utc).isoformat()
+    }, ensure_ascii=False)
+
+def push_payload_job():
+    # 以台灣日期為準：07:30 預備和 08:00 推播是同一天
+    return f"daily_payload:{datetime.now(TAIPEI_TZ).date().isoformat()}"
+
+def stage_daily_push():
+    """07:30 預備推播內容；只有一個 worker 會真的去產生，其他人共用"""
+    job = push_payload_job()
+
+    def stage(shard, bounds, lease):
+        push_leases.shared_payload(job, build_push_payload)
+
+    try:
+        run_sharded(push_leases, job.replace("daily_payload", "daily_stage"), 1, stage, lease_seconds=PUSH_LEASE_SECONDS)
+        log.info("✅ 推播內容已預備", job=job)
+    except Exception:
+        log.exception("❌ 推播預備失敗", job=job)
 
 # ==================== 修正後的推播函數 ====================
+def make_lease_backend():
+    if PUSH_LEASE_BACKEND == 'supabase' and supabase:
+        return SupabaseLeaseBackend(supabase)
+    if SCHEDULER_ENABLED:
+        # SQLite / 記憶體租約只看得到同一台機器（或同一個 process），多台機器各自都會推播一次
+        log.warning("⚠️ 推播租約未使用 Supabase，多台機器部署會重複推播；請設定 PUSH_LEASE_BACKEND=supabase",
+                    backend=PUSH_LEASE_BACKEND, supabase=bool(supabase))
+    if PUSH_LEASE_BACKEND == 'sqlite':
+        return SQLiteLeaseBackend(PUSH_LEASE_DB)
+    return SQLiteLeaseBackend()
+
+push_leases = make_lease_backend()
+
 def send_daily_push():
-    """發送每日推播給所有訂閱用戶（修正：先取所有活躍用戶，再手動過濾）"""
+    """發送每日推播：各 worker 以租約領取 user_id 分片，做完一片再領下一片"""
     if not supabase:
-        print("❌ Supabase 未連線，無法推播")
+        log.error("❌ Supabase 未連線，無法推播")
         return
 
     today = datetime.now(timezone.utc).date().isoformat()
-    print(f"🔍 今天的日期 (UTC): {today}")
+    job = f"daily_push:{today}"
+    log.info("🔍 開始每日推播", date=today, job=job)
 
     try:
-        # 先取得所有 is_active = true 的用戶
-        print("🔍 執行查詢: is_active=True")
-        response = supabase.table('subscribers')\
-            .select('*')\
-            .eq('is_active', True)\
-            .execute()
-        
-        all_active = response.data
-        print(f"🔍 所有活躍用戶: {all_active}")
+        # 07:30 已預備好的內容；沒有的話（例如預備失敗）現在補做，所有 worker 共用同一份
+        payload = json.loads(push_leases.shared_payload(push_payload_job(), build_push_payload))
+        log.info("🌱 今日知識", fact=payload['fact'])
+
+        def process_shard(shard, bounds, lease):
+            push_shard(today, payload, shard, bounds, lease)
+
+        shards = run_sharded(push_leases, job, PUSH_SHARDS, process_shard, lease_seconds=PUSH_LEASE_SECONDS)
+        log.info("📊 本 worker 推播完成", shards=shards, shard_count=len(shards))
+    except Exception:
+        log.exception("❌ 推播處理時發生例外", job=job)
+
+def _missing_relation(error):
+    """PostgREST 找不到表 / view（42P01 / PGRST205）：多半是還沒執行對應的 sql 檔"""
+    code = getattr(error, "code", None)
+    return code in ("42P01", "PGRST205") or "42P01" in str(error) or "PGRST205" in str(error)
+
+# push_recipients view（sql/push_recipients.sql）是否可用；不存在時改回逐批查 users
+push_recipients_view = True
 
-        # 手動過濾掉 last_push_date == today 的用戶
-        subscribers = [user for user in all_active if user.get('last_push_date') != today]
-        print(f"🔍 過濾後應推播用戶: {subscribers}")
+def group_by_city(rows, cities):
+    """依城市分組；沒設定城市或沒有天氣資料的放在 None
 
-        if not subscribers:
-            print("📭 今天沒有需要推播的用戶（過濾後為空）")
+    掃描時已經從 push_recipients 帶回 city 的不必再查；沒帶的（view 不存在）才每 500 人查一次 users
+    """
+    city_of = {row['user_id']: row.get('city') for row in rows if 'city' in row}
+    missing = [row['user_id'] for row in rows if 'city' not in row]
+    for i in range(0, len(missing), 500):
+        chunk = missing[i:i + 500]
+        for row in supabase.table('users').select('user_id,city').in_('user_id', chunk).execute().data:
+            city_of[row['user_id']] = row.get('city')
+    groups = {}
+    for row in rows:
+        city = city_of.get(row['user_id'])
+        groups.setdefault(city if city in cities else None, []).append(row['user_id'])
+    return groups
+
+def iter_subscriber_pages(today, lo=None, hi=None, after=None, page_size=PUSH_PAGE_SIZE, with_city=False):
+    """依 user_id 由小到大逐頁讀出今天還沒推播的活躍訂閱者（keyset 分頁）
+
+    每頁是 [{'user_id': ...}]；with_city=True 時改讀 push_recipients view，城市跟著同一頁回來
+    """
+    global push_recipients_view
+    with_city = with_city and push_recipients_view
+    while True:
+        # requirements 釘住的 postgrest-py 沒有 .or_()，用 or_filter 加 or=(...) 參數
+        query = or_filter(supabase.table('push_recipients' if with_city else 'subscribers')
+                          .select('user_id,city' if with_city else 'user_id')
+                          .eq('is_active', True),
+                          f'last_push_date.is.null,last_push_date.neq.{today}')
+        if after:
+            query = query.gt('user_id', after)
+        elif lo:
+            query = query.gte('user_id', lo)
+        if hi:
+            query = query.lt('user_id', hi)
+        try:
+            rows = query.order('user_id').limit(page_size).execute().data
+        except Exception as e:
+            if not (with_city and _missing_relation(e)):
+                raise
+            push_recipients_view = with_city = False
+            log.warning("⚠️ push_recipients view 不存在，改為每批查詢 users 城市（請執行 sql/push_recipients.sql）",
+                        error=str(e))
+            continue
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
             return
+        after = rows[-1]['user_id']
 
-        daily_fact = get_daily_plant_fact()
-        print(f"🌱 今日知識: {daily_fact}")
+def push_batch(today, payload, rows, lease, totals):
+    """推播一批用戶（依城市分組），成功的批次更新 last_push_date"""
+    def mark_pushed(ids):
+        # 每批一次 in_() 更新 last_push_date
+        supabase.table('subscribers')\
+            .update({'last_push_date': today})\
+            .in_('user_id', ids)\
+            .execute()
 
-        success_count = 0
-        for sub in subscribers:
-            user_id = sub['user_id']
-            last_push = sub.get('last_push_date')
-            print(f"👉 準備推播給 {user_id} (last_push_date={last_push})")
+    if payload['cities']:
+        groups = group_by_city(rows, payload['cities'])
+    else:
+        groups = {None: [row['user_id'] for row in rows]}
 
-            try:
-                line_bot_api.push_message(
-                    user_id,
-                    TextSendMessage(text=f"🌱 **蕨積早安**\n\n{daily_fact}")
-                )
-                update_result = supabase.table('subscribers')\
-                    .update({'last_push_date': today})\
-                    .eq('user_id', user_id)\
-                    .execute()
-                print(f"✅ 推播成功，已更新 last_push_date: {update_result.data}")
-                success_count += 1
-            except Exception as e:
-                print(f"❌ 推播失敗 {user_id}: {e}")
-
-        print(f"📊 推播完成：成功 {success_count} / 總共 {len(subscribers)}")
-    except Exception as e:
-        print(f"❌ 推播處理時發生例外: {e}")
+    for city, ids in groups.items():
+        text = payload['cities'][city] if city else payload['default']
+        result = multicast_fanout(
+            line_bot_api,
+            ids,
+            TextSendMessage(text=text),
+            on_delivered=mark_pushed,
+            concurrency=PUSH_CONCURRENCY,
+            rate_per_sec=PUSH_RATE_PER_SEC,
+            should_continue=lambda: not lease.lost
+        )
+        totals['sent'] += result['sent']
+        totals['failed'] += len(result['failed'])
+        totals['requests'] += result['requests']
+        totals['retries'] += result['retries']
+
+def push_shard(today, payload, shard, bounds, lease):
+    """推播單一分片（user_id 落在 [lo, hi) 的活躍訂閱者）
+
+    一次只在記憶體放一批；每批送完把最後一個 user_id 記成 cursor，
+    當掉或被別的 worker 接手時從 cursor 之後繼續，不必重掃整個分片
+    """
+    lo, hi = bounds
+    log.info("🔍 開始推播分片", shard=shard, lo=lo, hi=hi, cursor=lease.cursor)
+    totals = {'scanned': 0, 'pages': 0, 'sent': 0, 'failed': 0, 'requests': 0, 'retries': 0}
+    batch = []
+    # 有城市版本時，城市在掃描時一起讀回（07:30 只預備內容，08:00 不再每批查 users）
+    pages = iter_subscriber_pages(today, lo, hi, after=lease.cursor, with_city=bool(payload['cities']))
+    for page in pages:
+        totals['pages'] += 1
+        totals['scanned'] += len(page)
+        batch.extend(page)
+        if len(batch) >= PUSH_BATCH_SIZE:
+            push_batch(today, payload, batch, lease, totals)
+            lease.checkpoint(batch[-1]['user_id'])
+            batch = []
+    if batch:
+        push_batch(today, payload, batch, lease, totals)
+        lease.checkpoint(batch[-1]['user_id'])
+
+    if not totals['scanned']:
+        log.info("📭 分片沒有需要推播的用戶", shard=shard)
+        return
+    if totals['failed']:
+        log.warning("⚠️ 重試後仍有用戶推播失敗，明天會再推播", shard=shard, failed=totals['failed'])
+    log.info("📊 分片推播完成", shard=shard, **totals)
 
 # ==================== 排程器 ====================
 def init_scheduler():
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.triggers.cron import CronTrigger
+    import pytz
     scheduler = BackgroundScheduler()
     tz = pytz.timezone('Asia/Taipei')
+    scheduler.add_job(func=stage_daily_push, trigger=CronTrigger(hour=7, minute=30, timezone=tz), id='daily_push_stage', replace_existing=True)
     scheduler.add_job(func=send_daily_push, trigger=CronTrigger(hour=8, minute=0, timezone=tz), id='daily_push', replace_existing=True)
     scheduler.start()
-    print("✅ 排程器已啟動，每天 08:00 推播")
+    log.info("✅ 排程器已啟動，每天 07:30 預備、08:00 推播", pid=os.getpid())
     atexit.register(lambda: scheduler.shutdown())
     return scheduler
 
+# ==================== 回覆（reply token 過期改 push）====================
+reply_stats = {"reply": 0, "push_fallback": 0}
+
+def reply_or_push(event, message):
+    """優先用 reply；事件在佇列待太久或 token 失效時改用 push_message"""
+    age = time.time() - event.timestamp / 1000 if event.timestamp else 0
+    user_id = event.source.user_id
+    if age < REPLY_TOKEN_TTL or not user_id:
+        try:
+            with STAGE_SECONDS.time(stage='reply_message'):
+                line_bot_api.reply_message(event.reply_token, message)
+            reply_stats["reply"] += 1
+            return
+        except LineBotApiError as e:
+            if e.status_code != 400 or not user_id:
+                raise
+            log.warning("⚠️ reply token 失效，改用 push", user_id=user_id, error=str(e))
+    else:
+        log.warning("⏰ reply token 可能過期，改用 push", user_id=user_id, age=round(age, 1))
+    with STAGE_SECONDS.time(stage='push_message'):
+        line_bot_api.push_message(user_id, message)
+    reply_stats["push_fallback"] += 1
+
 # ==================== LINE Webhook ====================
+webhook_dispatcher = OrderedDispatcher(handler, max_workers=WEBHOOK_DISPATCH_WORKERS, deadline=WEBHOOK_BODY_DEADLINE)
+
+@STAGE_SECONDS.time(stage='process_webhook')
+def process_webhook(body, signature):
+    """驗簽、解析後交給 dispatcher（取代 handler.handle 的逐一處理）"""
+    payload = handler.parser.parse(body, signature, as_payload=True)
+    webhook_dispatcher.dispatch(payload.events, payload.destination)
+
+event_queue = EventQueue(
+    process_webhook,
+    maxsize=WEBHOOK_QUEUE_SIZE,
+    workers=WEBHOOK_WORKERS,
+    sqlite_path=WEBHOOK_QUEUE_DB
+)
+
+def make_event_deduper():
+    if WEBHOOK_DEDUPE_BACKEND == 'supabase' and supabase:
+        store = SupabaseEventStore(supabase)
+    elif WEBHOOK_DEDUPE_BACKEND == 'sqlite':
+        store = SQLiteEventStore(WEBHOOK_DEDUPE_DB, ttl=WEBHOOK_DEDUPE_TTL)
+    else:
+        store = None
+    return EventDeduper(ttl=WEBHOOK_DEDUPE_TTL, maxsize=WEBHOOK_DEDUPE_SIZE, store=store)
+
+webhook_dedupe = make_event_deduper()
+
+def deduplicated(func):
+    """同一個 webhookEventId 只處理一次；LINE 重送的事件在碰任何上游之前就略過"""
+    @functools.wraps(func)
+    def wrapper(event):
+        event_id = getattr(event, 'webhook_event_id', None)
+        if not event_id:
+            return func(event)
+        delivery_context = getattr(event, 'delivery_context', None)
+        redelivery = bool(getattr(delivery_context, 'is_redelivery', False))
+        if not webhook_dedupe.claim(event_id, redelivery):
+            WEBHOOK_DUPLICATES.inc(event=type(event).__name__, redelivery=str(redelivery).lower())
+            work = webhook_dedupe.work(event_id)
+            if work:
+                DUPLICATE_WORK_AVOIDED.inc(work=work)
+            log.info("🔁 略過重複事件", event_id=event_id, redelivery=redelivery, work=work)
+            return
+        try:
+            return func(event)
+        except Exception:
+            webhook_dedupe.release(event_id)
+            raise
+    return wrapper
+
 @app.route("/callback", methods=['POST'])
 def callback():
     signature = request.headers.get('X-Line-Signature', '')
     body = request.get_data(as_text=True)
     try:
-        handler.handle(body, signature)
+        if ASYNC_WEBHOOK:
+            # 簽章在請求內驗證，事件丟給背景 worker，馬上回 200
+            if not handler.parser.signature_validator.validate(body, signature):
+                raise InvalidSignatureError(f"Invalid signature. signature={signature}")
+            if not event_queue.submit(body, signature):
+                log.warning("⚠️ Webhook 佇列已滿，改為同步處理")
+                process_webhook(body, signature)
+        else:
+            process_webhook(body, signature)
     except InvalidSignatureError:
         abort(400)
     return 'OK', 200
 
 # ==================== 好友事件 ====================
 @handler.add(FollowEvent)
+@deduplicated
 def handle_follow(event):
     user_id = event.source.user_id
     if supabase:
-        get_or_create_user(user_id)
-        subscribe_user(user_id)
+        follow_user(user_id)
     welcome_msg = "🌿 蕨積來啦！\n\n跟我說你的名字和城市，這樣我能：\n✅ 叫你名字聊天\n✅ 給你天氣澆水建議\n\n直接說「我叫XXX」或「我在台北」就可以囉！"
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=welcome_msg))
+    reply_or_push(event, TextSendMessage(text=welcome_msg))
 
 @handler.add(UnfollowEvent)
+@deduplicated
 def handle_unfollow(event):
+    conversation.clear(event.source.user_id)
     if supabase:
         unsubscribe_user(event.source.user_id)
 
 # ==================== 圖片訊息處理 ====================
 @handler.add(MessageEvent, message=ImageMessage)
+@deduplicated
 def handle_image_message(event):
     user_id = event.source.user_id
-    reply_token = event.reply_token
     try:
+        queued = image_pipeline.submit(user_id, event.message.id)
         reply_text = random.choice(SORRY_MESSAGES)
-        line_bot_api.reply_message(reply_token, TextSendMessage(text=reply_text))
+        reply_or_push(event, TextSendMessage(text=reply_text))
         if supabase:
             update_last_active(user_id)
-        print(f"📸 用戶 {user_id} 傳了圖片")
-    except Exception as e:
-        print(f"圖片處理失敗: {e}")
-        line_bot_api.reply_message(reply_token, TextSendMessage(text="🌿 圖片處理失敗，再試一次？"))
+        log.info("📸 用戶傳了圖片", user_id=user_id, message_id=event.message.id, queued=queued)
+    except Exception:
+        log.exception("圖片處理失敗", user_id=user_id)
+        reply_or_push(event, TextSendMessage(text="🌿 圖片處理失敗，再試一次？"))
 
 # ==================== 文字訊息處理 ====================
 @handler.add(MessageEvent, message=TextMessage)
+@deduplicated
+@STAGE_SECONDS.time(stage='handle_text_message')
 def handle_text_message(event):
     user_message = event.message.text.strip()
-    reply_token = event.reply_token
     user_id = event.source.user_id
     
-    user_data = None
-    user_name = None
+    # 用戶資料在背景查（快取沒中才要跑一趟 Supabase），同時做下面的指令判斷與分類
+    profile = io_pool.submit(get_or_create_user, user_id) if supabase else None
     if supabase:
-        user_data = get_or_create_user(user_id)
-        user_name = user_data.get('user_name') if user_data else None
-        update_last_active(user_id)
+        update_last_active(user_id)  # 只寫記憶體，由 last_active_buffer 批次寫回，不會卡住
+    
+    def wait_profile(timeout=None):
+        if profile is None:
+            return None
+        with STAGE_SECONDS.time(stage='profile_wait'):
+            try:
+                return profile.result(timeout=timeout)
+            except FutureTimeout:
+                PROFILE_TIMEOUTS.inc()
+                log.info("⏱️ 用戶資料查詢逾時，先不帶名字", user_id=user_id, timeout=timeout)
+                return None
+    
+    def user_name_or_none():
+        user_data = wait_profile(NAME_LOOKUP_TIMEOUT)
+        return user_data.get('user_name') if user_data else None
+    
+    hits = scan_keywords(user_message)
     
     # 訂閱相關指令
     if supabase:
         if user_message in ["取消訂閱", "停止推播", "unsubscribe"]:
+            CLASSIFICATIONS.inc(route='unsubscribe')
             unsubscribe_user(user_id)
-            line_bot_api.reply_message(reply_token, TextSendMessage(text="📭 已取消，想回來說「訂閱」"))
+            reply_or_push(event, TextSendMessage(text="📭 已取消，想回來說「訂閱」"))
             return
         if user_message in ["訂閱", "subscribe"]:
+            CLASSIFICATIONS.inc(route='subscribe')
             subscribe_user(user_id)
-            line_bot_api.reply_message(reply_token, TextSendMessage(text="📬 訂閱成功！明早8點見"))
+            reply_or_push(event, TextSendMessage(text="📬 訂閱成功！明早8點見"))
             return
     
     # 記住名字
@@ -572,31 +1218,30 @@ def handle_text_message(event):
     if name_match:
         name = name_match.group(1).strip()
         if name and supabase:
+            CLASSIFICATIONS.inc(route='set_name')
+            wait_profile()  # 等背景的 get_or_create 寫完快取，才不會蓋掉剛改的名字
             update_user_name(user_id, name)
-            line_bot_api.reply_message(reply_token, TextSendMessage(text=f"🌿 哈囉 {name}！我記住你了～"))
+            reply_or_push(event, TextSendMessage(text=f"🌿 哈囉 {name}！我記住你了～"))
             return
     
     # 設定城市
     city_match = re.match(r"^我在(.+)$", user_message) or re.match(r"^我住(.+)$", user_message)
     if city_match:
         city = city_match.group(1).strip()
-        valid_city = None
-        for c in CITY_MAPPING.keys():
-            if c in city:
-                valid_city = c
-                break
+        valid_city = find_city(city)
         if valid_city and supabase:
+            CLASSIFICATIONS.inc(route='set_city')
+            wait_profile()
             update_user_city(user_id, valid_city)
-            line_bot_api.reply_message(reply_token, TextSendMessage(text=f"🌿 記住了，你在{valid_city}！以後問天氣就不用再說一次囉～"))
+            reply_or_push(event, TextSendMessage(text=f"🌿 記住了，你在{valid_city}！以後問天氣就不用再說一次囉～"))
             return
     
     # 天氣查詢
-    if "天氣" in user_message or "下雨" in user_message or "澆水" in user_message:
-        city = None
-        for c in CITY_MAPPING.keys():
-            if c in user_message:
-                city = c
-                break
+    if hits.get("weather"):
+        CLASSIFICATIONS.inc(route='weather')
+        user_data = wait_profile()
+        user_name = user_data.get('user_name') if user_data else None
+        city = find_city(user_message, hits)
         if not city and user_data and user_data.get('city'):
             city = user_data.get('city')
         if city:
@@ -607,24 +1252,28 @@ def handle_text_message(event):
                     reply = f"{user_name}，{city}今天{weather['status']}，{weather['temp']}度，降雨機率{weather['rain_prob']}%\n\n{advice}"
                 else:
                     reply = f"{city}今天{weather['status']}，{weather['temp']}度，降雨機率{weather['rain_prob']}%\n\n{advice}"
-                line_bot_api.reply_message(reply_token, TextSendMessage(text=reply))
+                reply_or_push(event, TextSendMessage(text=reply))
                 if user_data and not user_data.get('city') and supabase:
                     update_user_city(user_id, city)
                 return
             else:
-                line_bot_api.reply_message(reply_token, TextSendMessage(text=weather['message']))
+                reply_or_push(event, TextSendMessage(text=weather['message']))
                 return
         else:
             reply = "🌿 你想查哪個城市的天氣？\n直接告訴我城市名稱，例如：\n「台北天氣」\n「台中會下雨嗎」"
-            line_bot_api.reply_message(reply_token, TextSendMessage(text=reply))
+            reply_or_push(event, TextSendMessage(text=reply))
             return
     
     # 核心專業判斷
-    is_professional = is_professional_question(user_message)
+    with STAGE_SECONDS.time(stage='is_professional_question'):
+        is_professional = is_professional_question(user_message, hits)
+    CLASSIFICATIONS.inc(route='professional' if is_professional else 'casual')
     mode = "🔬 專業模式" if is_professional else "😊 賣萌模式"
-    print(f"📝 用戶 {user_id} | {mode} | 問題: {user_message}")
-    ai_response = ask_deepseek(user_message, user_name, is_professional)
-    line_bot_api.reply_message(reply_token, TextSendMessage(text=ai_response))
+    log.debug("📝 文字訊息", user_id=user_id, mode=mode, text=user_message)
+    webhook_dedupe.note(getattr(event, 'webhook_event_id', None), 'deepseek')
+    # 名字用到時才等（最多 NAME_LOOKUP_TIMEOUT 秒）；專業模式的 DeepSeek 不必等名字就先送出
+    ai_response = ask_deepseek(user_message, user_name_or_none, is_professional, user_id=user_id)
+    reply_or_push(event, TextSendMessage(text=ai_response))
 
 # ==================== 測試端點 ====================
 @app.route("/test-push", methods=['GET'])
@@ -641,9 +1290,60 @@ def test_line_push():
         )
         return {"status": "success", "message": "測試訊息已發送"}, 200
     except Exception as e:
-        print(f"測試 Push 失敗: {e}")
+        log.warning("測試 Push 失敗", error=str(e))
         return {"status": "error", "message": str(e)}, 500
 
+def register_gauges():
+    """把既有的 stats() 數字也輸出到 /metrics"""
+    METRICS.gauge_callback('dpbot_webhook_queue_depth', 'webhook 佇列長度', lambda: event_queue.stats()['depth'])
+    METRICS.gauge_callback('dpbot_webhook_busy_workers', '忙碌中的 webhook worker', lambda: event_queue.stats()['busy_workers'])
+    METRICS.gauge_callback('dpbot_webhook_rejected_total', '佇列滿改同步處理的次數', lambda: event_queue.stats()['rejected'], kind='counter')
+    METRICS.gauge_callback('dpbot_webhook_late_bodies_total', '超過處理期限的 webhook body', lambda: webhook_dispatcher.stats()['late_bodies'], kind='counter')
+    METRICS.gauge_callback('dpbot_webhook_events_claimed_total', '第一次處理的 webhook 事件', lambda: webhook_dedupe.stats()['claimed'], kind='counter')
+    METRICS.gauge_callback('dpbot_reply_total', '回覆方式', lambda: dict(reply_stats), 'method', kind='counter')
+    METRICS.gauge_callback('dpbot_cache_hit_rate', '快取命中率', lambda: {
+        'user': user_cache.stats()['hit_rate'],
+        'answer': answer_cache.stats()['hit_rate'],
+    }, 'cache')
+    METRICS.gauge_callback('dpbot_last_active_coalesced_total', '被合併掉的 last_active 寫入', lambda: last_active_buffer.stats()['writes_coalesced'], kind='counter')
+    METRICS.gauge_callback('dpbot_upstream_in_flight', '進行中的上游請求', lambda: {n: u.stats()['in_flight'] for n, u in UPSTREAMS.items()}, 'upstream')
+    METRICS.gauge_callback('dpbot_admission_total', 'DeepSeek 准入結果（降級層級）', lambda: admission.stats()['tiers'], 'tier', kind='counter')
+    METRICS.gauge_callback('dpbot_admission_in_flight', '已准入、進行中的 DeepSeek 呼叫', lambda: admission.stats()['in_flight'])
+    METRICS.gauge_callback('dpbot_conversation_users', '記憶體中保有對話的用戶數', lambda: conversation.stats()['users'])
+    METRICS.gauge_callback('dpbot_image_store_bytes', '圖片暫存目錄使用量', lambda: image_store.stats()['bytes'])
+    METRICS.gauge_callback('dpbot_image_queue_depth', '等待下載的圖片數', lambda: image_pipeline.stats()['depth'])
+    METRICS.gauge_callback('dpbot_log_dropped_total', 'log 佇列滿而丟棄的筆數', lambda: log_handler.dropped, kind='counter')
+    METRICS.gauge_callback('dpbot_circuit_open', '斷路器是否打開（1=打開）', lambda: {n: int(u.breaker.state != 'closed') for n, u in UPSTREAMS.items()}, 'upstream')
+
+register_gauges()
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    return METRICS.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route("/stats", methods=['GET'])
+def stats():
+    return jsonify({
+        "async": ASYNC_WEBHOOK,
+        "queue": event_queue.stats(),
+        "dedupe": webhook_dedupe.stats(),
+        "dispatch": webhook_dispatcher.stats(),
+        "reply": reply_stats,
+        "user_cache": user_cache.stats(),
+        "last_active": last_active_buffer.stats(),
+        "weather_cache": weather_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "upstreams": {name: u.stats() for name, u in UPSTREAMS.items()},
+        "deepseek_latency": deepseek_latency.stats(),
+        "admission": admission.stats(),
+        "conversation": conversation.stats(),
+        "images": image_pipeline.stats(),
+        "repository": users_repo.stats(),
+        "classifier": {"weights": CLASSIFIER_WEIGHTS if question_classifier is not None else None,
+                       "min_confidence": CLASSIFIER_MIN_CONFIDENCE},
+        "startup": startup_stats()
+    }), 200
+
 @app.route("/", methods=['GET'])
 def health():
     supabase_status = "✅ 已連線" if supabase else "⚠️ 未設定"
@@ -651,10 +1351,50 @@ def health():
     return f"🌿 蕨積7.0 智能專業版 | Supabase: {supabase_status} | 排程器: {scheduler_status}", 200
 
 # ==================== 啟動 ====================
-if __name__ == "__main__":
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+log.info("✅ app 載入完成", import_ms=round(IMPORT_SECONDS * 1000, 1), pid=os.getpid())
+
+scheduler = None
+worker_started_at = None
+
+def init_worker():
+    """每個 process 呼叫一次（gunicorn 的 post_worker_init，或直接執行時）：開排程器、先建好 client"""
+    global scheduler, worker_started_at
+    if worker_started_at is not None:
+        return
+    started = time.perf_counter()
+    worker_started_at = time.time()
+    if SCHEDULER_ENABLED:
+        try:
+            scheduler = init_scheduler()
+        except Exception:
+            log.exception("❌ 排程器啟動失敗")
+    if ASYNC_WEBHOOK and WEBHOOK_QUEUE_DB:
+        # 不等第一個 webhook 進來，worker 一啟動就接手已結束 worker 留在 SQLite 的事件
+        event_queue.start()
+    # fork 之後才建立，第一個請求就不用等；失敗就留給第一次使用時再試
     try:
-        scheduler = init_scheduler()
+        line_bot_api.get()
+        if supabase:
+            supabase.get()
     except Exception as e:
-        print(f"❌ 排程器啟動失敗: {e}")
+        log.warning("⚠️ 預先建立 client 失敗", error=str(e))
+    log.info("✅ worker 就緒", pid=os.getpid(), init_ms=round((time.perf_counter() - started) * 1000, 1))
+
+def create_app():
+    """gunicorn 用的 app factory（wsgi_app = "app:create_app()"）；匯入本身不建連線、不開 thread"""
+    return app
+
+def startup_stats():
+    return {
+        "pid": os.getpid(),
+        "import_ms": round(IMPORT_SECONDS * 1000, 1),
+        "worker_started_at": worker_started_at,
+        "scheduler": scheduler is not None,
+        "clients": {"line_bot_api": line_bot_api.created(), "supabase": supabase.created()},
+    }
+
+if __name__ == "__main__":
+    init_worker()
     port = int(os.getenv('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,82 @@
+# bench/bench_keywords.py - 關鍵字自動機：黃金輸出比對 + 每則訊息成本（詞表 1x / 10x / 100x）
+# 用法：python bench/bench_keywords.py
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app  # noqa: E402
+from keyword_index import KeywordIndex  # noqa: E402
+
+GOLDEN_PATH = os.path.join(ROOT, "bench", "data", "keyword_golden.tsv")
+
+
+def load_golden():
+    rows = []
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#") or not line.strip():
+                continue
+            text, professional, city = line.rstrip("\n").split("\t")
+            rows.append((text, professional == "1", city or None))
+    return rows
+
+
+def check_golden(rows):
+    """自動機版的判斷必須跟原本逐字掃描的規則完全一樣（只比規則，不經過分流模型）"""
+    failures = 0
+    for text, professional, city in rows:
+        with contextlib.redirect_stdout(io.StringIO()):
+            got = app.is_professional_by_rules(text)
+        got_city = app.find_city(text)
+        if got != professional or got_city != city:
+            failures += 1
+            print(f"❌ {text!r}: professional={got} (預期 {professional}), city={got_city} (預期 {city})")
+    print(f"✅ 黃金輸出比對 {len(rows) - failures}/{len(rows)}")
+    return failures == 0
+
+
+def synthetic_words(n, seed=0):
+    """產生 n 個假植物名（2~4 個中文字），模擬詞表一直長大"""
+    rng = random.Random(seed)
+    chars = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+    return ["".join(rng.choice(chars) for _ in range(rng.randint(2, 4))) for _ in range(n)]
+
+
+def linear_scan(keywords, text):
+    return [k for k in keywords if k in text]
+
+
+def bench(texts, factor, rounds=5):
+    base = list(app.PROFESSIONAL_WEIGHTS) + app.PLANT_LIST + app.CASUAL_PHRASES + list(app.CITY_MAPPING)
+    extra = synthetic_words(len(base) * (factor - 1), seed=factor)
+    keywords = base + extra
+    index = KeywordIndex({"kw": keywords})
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for t in texts:
+            linear_scan(keywords, t)
+    linear_us = (time.perf_counter() - start) / (rounds * len(texts)) * 1e6
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for t in texts:
+            index.scan(t)
+    automaton_us = (time.perf_counter() - start) / (rounds * len(texts)) * 1e6
+
+    print(f"{factor:>4}x 詞表 ({len(keywords):>6} 詞): 逐字掃描 {linear_us:8.1f} µs/則 | 自動機 {automaton_us:6.1f} µs/則")
+
+
+if __name__ == "__main__":
+    rows = load_golden()
+    ok = check_golden(rows)
+    texts = [text for text, _, _ in rows]
+    for factor in (1, 10, 100):
+        bench(texts, factor)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,55 @@
+# bench/bench_push.py - 每日推播：逐一 push vs multicast 分批（對本機假 LINE server）
+# 用法：python bench/bench_push.py --subscribers 50000 --latency 0.02
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from linebot import LineBotApi  # noqa: E402
+from linebot.models import TextSendMessage  # noqa: E402
+
+from bench.fakes import FakeLine  # noqa: E402
+from push_fanout import multicast_fanout  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=50000)
+    parser.add_argument("--latency", type=float, default=0.02, help="假 LINE API 每次回應延遲（秒）")
+    parser.add_argument("--serial-sample", type=int, default=500, help="逐一 push 只量這麼多人再外插")
+    parser.add_argument("--rate-limit-prob", type=float, default=0.01, help="假 server 回 429 的機率")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=50)
+    args = parser.parse_args()
+
+    user_ids = [f"U{i:032x}" for i in range(args.subscribers)]
+    message = TextSendMessage(text="🌱 **蕨積早安**\n\n香蕉是莓果，草莓不是。植物界也搞詐欺🍌")
+
+    with FakeLine(latency=args.latency) as fake:
+        api = LineBotApi("bench-token", endpoint=fake.url)
+        sample = user_ids[:args.serial_sample]
+        start = time.perf_counter()
+        for user_id in sample:
+            api.push_message(user_id, message)
+        per_user = (time.perf_counter() - start) / len(sample)
+        print(f"逐一 push：{per_user * 1000:.1f} ms/人 → {args.subscribers} 人約 {per_user * args.subscribers:.1f} 秒"
+              f"（另加同樣次數的 subscribers UPDATE）")
+
+    with FakeLine(latency=args.latency, rate_limit_prob=args.rate_limit_prob) as fake:
+        api = LineBotApi("bench-token", endpoint=fake.url)
+        updates = []
+        start = time.perf_counter()
+        result = multicast_fanout(api, user_ids, message, on_delivered=updates.append,
+                                  concurrency=args.concurrency, rate_per_sec=args.rate, base_delay=0.05)
+        elapsed = time.perf_counter() - start
+        duplicates = sum(1 for n in fake.recipients.values() if n > 1)
+        print(f"multicast：{elapsed:.2f} 秒送完 {result['sent']} 人，API 呼叫 {result['requests']} 次"
+              f"（429 {fake.calls['multicast_429']} 次，重試 {result['retries']} 次），"
+              f"bulk UPDATE {len(updates)} 次，失敗 {len(result['failed'])} 人，重複收到 {duplicates} 人")
+
+
+if __name__ == "__main__":
+    main()
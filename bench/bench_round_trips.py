@@ -0,0 +1,124 @@
+# bench/bench_round_trips.py - 每個 handler 打幾趟 Supabase（PostgREST 替身計數），超過預算就 exit 1
+# 用法：python bench/bench_round_trips.py
+import json
+import os
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.loadgen import Harness, make_body, sign  # noqa: E402
+
+# 情境 -> (舊的先查再寫版本, 預算：未執行 sql/users_rpc.sql, 預算：已執行（RPC + 欄位預設值）)
+# 沒有預設值時新建資料列要自帶建立時間、又不能蓋掉既有列，沒加好友就直接傳訊息的新用戶要多一趟
+SCENARIOS = [
+    ("加好友（新用戶）", 4, 2, 1),
+    ("封鎖", 1, 1, 1),
+    ("封鎖後再加回", 2, 1, 1),
+    ("文字訊息（新用戶、快取未命中）", 2, 2, 1),
+    ("文字訊息（快取命中）", 0, 0, 0),
+    ("我叫小明", 1, 1, 1),
+    ("訂閱指令（新用戶）", 4, 4, 2),
+]
+
+
+def event(kind, user_id, text=None):
+    body = {
+        "type": kind,
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+        "deliveryContext": {"isRedelivery": False},
+    }
+    if kind != "unfollow":
+        body["replyToken"] = uuid.uuid4().hex
+    if text is not None:
+        body["message"] = {"type": "text", "id": str(uuid.uuid4().int)[:14], "text": text}
+    return body
+
+
+class RoundTrips:
+    def __init__(self, harness):
+        self.harness = harness
+        self.db = harness.fakes["supabase"]
+
+    def total(self):
+        return sum(self.db.calls.values())
+
+    def settle(self, quiet=0.15, timeout=5):
+        """等背景查詢（io_pool）也打完：計數連續 quiet 秒沒變才算數"""
+        deadline = time.monotonic() + timeout
+        last, since = self.total(), time.monotonic()
+        while time.monotonic() < deadline:
+            time.sleep(0.02)
+            now = self.total()
+            if now != last:
+                last, since = now, time.monotonic()
+            elif time.monotonic() - since >= quiet:
+                break
+        return last
+
+    def post(self, *events):
+        import requests
+        before = self.settle()
+        body = make_body(list(events))
+        response = requests.post(f"{self.harness.url}/callback", data=body.encode("utf-8"), timeout=10,
+                                 headers={"X-Line-Signature": sign(body), "Content-Type": "application/json"})
+        response.raise_for_status()
+        return self.settle() - before
+
+
+def run(counter):
+    new_user = lambda: f"U{uuid.uuid4().hex}"  # noqa: E731
+    results = []
+
+    user = new_user()
+    results.append(counter.post(event("follow", user)))
+    results.append(counter.post(event("unfollow", user)))
+    results.append(counter.post(event("follow", user)))
+
+    user = new_user()
+    results.append(counter.post(event("message", user, "今天好累")))
+    results.append(counter.post(event("message", user, "你在幹嘛")))
+    results.append(counter.post(event("message", user, "我叫小明")))
+
+    user = new_user()
+    results.append(counter.post(event("message", user, "訂閱")))
+    return results
+
+
+def main():
+    harness = Harness(deepseek_latency=0, line_latency=0, db_latency=0, cwa_latency=0,
+                      extra_env={"ASYNC_WEBHOOK": "0", "SCHEDULER_ENABLED": "0",
+                                 "LAST_ACTIVE_FLUSH_INTERVAL": "3600"})
+    app_module = harness.app_module
+    counter = RoundTrips(harness)
+    failures = 0
+    try:
+        for mode in ("upsert", "rpc"):
+            # upsert 版 = 資料庫還沒執行 sql/users_rpc.sql：沒有 RPC，也沒有欄位預設值
+            app_module.users_repo.use_rpc = mode == "rpc"
+            harness.fakes["supabase"].column_defaults = mode == "rpc"
+            app_module.user_cache.clear()
+            results = run(counter)
+            print(f"\n{mode} 版（Supabase 往返次數）")
+            for (name, before, upsert_budget, rpc_budget), got in zip(SCENARIOS, results):
+                budget = rpc_budget if mode == "rpc" else upsert_budget
+                ok = got <= budget
+                failures += not ok
+                print(f"   {'✅' if ok else '❌'} {name:<24} {got}（預算 {budget}，舊版 {before}）")
+        print("\n" + json.dumps(app_module.users_repo.stats(), ensure_ascii=False))
+        tables = harness.fakes["supabase"].tables
+        assert all(row["is_active"] for row in tables["subscribers"].values()), "訂閱狀態不對"
+        assert all(row.get("created_at") for row in tables["users"].values()), "新用戶缺 created_at"
+        assert all(row.get("subscribed_at") for row in tables["subscribers"].values()), "新訂閱缺 subscribed_at"
+    finally:
+        harness.stop()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# bench/bench_startup.py - 量測 app 匯入時間、冷啟動 worker 到第一個 /callback 成功的時間
+# 用法：python bench/bench_startup.py --repeat 5
+import argparse
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.loadgen import fake_env, make_body, make_event, sign, start_fakes  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(env, repeat):
+    """每次開新的 python 匯入 app，回傳 (各次毫秒, 最慢的模組)"""
+    code = "import time; t = time.perf_counter(); import app; print((time.perf_counter() - t) * 1000)"
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                             capture_output=True, text=True, check=True)
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+
+    # -X importtime：累計時間最久的頂層模組
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT, env=env,
+                         capture_output=True, text=True)
+    slowest = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  ") and cumulative.strip().isdigit():
+            slowest.append((int(cumulative) / 1000, name.strip()))
+    slowest.sort(reverse=True)
+    return times, slowest[:8]
+
+
+def wait_first_callback(url, deadline=60):
+    """一直送簽好名的 /callback，直到回 200；回傳花了幾秒"""
+    import requests
+    started = time.perf_counter()
+    while time.perf_counter() - started < deadline:
+        body = make_body([make_event("chat", "U" + "0" * 32)])
+        try:
+            response = requests.post(f"{url}/callback", data=body.encode("utf-8"), timeout=5,
+                                     headers={"X-Line-Signature": sign(body), "Content-Type": "application/json"})
+            if response.status_code == 200:
+                return time.perf_counter() - started
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.02)
+    raise TimeoutError("等不到第一個 /callback")
+
+
+def server_command(server, port):
+    if server == "gunicorn":
+        return [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+                "--bind", f"127.0.0.1:{port}", "--workers", "1"]
+    return [sys.executable, "app.py"]
+
+
+def measure_cold_start(env, server, preload, repeat):
+    """從啟動 process 到第一個 /callback 成功；gunicorn 另外量 worker 被砍掉後重生的時間"""
+    firsts, respawns = [], []
+    for _ in range(repeat):
+        port = free_port()
+        run_env = dict(env, PORT=str(port), GUNICORN_PRELOAD="1" if preload else "0")
+        proc = subprocess.Popen(server_command(server, port), cwd=ROOT, env=run_env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            url = f"http://127.0.0.1:{port}"
+            firsts.append(wait_first_callback(url))
+            if server == "gunicorn":
+                import requests
+                worker_pid = requests.get(f"{url}/stats", timeout=5).json()["startup"]["pid"]
+                os.kill(worker_pid, signal.SIGKILL)
+                respawns.append(wait_first_callback(url))
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+    return firsts, respawns
+
+
+def fmt(values):
+    if not values:
+        return "-"
+    return f"中位數 {statistics.median(values) * 1000:7.1f} ms（最小 {min(values) * 1000:.1f}，最大 {max(values) * 1000:.1f}）"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--server", choices=["auto", "gunicorn", "werkzeug"], default="auto")
+    args = parser.parse_args()
+
+    fakes = start_fakes(deepseek_latency=0.0, line_latency=0.0, db_latency=0.0, cwa_latency=0.0)
+    env = dict(os.environ, **fake_env(fakes), SCHEDULER_ENABLED="0",
+               PUSH_LEASE_BACKEND="local", PYTHONDONTWRITEBYTECODE="1")
+    try:
+        times, slowest = measure_import(env, args.repeat)
+        print(f"匯入 app：中位數 {statistics.median(times):.1f} ms（{args.repeat} 次）")
+        for ms, name in slowest:
+            print(f"   {ms:8.1f} ms  {name}")
+
+        server = args.server
+        if server == "auto":
+            server = "gunicorn" if subprocess.run([sys.executable, "-c", "import gunicorn"],
+                                                  capture_output=True).returncode == 0 else "werkzeug"
+        variants = [("gunicorn", False), ("gunicorn", True)] if server == "gunicorn" else [("werkzeug", False)]
+        for name, preload in variants:
+            firsts, respawns = measure_cold_start(env, name, preload, args.repeat)
+            label = f"{name}{' --preload' if preload else ''}"
+            print(f"\n{label}")
+            print(f"   啟動 → 第一個 /callback：{fmt(firsts)}")
+            if respawns:
+                print(f"   worker 被砍 → 新 worker 回應：{fmt(respawns)}")
+    finally:
+        for fake in fakes.values():
+            fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# bench/bench_subscriber_scan.py - 推播分片的訂閱者讀取：一次 select('*') vs keyset 分頁（含中途當掉後續跑）
+# 用法：python bench/bench_subscriber_scan.py --subscribers 50000 --page-size 1000 --batch-size 10000
+#       python bench/bench_subscriber_scan.py --per-city            # 依城市分版本（城市隨掃描讀回）
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.loadgen import fake_env, start_fakes  # noqa: E402
+
+TODAY = "2026-01-01"
+
+
+class Crash(Exception):
+    pass
+
+
+class BenchLease:
+    """ShardLease 的替身：記錄 cursor，可以在第 N 次 checkpoint 後「當掉」"""
+
+    def __init__(self, cursor=None, crash_after=None):
+        self.cursor = cursor
+        self.lost = False
+        self.checkpoints = 0
+        self.crash_after = crash_after
+
+    def checkpoint(self, cursor):
+        self.cursor = cursor
+        self.checkpoints += 1
+        if self.crash_after and self.checkpoints >= self.crash_after:
+            raise Crash(cursor)
+
+
+def measure(func):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=50000)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--crash-after", type=int, default=2, help="第幾批送完後模擬當掉")
+    parser.add_argument("--per-city", action="store_true", help="推播內容依城市分版本（PUSH_PER_CITY=1）")
+    args = parser.parse_args()
+
+    fakes = start_fakes(deepseek_latency=0, line_latency=0, db_latency=0, cwa_latency=0)
+    os.environ.update(fake_env(fakes), SCHEDULER_ENABLED="0",
+                      PUSH_PAGE_SIZE=str(args.page_size), PUSH_BATCH_SIZE=str(args.batch_size),
+                      PUSH_RATE_PER_SEC="100000")
+    import app
+
+    rng = random.Random(0)
+    db = fakes["supabase"]
+    db.tables["subscribers"] = {}
+    db.tables["users"] = {}
+    for i in range(args.subscribers):
+        user_id = f"U{rng.getrandbits(128):032x}"
+        # 1/3 設定了城市
+        db.tables["users"][(user_id,)] = {"user_id": user_id, "city": "臺北市" if i % 3 == 0 else None}
+        # 1/10 已取消訂閱、1/10 今天已推播過
+        db.tables["subscribers"][(user_id,)] = {
+            "user_id": user_id, "is_active": i % 10 != 0,
+            "subscribed_at": "2025-01-01T00:00:00+00:00",
+            "last_push_date": TODAY if i % 10 == 1 else None,
+        }
+    expected = {row["user_id"] for row in db.tables["subscribers"].values()
+                if row["is_active"] and row["last_push_date"] != TODAY}
+    payload = {"fact": "", "default": "🌱 蕨積早安",
+               "cities": {"臺北市": "🌱 蕨積早安\n\n臺北市今天晴"} if args.per_city else {}}
+
+    # 舊作法：整個分片一次讀進來
+    rows, elapsed, peak = measure(
+        lambda: app.supabase.table("subscribers").select("*").eq("is_active", True).execute().data)
+    print(f"select('*') 一次讀完：{len(rows)} 列，{elapsed:.2f} 秒，Python 配置峰值 {peak:.1f} MB")
+    del rows
+
+    # 新作法：分頁 + 每批 checkpoint；第一次跑到一半當掉，第二次從 cursor 續跑
+    lease = BenchLease(crash_after=args.crash_after)
+    try:
+        _, elapsed, peak = measure(lambda: app.push_shard(TODAY, payload, 0, (None, None), lease))
+        print("（沒有當掉：批次數少於 --crash-after）")
+    except Crash as e:
+        print(f"💥 第 {lease.checkpoints} 批後當掉，cursor = {e.args[0]}")
+    resumed = BenchLease(cursor=lease.cursor)
+    db.calls.clear()
+    _, elapsed, peak = measure(lambda: app.push_shard(TODAY, payload, 0, (None, None), resumed))
+    print(f"續跑：{elapsed:.2f} 秒，Python 配置峰值 {peak:.1f} MB，"
+          f"查詢 {db.calls['GET subscribers'] + db.calls['GET push_recipients']} 頁，"
+          f"查 users 城市 {db.calls['GET users']} 次，更新 {db.calls['PATCH subscribers']} 次")
+
+    recipients = fakes["line"].recipients
+    duplicates = sum(1 for n in recipients.values() if n > 1)
+    missing = len(expected - set(recipients))
+    extra = len(set(recipients) - expected)
+    print(f"應送 {len(expected)} 人：送達 {len(recipients)} 人，重複 {duplicates}，漏送 {missing}，多送 {extra}")
+
+    for fake in fakes.values():
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# bench/eval_classifier.py - 分流模型離線評估：訓練 / 準確率（對照關鍵字規則）/ 每秒訊息數
+# 用法：python bench/eval_classifier.py --train            # 用語料的訓練集重訓並寫出 data/classifier.npz
+#       python bench/eval_classifier.py --min-confidence 0.8
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app  # noqa: E402
+from classifier import NgramClassifier  # noqa: E402
+
+CORPUS_PATH = os.path.join(ROOT, "bench", "data", "classifier_corpus.tsv")
+WEIGHTS_PATH = os.path.join(ROOT, "data", "classifier.npz")
+
+
+def load_corpus(path):
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#") or not line.strip():
+                continue
+            label, text = line.rstrip("\n").split("\t", 1)
+            rows.append((text, label == "1"))
+    return rows
+
+
+def split(rows, test_every=5):
+    """依文字的 crc32 固定切 1/5 當測試集（每次切法一樣、跟檔案順序無關）"""
+    train, test = [], []
+    for row in rows:
+        (test if zlib.crc32(row[0].encode("utf-8")) % test_every == 0 else train).append(row)
+    return train, test
+
+
+def rules(text):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return app.is_professional_by_rules(text)
+
+
+def score(name, predictions, rows, coverage=None):
+    correct = sum(p == label for p, (_, label) in zip(predictions, rows))
+    # 誤判成專業 = 白花一次長回答；誤判成閒聊 = 該認真回答卻在賣萌
+    false_pro = sum(p and not label for p, (_, label) in zip(predictions, rows))
+    false_casual = sum(label and not p for p, (_, label) in zip(predictions, rows))
+    extra = f"，模型決定 {coverage:.0%}" if coverage is not None else ""
+    print(f"   {name:<22} 準確率 {correct / len(rows):6.1%}（{correct}/{len(rows)}）"
+          f"  誤判專業 {false_pro:3d}  誤判閒聊 {false_casual:3d}{extra}")
+
+
+def throughput(func, texts, seconds=1.0):
+    """重複跑到至少 seconds 秒，回傳每秒處理幾則"""
+    done = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        func(texts)
+        done += len(texts)
+    return done / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--weights", default=WEIGHTS_PATH)
+    parser.add_argument("--train", action="store_true", help="用訓練集重訓並覆寫 --weights")
+    parser.add_argument("--epochs", type=int, default=200)
+    parser.add_argument("--min-confidence", type=float, default=app.CLASSIFIER_MIN_CONFIDENCE)
+    args = parser.parse_args()
+
+    rows = load_corpus(args.corpus)
+    train, test = split(rows)
+    print(f"語料 {len(rows)} 句（專業 {sum(label for _, label in rows)}），訓練 {len(train)} / 測試 {len(test)}")
+
+    if args.train:
+        started = time.perf_counter()
+        model = NgramClassifier.fit([t for t, _ in train], [label for _, label in train], epochs=args.epochs)
+        os.makedirs(os.path.dirname(args.weights), exist_ok=True)
+        model.save(args.weights)
+        print(f"訓練 {time.perf_counter() - started:.2f} 秒 → {args.weights}（{os.path.getsize(args.weights) / 1024:.1f} KB）")
+    model = NgramClassifier.load(args.weights)
+
+    texts = [t for t, _ in test]
+    by_rules = [rules(t) for t in texts]
+    proba = model.predict_proba(texts)
+    by_model = [bool(p >= 0.5) for p in proba]
+    confident = [p >= args.min_confidence or p <= 1 - args.min_confidence for p in proba]
+    hybrid = [m if c else r for m, c, r in zip(by_model, confident, by_rules)]
+
+    print("\n測試集")
+    score("關鍵字規則", by_rules, test)
+    score("模型（0.5 切）", by_model, test)
+    score(f"模型 + 規則（信心 {args.min_confidence}）", hybrid, test, coverage=sum(confident) / len(test))
+    changed = [(text, label, h) for (text, label), h, r in zip(test, hybrid, by_rules) if h != r]
+    if changed:
+        print(f"\n與規則結果不同的句子（{len(changed)}）")
+        for text, label, got in changed:
+            print(f"   {'✅' if got == label else '❌'} {'專業' if got else '閒聊'}  {text}")
+
+    all_texts = [t for t, _ in rows]
+    print("\n吞吐量（則 / 秒，單一 thread）")
+    print(f"   關鍵字規則（逐則）        {throughput(lambda batch: [rules(t) for t in batch], all_texts):10,.0f}")
+    for size in (1, 32, 256):
+        batches = [all_texts[i:i + size] for i in range(0, len(all_texts), size)]
+        rate = throughput(lambda _: [model.predict_proba(b) for b in batches], all_texts)
+        print(f"   模型（每批 {size:>3} 則）        {rate:10,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+# bench/fakes.py - 本機假服務（壓測 / benchmark 用，不連任何外部 API）
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeServer:
+    """在背景 thread 跑一個 HTTP server，子類別實作 handle(method, path, query, body)"""
+
+    def __init__(self, latency=0.0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _dispatch(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                path, _, query = self.path.partition("?")
+                if fake.latency:
+                    time.sleep(fake.latency)
+                status, payload, headers = fake.handle(method, path, query, raw, self.headers)
+                data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                if not headers or "Content-Type" not in headers:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def do_PATCH(self):
+                self._dispatch("PATCH")
+
+            def do_DELETE(self):
+                self._dispatch("DELETE")
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.calls[name] += n
+
+    def handle(self, method, path, query, body, headers):
+        raise NotImplementedError
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FakeLine(FakeServer):
+    """LINE Messaging API：reply / push / multicast / 圖片內容，可注入 429"""
+
+    def __init__(self, rate_limit_prob=0.0, content_size=512 * 1024, **kwargs):
+        super().__init__(**kwargs)
+        self.rate_limit_prob = rate_limit_prob
+        self.content_size = content_size
+        self.recipients = Counter()
+        self._retry_keys = set()
+
+    def handle(self, method, path, query, body, headers):
+        if method == "POST" and path.startswith("/v2/bot/message/"):
+            kind = path.rsplit("/", 1)[-1]
+            if self.rate_limit_prob and random.random() < self.rate_limit_prob:
+                self.count(f"{kind}_429")
+                return 429, {"message": "Too Many Requests"}, {"Retry-After": "0.05"}
+            retry_key = headers.get("X-Line-Retry-Key")
+            if retry_key:
+                with self._lock:
+                    if retry_key in self._retry_keys:
+                        self.calls[f"{kind}_409"] += 1
+                        return 409, {"message": "The retry key is already accepted"}, None
+                    self._retry_keys.add(retry_key)
+            payload = json.loads(body or b"{}")
+            self.count(kind)
+            to = payload.get("to")
+            with self._lock:
+                for user_id in (to if isinstance(to, list) else [to] if to else []):
+                    self.recipients[user_id] += 1
+            return 200, {}, None
+        if method == "GET" and path.endswith("/content"):
+            self.count("content")
+            return 200, b"\xff\xd8" + b"\0" * (self.content_size - 2), {"Content-Type": "image/jpeg"}
+        return 404, {"message": "Not found"}, None
+
+
+class FakeDeepSeek(FakeServer):
+    """DeepSeek chat completions：可設定延遲，支援 stream（SSE）；第一則 system 出現過就算 context cache 命中"""
+
+    def __init__(self, reply="這是典型澆水過多導致的根部問題。建議停止澆水並移到通風處。未來等土壤乾燥再澆。", **kwargs):
+        super().__init__(**kwargs)
+        self.reply = reply
+        self.prompt_tokens = 0
+        self._prefixes = set()
+
+    def handle(self, method, path, query, body, headers):
+        if method != "POST" or not path.endswith("/chat/completions"):
+            return 404, {"error": "not found"}, None
+        payload = json.loads(body or b"{}")
+        mode = "professional" if payload.get("temperature", 1) < 0.5 else "casual"
+        self.count(f"chat_{mode}")
+        messages = payload.get("messages", [])
+        prompt_chars = sum(len(m.get("content", "")) for m in messages)
+        prefix = messages[0].get("content", "") if messages else ""
+        with self._lock:
+            self.prompt_tokens += prompt_chars
+            hit = len(prefix) if prefix in self._prefixes else 0
+            self._prefixes.add(prefix)
+        usage = {"prompt_tokens": prompt_chars, "completion_tokens": len(self.reply),
+                 "prompt_cache_hit_tokens": hit, "prompt_cache_miss_tokens": prompt_chars - hit}
+        if payload.get("stream"):
+            lines = []
+            for i in range(0, len(self.reply), 4):
+                chunk = {"choices": [{"index": 0, "delta": {"content": self.reply[i:i + 4]}}]}
+                lines.append("data: " + json.dumps(chunk, ensure_ascii=False))
+            lines.append("data: " + json.dumps({"choices": [], "usage": usage}))
+            lines.append("data: [DONE]")
+            data = ("\n\n".join(lines) + "\n\n").encode("utf-8")
+            return 200, data, {"Content-Type": "text/event-stream"}
+        return 200, {
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": self.reply}}],
+            "usage": usage,
+        }, None
+
+
+class FakeCWA(FakeServer):
+    """CWA F-C0032-001：回傳固定的三個時段預報"""
+
+    CITIES = ["基隆市", "臺北市", "新北市", "桃園市", "新竹市", "新竹縣", "苗栗縣", "臺中市", "彰化縣", "南投縣",
+              "雲林縣", "嘉義市", "嘉義縣", "臺南市", "高雄市", "屏東縣", "宜蘭縣", "花蓮縣", "臺東縣", "澎湖縣",
+              "金門縣", "連江縣"]
+
+    @staticmethod
+    def _location(name):
+        start = datetime.now().replace(minute=0, second=0, microsecond=0)
+        periods = [(start + timedelta(hours=12 * i), start + timedelta(hours=12 * (i + 1))) for i in range(3)]
+
+        def element(name_, value):
+            return {"elementName": name_, "time": [
+                {"startTime": s.strftime("%Y-%m-%d %H:%M:%S"), "endTime": e.strftime("%Y-%m-%d %H:%M:%S"),
+                 "parameter": {"parameterName": value}} for s, e in periods]}
+
+        return {"locationName": name, "weatherElement": [
+            element("Wx", "多雲時晴"), element("PoP", "20"), element("MinT", "24"),
+            element("CI", "舒適"), element("MaxT", "30")]}
+
+    def handle(self, method, path, query, body, headers):
+        if method != "GET" or "F-C0032-001" not in path:
+            return 404, {"success": "false"}, None
+        name = parse_qs(query).get("locationName", [None])[0]
+        self.count("forecast_one" if name else "forecast_all")
+        cities = [name] if name else self.CITIES
+        return 200, {"success": "true", "records": {"location": [self._location(c) for c in cities]}}, None
+
+
+class FakePostgREST(FakeServer):
+    """Supabase PostgREST 的最小替身：users / subscribers / 其他表的 select、insert、upsert、update，follow_user RPC 和 push_recipients view"""
+
+    PRIMARY_KEYS = {"users": ("user_id",), "subscribers": ("user_id",), "push_leases": ("job", "shard")}
+    VIEWS = ("push_recipients",)
+    # 新建資料列時沒給的欄位是 NULL；column_defaults=True 時改用 sql/users_rpc.sql 設定的預設值
+    COLUMNS = {
+        "users": ("user_name", "city", "created_at", "last_active"),
+        "subscribers": ("subscribed_at", "last_push_date", "is_active"),
+    }
+    DEFAULTS = {
+        "users": lambda: {"created_at": _now(), "last_active": _now()},
+        "subscribers": lambda: {"subscribed_at": _now(), "is_active": True},
+    }
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.tables = {}
+        self.column_defaults = True
+        self.functions = {"follow_user": self._follow_user, "touch_last_active": self._touch_last_active}
+        # 唯讀 view（對應 sql/*.sql）；刪掉某個 key 可模擬還沒執行 migration
+        self.views = {"push_recipients": self._push_recipients}
+
+    # ---------- 篩選條件 ----------
+    @staticmethod
+    def _coerce(stored, value):
+        if value == "null":
+            return None
+        if isinstance(stored, bool):
+            return value.lower() == "true"  # postgrest-py 0.x 送 eq.True，Postgres 不分大小寫
+        if isinstance(stored, (int, float)) and not isinstance(stored, bool):
+            try:
+                return type(stored)(value)
+            except ValueError:
+                return value
+        return value
+
+    @staticmethod
+    def _in_list(value):
+        return frozenset(v.strip('"') for v in value.strip("()").split(","))
+
+    def _match(self, row, column, op, value):
+        stored = row.get(column)
+        if op == "is":
+            return stored is None if value == "null" else stored == (value.lower() == "true")
+        if op == "in":
+            return str(stored) in (self._in_list(value) if isinstance(value, str) else value)
+        if stored is None:
+            return False
+        target = self._coerce(stored, value)
+        if op == "eq":
+            return stored == target
+        if op == "neq":
+            return stored != target
+        if op == "gt":
+            return stored > target
+        if op == "gte":
+            return stored >= target
+        if op == "lt":
+            return stored < target
+        if op == "lte":
+            return stored <= target
+        if op == "like":
+            return str(stored).startswith(value.rstrip("*%"))
+        raise ValueError(f"unsupported operator {op}")
+
+    def _filters(self, params):
+        filters = []
+        for key, values in params.items():
+            if key in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                continue
+            for value in values:
+                if key == "or":
+                    alternatives = [part.split(".", 2) for part in value.strip("()").split(",")]
+                    filters.append(("or", alternatives))
+                else:
+                    op, _, operand = value.partition(".")
+                    # in.(...) 先拆成 set：每批幾百個 user_id，逐列重拆會慢到讓 client 逾時
+                    filters.append((key, (op, self._in_list(operand) if op == "in" else operand)))
+        return filters
+
+    def _rows(self, table, params):
+        rows = []
+        source = self.views[table]() if table in self.views else self.tables.setdefault(table, {}).values()
+        filters = self._filters(params)
+        for row in source:
+            ok = True
+            for column, cond in filters:
+                if column == "or":
+                    ok = any(self._match(row, c, op, v) for c, op, v in cond)
+                else:
+                    ok = self._match(row, column, *cond)
+                if not ok:
+                    break
+            if ok:
+                rows.append(row)
+        if "order" in params:
+            column, _, direction = params["order"][0].partition(".")
+            rows.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=direction.startswith("desc"))
+        if "limit" in params:
+            rows = rows[:int(params["limit"][0])]
+        return rows
+
+    @staticmethod
+    def _project(rows, params):
+        select = params.get("select", ["*"])[0]
+        if select == "*":
+            return [dict(r) for r in rows]
+        columns = select.split(",")
+        return [{c: r.get(c) for c in columns} for r in rows]
+
+    def _new_row(self, table, row):
+        new = dict.fromkeys(self.COLUMNS.get(table, ()))
+        if self.column_defaults and table in self.DEFAULTS:
+            new.update(self.DEFAULTS[table]())
+        new.update(row)
+        return new
+
+    def _upsert(self, table, row, changes):
+        """ON CONFLICT DO UPDATE SET changes；回傳資料列（已持有 _lock）"""
+        data = self.tables.setdefault(table, {})
+        key = self._key(table, row, {})
+        if key in data:
+            data[key].update(changes)
+        else:
+            data[key] = self._new_row(table, row)
+        return dict(data[key])
+
+    def _follow_user(self, p_user_id):
+        user = self._upsert("users", {"user_id": p_user_id, "last_active": _now()}, {"last_active": _now()})
+        self._upsert("subscribers", {"user_id": p_user_id, "is_active": True}, {"is_active": True})
+        return user
+
+    def _touch_last_active(self, p_rows):
+        users = self.tables.setdefault("users", {})
+        for row in p_rows:
+            user = users.get((row["user_id"],))
+            if user is not None and (user.get("last_active") or "") < row["last_active"]:
+                user["last_active"] = row["last_active"]
+        return None
+
+    def _push_recipients(self):
+        users = self.tables.setdefault("users", {})
+        return [dict(user_id=s["user_id"], is_active=s.get("is_active"), last_push_date=s.get("last_push_date"),
+                     city=users.get((s["user_id"],), {}).get("city"))
+                for s in self.tables.setdefault("subscribers", {}).values()]
+
+    def _key(self, table, row, params):
+        conflict = params.get("on_conflict", [None])[0]
+        columns = tuple(conflict.split(",")) if conflict else self.PRIMARY_KEYS.get(table, ("id",))
+        return tuple(row.get(c) for c in columns)
+
+    # ---------- HTTP ----------
+    def handle(self, method, path, query, body, headers):
+        if not path.startswith("/rest/v1/"):
+            return 404, {"message": "not found"}, None
+        table = path[len("/rest/v1/"):]
+        params = parse_qs(query, keep_blank_values=True)
+        prefer = headers.get("Prefer", "") or ""
+        self.count(f"{method} {table}")
+        if table.startswith("rpc/"):
+            func = self.functions.get(table[len("rpc/"):])
+            if func is None:
+                return 404, {"code": "PGRST202", "message": f"function {table} not found"}, None
+            with self._lock:
+                return 200, func(**json.loads(body or b"{}")), None
+        with self._lock:
+            data = self.tables.setdefault(table, {})
+            if method == "GET":
+                if table in self.VIEWS and table not in self.views:
+                    return 404, {"code": "42P01", "message": f'relation "{table}" does not exist'}, None
+                return 200, self._project(self._rows(table, params), params), None
+            if method == "POST":
+                payload = json.loads(body or b"[]")
+                rows = payload if isinstance(payload, list) else [payload]
+                result = []
+                for row in rows:
+                    key = self._key(table, row, params)
+                    if key in data:
+                        if "ignore-duplicates" in prefer:
+                            continue
+                        if "merge-duplicates" not in prefer:
+                            return 409, {"code": "23505", "message": "duplicate key"}, None
+                        data[key].update(row)
+                    else:
+                        data[key] = self._new_row(table, row)
+                    result.append(dict(data[key]))
+                return 201, result if "return=representation" in prefer else b"", None
+            if method == "PATCH":
+                changes = json.loads(body or b"{}")
+                rows = self._rows(table, params)
+                for row in rows:
+                    row.update(changes)
+                return 200, [dict(r) for r in rows] if "return=representation" in prefer else b"", None
+            if method == "DELETE":
+                rows = self._rows(table, params)
+                for row in rows:
+                    data.pop(self._key(table, row, {}), None)
+                return 200, [dict(r) for r in rows], None
+        return 405, {"message": "method not allowed"}, None
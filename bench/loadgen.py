@@ -0,0 +1,213 @@
+# bench/loadgen.py - 對本機 app 的 /callback 壓測（所有上游都是 bench/fakes.py 的假服務）
+# 用法：python bench/loadgen.py --requests 200 --concurrency 16 --deepseek-latency 0.5
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fakes import FakeCWA, FakeDeepSeek, FakeLine, FakePostgREST  # noqa: E402
+
+CHANNEL_SECRET = "bench-channel-secret"
+
+# 訊息種類與比例（大致照實際流量）
+MESSAGE_MIX = {
+    "chat": (0.45, ["今天好累", "哈哈你好可愛", "你在幹嘛", "吃飽了沒", "晚安蕨積", "好無聊喔陪我聊天"]),
+    "professional": (0.25, ["我的多肉葉子變軟怎麼辦？", "龜背芋葉子發黃是什麼問題", "虎尾蘭爛根了怎麼救",
+                            "發財樹掉葉正常嗎", "黃金葛有介殼蟲要怎麼防治"]),
+    "weather": (0.15, ["台北天氣", "台中會下雨嗎", "高雄今天要澆水嗎", "天氣如何"]),
+    "profile": (0.10, ["我叫小明", "我在台北", "我住新竹縣", "我是阿花"]),
+    "image": (0.05, [None]),
+}
+
+
+def sign(body):
+    digest = hmac.new(CHANNEL_SECRET.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("utf-8")
+
+
+def make_event(kind, user_id):
+    message_id = str(random.randint(10 ** 13, 10 ** 14))
+    if kind == "image":
+        message = {"type": "image", "id": message_id, "contentProvider": {"type": "line"}}
+    else:
+        message = {"type": "text", "id": message_id, "text": random.choice(MESSAGE_MIX[kind][1])}
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": uuid.uuid4().hex,
+        "message": message,
+    }
+
+
+def make_body(events):
+    return json.dumps({"destination": "Ubench", "events": events}, ensure_ascii=False)
+
+
+def pick_kind(rng):
+    r = rng.random()
+    for kind, (weight, _) in MESSAGE_MIX.items():
+        if r < weight:
+            return kind
+        r -= weight
+    return "chat"
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def start_fakes(deepseek_latency=0.3, line_latency=0.02, db_latency=0.02, cwa_latency=0.1):
+    return {
+        "line": FakeLine(latency=line_latency).start(),
+        "deepseek": FakeDeepSeek(latency=deepseek_latency).start(),
+        "supabase": FakePostgREST(latency=db_latency).start(),
+        "cwa": FakeCWA(latency=cwa_latency).start(),
+    }
+
+
+def fake_env(fakes):
+    """讓 app 的所有上游都指到假服務的環境變數"""
+    return {
+        "LINE_CHANNEL_SECRET": CHANNEL_SECRET,
+        "LINE_CHANNEL_ACCESS_TOKEN": "bench-token",
+        "LINE_API_ENDPOINT": fakes["line"].url,
+        "LINE_DATA_ENDPOINT": fakes["line"].url,
+        "DEEPSEEK_API_KEY": "bench-key",
+        "DEEPSEEK_API_URL": fakes["deepseek"].url + "/v1/chat/completions",
+        "SUPABASE_URL": fakes["supabase"].url,
+        "SUPABASE_KEY": "bench.bench.bench",
+        "CWA_API_KEY": "bench-key",
+        "CWA_API_URL": fakes["cwa"].url + "/api/v1/rest/datastore/F-C0032-001",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+    }
+
+
+class Harness:
+    """啟動假服務 → 設定環境變數 → 在同一個 process 裡起 app 的 HTTP server"""
+
+    def __init__(self, deepseek_latency, line_latency, db_latency, cwa_latency, extra_env=None):
+        self.fakes = start_fakes(deepseek_latency, line_latency, db_latency, cwa_latency)
+        os.environ.update(fake_env(self.fakes))
+        os.environ.update(extra_env or {})
+
+        from werkzeug.serving import make_server
+        import app as app_module
+        self.app_module = app_module
+        self.server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def upstream_calls(self):
+        calls = Counter()
+        for name, fake in self.fakes.items():
+            for key, value in fake.calls.items():
+                calls[f"{name}:{key}"] += value
+        return calls
+
+    def stop(self):
+        self.server.shutdown()
+        for fake in self.fakes.values():
+            fake.stop()
+
+
+def run_phase(harness, kinds, concurrency, users, seed, redeliver_rate=0.0):
+    import requests
+    rng = random.Random(seed)
+    session = requests.Session()
+    jobs = [(kind, f"U{rng.randrange(users):032x}") for kind in kinds]
+    latencies = {}
+    errors = Counter()
+    lock = threading.Lock()
+
+    def post(body):
+        return session.post(f"{harness.url}/callback", data=body.encode("utf-8"),
+                            headers={"X-Line-Signature": sign(body), "Content-Type": "application/json"})
+
+    def send(job):
+        kind, user_id = job
+        event = make_event(kind, user_id)
+        start = time.perf_counter()
+        response = post(make_body([event]))
+        elapsed = time.perf_counter() - start
+        if redeliver_rate and rng.random() < redeliver_rate:
+            # 模擬 LINE 因為回應太慢而重送同一個事件
+            event["deliveryContext"]["isRedelivery"] = True
+            post(make_body([event]))
+        with lock:
+            latencies.setdefault(kind, []).append(elapsed)
+            if response.status_code != 200:
+                errors[kind] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, jobs))
+    return time.perf_counter() - start, latencies, errors
+
+
+def report(title, elapsed, latencies, errors, calls_before, calls_after, count):
+    total = sum(len(v) for v in latencies.values())
+    print(f"\n== {title}：{total} 則，{elapsed:.2f} 秒，{total / elapsed:.1f} 則/秒")
+    for kind, values in sorted(latencies.items()):
+        print(f"   {kind:<13} n={len(values):<5} p50={percentile(values, 50) * 1000:8.1f} ms"
+              f"  p99={percentile(values, 99) * 1000:8.1f} ms  errors={errors.get(kind, 0)}")
+    diff = {k: calls_after[k] - calls_before.get(k, 0) for k in calls_after if calls_after[k] - calls_before.get(k, 0)}
+    if diff and count:
+        print("   上游呼叫（每則平均）: " + ", ".join(f"{k}={v / count:.2f}" for k, v in sorted(diff.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200, help="混合流量的請求數")
+    parser.add_argument("--per-type", type=int, default=30, help="每種訊息單獨量測的請求數")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--deepseek-latency", type=float, default=0.3)
+    parser.add_argument("--line-latency", type=float, default=0.02)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--cwa-latency", type=float, default=0.1)
+    parser.add_argument("--redeliver-rate", type=float, default=0.0, help="混合流量中被 LINE 重送的比例")
+    parser.add_argument("--env", action="append", default=[], help="額外環境變數，例如 --env ASYNC_WEBHOOK=1")
+    args = parser.parse_args()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    harness = Harness(args.deepseek_latency, args.line_latency, args.db_latency, args.cwa_latency, extra_env)
+    try:
+        for i, kind in enumerate(MESSAGE_MIX):
+            before = harness.upstream_calls()
+            elapsed, latencies, errors = run_phase(harness, [kind] * args.per_type, args.concurrency, args.users, i)
+            report(f"只送 {kind}", elapsed, latencies, errors, before, harness.upstream_calls(), args.per_type)
+
+        rng = random.Random(42)
+        before = harness.upstream_calls()
+        kinds = [pick_kind(rng) for _ in range(args.requests)]
+        elapsed, latencies, errors = run_phase(harness, kinds, args.concurrency, args.users, 99, args.redeliver_rate)
+        report("混合流量", elapsed, latencies, errors, before, harness.upstream_calls(), args.requests)
+        all_latencies = [v for values in latencies.values() for v in values]
+        print(f"   全部 p50={statistics.median(all_latencies) * 1000:.1f} ms"
+              f"  p99={percentile(all_latencies, 99) * 1000:.1f} ms")
+    finally:
+        harness.stop()
+
+
+if __name__ == "__main__":
+    main()
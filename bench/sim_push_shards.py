@@ -0,0 +1,107 @@
+# bench/sim_push_shards.py - 多個 worker process 共用 SQLite 租約表跑每日推播（含一個中途當掉的 worker）
+# 用法：python bench/sim_push_shards.py --workers 4 --subscribers 20000
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from push_lease import SQLiteLeaseBackend, run_sharded, worker_id  # noqa: E402
+
+TODAY = "2026-01-01"
+JOB = f"daily_push:{TODAY}"
+
+
+def setup(db_path, subscribers):
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE subscribers (user_id TEXT PRIMARY KEY, is_active INTEGER, last_push_date TEXT)")
+    conn.execute("CREATE TABLE deliveries (user_id TEXT, owner TEXT)")
+    rng = random.Random(0)
+    conn.executemany(
+        "INSERT INTO subscribers VALUES (?, 1, NULL)",
+        [(f"U{rng.getrandbits(128):032x}",) for _ in range(subscribers)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def worker(db_path, shards, lease_seconds, crash_after):
+    owner = worker_id()
+    backend = SQLiteLeaseBackend(db_path)
+    conn = sqlite3.connect(db_path, timeout=30)
+
+    def process_shard(shard, bounds, lease):
+        lo, hi = bounds
+        sql = "SELECT user_id FROM subscribers WHERE is_active = 1 AND (last_push_date IS NULL OR last_push_date != ?)"
+        args = [TODAY]
+        if lo:
+            sql += " AND user_id >= ?"
+            args.append(lo)
+        if hi:
+            sql += " AND user_id < ?"
+            args.append(hi)
+        user_ids = [r[0] for r in conn.execute(sql, args)]
+        for i in range(0, len(user_ids), 500):
+            if lease.lost:
+                return
+            chunk = user_ids[i:i + 500]
+            # 「送出」後馬上標記 last_push_date（同一個交易）
+            conn.executemany("INSERT INTO deliveries VALUES (?, ?)", [(u, owner) for u in chunk])
+            conn.executemany("UPDATE subscribers SET last_push_date = ? WHERE user_id = ?", [(TODAY, u) for u in chunk])
+            conn.commit()
+            lease.checkpoint(chunk[-1])
+            if crash_after and i >= crash_after:
+                print(f"💥 {owner} 在分片 {shard} 中途當掉")
+                os._exit(1)
+            time.sleep(0.01)
+
+    done = run_sharded(backend, JOB, shards, process_shard, owner=owner, lease_seconds=lease_seconds)
+    print(f"✅ {owner} 完成分片 {done}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--subscribers", type=int, default=20000)
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--lease-seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "push.db")
+        setup(db_path, args.subscribers)
+        SQLiteLeaseBackend(db_path)
+
+        start = time.perf_counter()
+        procs = [multiprocessing.Process(target=worker, args=(db_path, args.shards, args.lease_seconds, 0))
+                 for _ in range(args.workers)]
+        procs.append(multiprocessing.Process(target=worker, args=(db_path, args.shards, args.lease_seconds, 500)))
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - start
+
+        conn = sqlite3.connect(db_path)
+        delivered = conn.execute("SELECT COUNT(DISTINCT user_id) FROM deliveries").fetchone()[0]
+        duplicates = conn.execute(
+            "SELECT COUNT(*) FROM (SELECT user_id FROM deliveries GROUP BY user_id HAVING COUNT(*) > 1)"
+        ).fetchone()[0]
+        pending = conn.execute("SELECT COUNT(*) FROM push_leases WHERE job = ? AND shard >= 0 AND done = 0",
+                               (JOB,)).fetchone()[0]
+        owners = conn.execute("SELECT owner, COUNT(*) FROM deliveries GROUP BY owner").fetchall()
+        print(f"⏱️ {elapsed:.2f} 秒：送達 {delivered}/{args.subscribers} 人，重複 {duplicates} 人，未完成分片 {pending}")
+        for owner, count in owners:
+            print(f"   {owner}: {count} 人")
+        ok = delivered == args.subscribers and duplicates == 0 and pending == 0
+        sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# classifier.py - 專業 / 閒聊分流模型：字元 n-gram 雜湊特徵 + 線性模型（NumPy 可選，沒裝就只用規則）
+import unicodedata
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 是選配，沒裝時 load_classifier() 回 None
+    np = None
+
+from log import get_logger
+
+log = get_logger(__name__)
+
+N_FEATURES = 1 << 14
+NGRAM_RANGE = (1, 3)
+
+
+def normalize(text):
+    """全形半形統一、英文轉小寫、去掉空白（與訓練時一致）"""
+    return "".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+def ngram_ids(text, n_features=N_FEATURES, ngram_range=NGRAM_RANGE):
+    """字元 n-gram 的雜湊桶編號；用 crc32 而不是 hash()，換 process 結果也一樣"""
+    padded = f"\x02{normalize(text)}\x03"  # 句首句尾記號，讓「嗎」在句尾和句中不同
+    lo, hi = ngram_range
+    ids = []
+    for n in range(lo, hi + 1):
+        for i in range(len(padded) - n + 1):
+            ids.append(zlib.crc32(padded[i:i + n].encode("utf-8")) % n_features)
+    return ids
+
+
+def featurize(texts, n_features=N_FEATURES, ngram_range=NGRAM_RANGE):
+    """整批轉成稀疏矩陣的三個陣列：(桶編號, 所屬訊息, 值)；值是 1/sqrt(n-gram 數)，長短句分數同一尺度"""
+    ids, segments, values = [], [], []
+    for row, text in enumerate(texts):
+        row_ids = ngram_ids(text, n_features, ngram_range)
+        ids.extend(row_ids)
+        segments.extend([row] * len(row_ids))
+        values.extend([1.0 / max(len(row_ids), 1) ** 0.5] * len(row_ids))
+    return (np.asarray(ids, dtype=np.int32),
+            np.asarray(segments, dtype=np.int32),
+            np.asarray(values, dtype=np.float32))
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+class NgramClassifier:
+    """logistic regression；predict_proba 回傳「是專業問題」的機率"""
+
+    def __init__(self, weights, bias, ngram_range=NGRAM_RANGE):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+        self.ngram_range = tuple(int(n) for n in ngram_range)
+
+    @property
+    def n_features(self):
+        return len(self.weights)
+
+    def scores(self, texts):
+        ids, segments, values = featurize(texts, self.n_features, self.ngram_range)
+        # 每則訊息的分數 = 該訊息所有 n-gram 權重的加總，一次 bincount 算完整批
+        totals = np.bincount(segments, weights=self.weights[ids] * values, minlength=len(texts))
+        return totals + self.bias
+
+    def predict_proba(self, texts):
+        return _sigmoid(self.scores(texts))
+
+    @classmethod
+    def fit(cls, texts, labels, n_features=N_FEATURES, ngram_range=NGRAM_RANGE,
+            epochs=200, learning_rate=0.5, l2=1e-4):
+        """全批次 AdaGrad（離線用；語料只有幾百到幾萬句）"""
+        y = np.asarray(labels, dtype=np.float64)
+        ids, segments, values = featurize(texts, n_features, ngram_range)
+        weights = np.zeros(n_features, dtype=np.float64)
+        bias = 0.0
+        grad_sq = np.full(n_features, 1e-8)
+        bias_sq = 1e-8
+        for _ in range(epochs):
+            totals = np.bincount(segments, weights=weights[ids] * values, minlength=len(y)) + bias
+            residual = _sigmoid(totals) - y
+            grad = np.bincount(ids, weights=residual[segments] * values, minlength=n_features) / len(y)
+            grad += l2 * weights
+            grad_sq += grad * grad
+            weights -= learning_rate * grad / np.sqrt(grad_sq)
+            bias_grad = residual.mean()
+            bias_sq += bias_grad * bias_grad
+            bias -= learning_rate * bias_grad / np.sqrt(bias_sq)
+        return cls(weights, bias, ngram_range)
+
+    def save(self, path):
+        # float16 + 壓縮：16384 桶只有十幾 KB
+        np.savez_compressed(path, weights=self.weights.astype(np.float16),
+                            bias=np.float32(self.bias),
+                            ngram_range=np.asarray(self.ngram_range, dtype=np.int8))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["weights"].astype(np.float32), float(data["bias"]),
+                       tuple(data["ngram_range"].tolist()))
+
+
+def load_classifier(path):
+    """讀權重檔；沒裝 NumPy 或檔案有問題就回 None（呼叫端改用規則）"""
+    if np is None:
+        log.warning("⚠️ 未安裝 NumPy，分流只用關鍵字規則", weights=path)
+        return None
+    try:
+        model = NgramClassifier.load(path)
+    except Exception as e:
+        log.warning("⚠️ 分流模型載入失敗，只用關鍵字規則", weights=path, error=str(e))
+        return None
+    log.info("✅ 分流模型已載入", weights=path, features=model.n_features, ngram_range=model.ngram_range)
+    return model
@@ -0,0 +1,240 @@
+# conversation.py - 每位用戶的短期對話記憶（固定輪數、依 token 預算裁切、LRU 跨用戶淘汰）
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from log import get_logger
+from ttl_cache import TTLCache
+
+log = get_logger(__name__)
+
+USER, ASSISTANT = "user", "assistant"
+
+
+def estimate_tokens(text):
+    """粗估 token 數：中日韓字約 0.6 個 token，其餘約 4 個字元 1 個 token"""
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return int(cjk * 0.6 + (len(text) - cjk) / 4) + 1
+
+
+class SQLiteConversationStore:
+    """被擠出記憶體的對話存到本機 SQLite，之後再回來時讀回"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "user_id TEXT PRIMARY KEY, turns TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def load(self, user_id, max_age):
+        row = self._conn().execute(
+            "SELECT turns FROM conversations WHERE user_id = ? AND updated_at > ?",
+            (user_id, time.time() - max_age)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, user_id, turns):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO conversations (user_id, turns, updated_at) VALUES (?, ?, ?)",
+            (user_id, json.dumps(turns, ensure_ascii=False), time.time())
+        )
+
+    def delete(self, user_id):
+        self._conn().execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
+
+
+class SupabaseConversationStore:
+    """Supabase 版（多台共用）；turns 存成 jsonb"""
+
+    def __init__(self, client, table="conversations"):
+        self.client = client
+        self.table = table
+
+    def load(self, user_id, max_age):
+        rows = self.client.table(self.table).select("turns,updated_at").eq("user_id", user_id).execute().data
+        if not rows:
+            return None
+        updated_at = datetime.fromisoformat(rows[0]["updated_at"].replace("Z", "+00:00"))
+        if (datetime.now(timezone.utc) - updated_at).total_seconds() > max_age:
+            return None
+        return rows[0]["turns"]
+
+    def save(self, user_id, turns):
+        self.client.table(self.table).upsert({
+            "user_id": user_id,
+            "turns": turns,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }, on_conflict="user_id").execute()
+
+    def delete(self, user_id):
+        self.client.table(self.table).delete().eq("user_id", user_id).execute()
+
+
+class ConversationMemory:
+    """user_id -> 最近 max_turns 輪問答；超過 maxsize 位用戶時把最久沒講話的擠到 store
+
+    寫入 store 在背景 thread 做，不佔回覆路徑；查過 store 沒有前文的用戶記在 _no_history，
+    TTL 內不再查（新用戶只在第一次訊息查一次）
+    """
+
+    def __init__(self, max_turns=6, max_chars=500, maxsize=5000, ttl=3600, store=None):
+        self.max_turns = max_turns
+        self.max_chars = max_chars  # 單則訊息最多保留的字數
+        self.ttl = ttl
+        self.store = store
+        self._users = TTLCache(maxsize=maxsize, ttl=ttl, on_evict=self._spill)
+        self._no_history = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._pending = {}  # 正在背景寫入 store 的對話，寫完前回來的用戶直接從這裡拿
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+        self.spilled = 0
+        self.restored = 0
+        self.loads_skipped = 0
+        self.trimmed_turns = 0
+        self.store_errors = 0
+
+    def _executor(self):
+        # 一個 thread 就好：依序寫入，同一用戶較新的內容不會被舊的蓋掉
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-spill")
+                    self._pid = os.getpid()
+        return self._pool
+
+    def _spill(self, user_id, turns):
+        if self.store is None or not turns:
+            return
+        snapshot = list(turns)
+        with self._lock:
+            self._pending[user_id] = snapshot
+        self._no_history.pop(user_id)
+        self._executor().submit(self._save, user_id, snapshot)
+
+    def _save(self, user_id, snapshot):
+        with self._lock:
+            if self._pending.get(user_id) is not snapshot:
+                return  # 已經被 clear() 或更新的 spill 取代
+        try:
+            self.store.save(user_id, snapshot)
+            with self._lock:
+                self.spilled += 1
+        except Exception as e:
+            log.warning("⚠️ 對話記憶寫入失敗", user_id=user_id, error=str(e))
+            with self._lock:
+                self.store_errors += 1
+        finally:
+            with self._lock:
+                if self._pending.get(user_id) is snapshot:
+                    del self._pending[user_id]
+
+    def _load(self, user_id):
+        with self._lock:
+            pending = self._pending.get(user_id)
+        if pending is not None:
+            return pending
+        if self._no_history.get(user_id) is not None:
+            with self._lock:
+                self.loads_skipped += 1
+            return None
+        try:
+            saved = self.store.load(user_id, self.ttl)
+        except Exception as e:
+            log.warning("⚠️ 對話記憶讀取失敗", user_id=user_id, error=str(e))
+            with self._lock:
+                self.store_errors += 1
+            return None
+        if not saved:
+            self._no_history.set(user_id, True)
+        return saved
+
+    def _turns(self, user_id, create=False):
+        turns = self._users.get(user_id)
+        if turns is None and self.store is not None:
+            saved = self._load(user_id)
+            if saved:
+                turns = deque((tuple(t) for t in saved), maxlen=self.max_turns * 2)
+                self._users.set(user_id, turns)
+                with self._lock:
+                    self.restored += 1
+        if turns is None and create:
+            turns = deque(maxlen=self.max_turns * 2)
+            self._users.set(user_id, turns)
+        return turns
+
+    def history(self, user_id, token_budget):
+        """回傳要放在本次問題前面的 messages；從最新往回取，整輪超出預算就停"""
+        if not user_id:
+            return []
+        turns = self._turns(user_id)
+        if not turns:
+            return []
+        with self._lock:
+            snapshot = list(turns)
+        kept, used = [], 0
+        # 兩則一組（user + assistant）從新到舊
+        for i in range(len(snapshot) - 2, -1, -2):
+            pair = snapshot[i:i + 2]
+            cost = sum(estimate_tokens(text) for _, text in pair)
+            if used + cost > token_budget:
+                with self._lock:
+                    self.trimmed_turns += (i + 2) // 2
+                break
+            kept[:0] = pair
+            used += cost
+        return [{"role": role, "content": text} for role, text in kept]
+
+    def append(self, user_id, question, answer):
+        if not user_id or not answer:
+            return
+        turns = self._turns(user_id, create=True)
+        with self._lock:
+            turns.append((USER, question[:self.max_chars]))
+            turns.append((ASSISTANT, answer[:self.max_chars]))
+        # 重新 set 一次，刷新 TTL 與 LRU 位置
+        self._users.set(user_id, turns)
+
+    def clear(self, user_id):
+        self._users.pop(user_id)
+        with self._lock:
+            self._pending.pop(user_id, None)
+        if self.store is not None:
+            self._no_history.set(user_id, True)
+            try:
+                self.store.delete(user_id)
+            except Exception as e:
+                log.warning("⚠️ 對話記憶刪除失敗", user_id=user_id, error=str(e))
+
+    def stats(self):
+        cache = self._users.stats()
+        with self._lock:
+            return {
+                "users": cache["size"],
+                "maxsize": cache["maxsize"],
+                "evictions": cache["evictions"],
+                "spilled": self.spilled,
+                "restored": self.restored,
+                "pending_spills": len(self._pending),
+                "loads_skipped": self.loads_skipped,
+                "trimmed_turns": self.trimmed_turns,
+                "store_errors": self.store_errors,
+                "shared": self.store is not None,
+            }
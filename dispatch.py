@@ -0,0 +1,136 @@
+# dispatch.py - 一個 webhook body 內的多個事件：同一用戶依序處理，不同用戶平行處理
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from log import get_logger
+
+log = get_logger(__name__)
+
+# 同一用戶的加好友 / 封鎖先處理，後面的訊息才看得到訂閱狀態
+PRIORITY_EVENTS = ("FollowEvent", "UnfollowEvent")
+
+
+def source_key(event):
+    """分組依據：userId；群組裡沒給 userId 時用群組 / 聊天室 id"""
+    source = getattr(event, "source", None)
+    for attr in ("user_id", "group_id", "room_id"):
+        value = getattr(source, attr, None)
+        if value:
+            return value
+    return f"event:{id(event)}"
+
+
+def partition(events):
+    """user -> [事件]；保留原本順序，只把 follow / unfollow 提到同一用戶的最前面"""
+    groups = OrderedDict()
+    for event in events:
+        groups.setdefault(source_key(event), []).append(event)
+    for key, items in groups.items():
+        items.sort(key=lambda e: type(e).__name__ not in PRIORITY_EVENTS)  # sort 是穩定的
+    return groups
+
+
+class OrderedDispatcher:
+    """照 WebhookHandler 的對應規則找出 handler，分組丟到有上限的 thread pool"""
+
+    def __init__(self, webhook_handler, max_workers=8, deadline=10.0):
+        self.webhook_handler = webhook_handler
+        self.max_workers = max_workers
+        self.deadline = deadline
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._arg_counts = {}
+
+        self.bodies = 0
+        self.events = 0
+        self.parallel_bodies = 0
+        self.failed = 0
+        self.late_bodies = 0
+        self.max_groups = 0
+
+    def _executor(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="webhook-dispatch")
+                    self._pid = os.getpid()
+        return self._pool
+
+    def _find(self, event):
+        # 與 WebhookHandler.handle 相同：先找「事件_訊息」，再找「事件」，最後是 default
+        handlers = self.webhook_handler._handlers
+        func = None
+        message = getattr(event, "message", None)
+        if message is not None:
+            func = handlers.get(f"{type(event).__name__}_{type(message).__name__}")
+        if func is None:
+            func = handlers.get(type(event).__name__)
+        return func or self.webhook_handler._default
+
+    def _invoke(self, func, event, destination):
+        count = self._arg_counts.get(func)
+        if count is None:
+            count = len(inspect.signature(func).parameters)
+            self._arg_counts[func] = count
+        if count >= 2:
+            func(event, destination)
+        else:
+            func(event)
+
+    def _run_group(self, events, destination):
+        for event in events:
+            func = self._find(event)
+            if func is None:
+                log.info("沒有對應的 handler", event=type(event).__name__)
+                continue
+            try:
+                self._invoke(func, event, destination)
+            except Exception:
+                # 一個事件失敗不影響同一個 body 裡的其他事件
+                log.exception("❌ 事件處理失敗", event=type(event).__name__, source=source_key(event))
+                with self._lock:
+                    self.failed += 1
+
+    def dispatch(self, events, destination=None):
+        groups = partition(events)
+        with self._lock:
+            self.bodies += 1
+            self.events += len(events)
+            self.max_groups = max(self.max_groups, len(groups))
+        if len(groups) <= 1:
+            # 常見情況：一個 body 只有一個用戶，直接在目前的 thread 跑
+            for items in groups.values():
+                self._run_group(items, destination)
+            return
+
+        with self._lock:
+            self.parallel_bodies += 1
+        started = time.monotonic()
+        pool = self._executor()
+        futures = [pool.submit(self._run_group, items, destination) for items in groups.values()]
+        _, pending = wait(futures, timeout=self.deadline)
+        if pending:
+            # 超過期限就先回應，剩下的繼續在背景跑（reply token 過期會自動改 push）
+            with self._lock:
+                self.late_bodies += 1
+            log.warning("⏰ webhook body 超過處理期限，其餘事件在背景完成",
+                        groups=len(groups), pending=len(pending),
+                        elapsed=round(time.monotonic() - started, 2))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "deadline": self.deadline,
+                "bodies": self.bodies,
+                "events": self.events,
+                "parallel_bodies": self.parallel_bodies,
+                "max_groups": self.max_groups,
+                "late_bodies": self.late_bodies,
+                "failed": self.failed,
+            }
@@ -0,0 +1,149 @@
+# event_dedupe.py - webhookEventId 去重（LINE 重送的事件不再重跑 Supabase / DeepSeek）
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from log import get_logger
+from ttl_cache import TTLCache
+
+log = get_logger(__name__)
+
+
+class SQLiteEventStore:
+    """本機 SQLite 版已處理事件表（同一台機器的多個 worker 共用）"""
+
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._claims = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS webhook_events ("
+            "event_id TEXT PRIMARY KEY, received_at REAL NOT NULL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def claim(self, event_id):
+        conn = self._conn()
+        now = time.time()
+        self._claims += 1
+        if self._claims % 1000 == 0:
+            conn.execute("DELETE FROM webhook_events WHERE received_at < ?", (now - self.ttl,))
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO webhook_events (event_id, received_at) VALUES (?, ?)", (event_id, now)
+        )
+        return cur.rowcount == 1
+
+    def release(self, event_id):
+        self._conn().execute("DELETE FROM webhook_events WHERE event_id = ?", (event_id,))
+
+
+class SupabaseEventStore:
+    """Supabase（Postgres）版：insert ... on conflict do nothing，回傳空代表別台已處理"""
+
+    def __init__(self, client, table="webhook_events"):
+        self.client = client
+        self.table = table
+
+    def claim(self, event_id):
+        data = self.client.table(self.table)\
+            .upsert({"event_id": event_id}, on_conflict="event_id", ignore_duplicates=True)\
+            .execute().data
+        return bool(data)
+
+    def release(self, event_id):
+        self.client.table(self.table).delete().eq("event_id", event_id).execute()
+
+
+class EventDeduper:
+    """記憶體 TTL 集合 + 可選的共用表；claim() 第一次回 True，重複回 False"""
+
+    def __init__(self, ttl=86400, maxsize=100000, store=None):
+        self.store = store
+        self._seen = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+        self.claimed = 0
+        self.duplicates = 0
+        self.shared_duplicates = 0
+        self.store_errors = 0
+
+    def _background(self, func, *args):
+        # 首次投遞不可能在別台出現過，共用表的寫入不必卡住請求
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="event-dedupe")
+                    self._pid = os.getpid()
+        self._executor.submit(func, *args)
+
+    def _store_claim(self, event_id):
+        try:
+            return self.store.claim(event_id)
+        except Exception as e:
+            # 共用表壞掉時寧可重複處理，也不要把事件吃掉
+            log.warning("⚠️ 事件去重表寫入失敗", event_id=event_id, error=str(e))
+            with self._lock:
+                self.store_errors += 1
+            return True
+
+    def claim(self, event_id, redelivery=False):
+        with self._lock:
+            if self._seen.get(event_id) is not None:
+                self.duplicates += 1
+                return False
+            self._seen.set(event_id, {"work": None})
+        if self.store is not None:
+            if not redelivery:
+                self._background(self._store_claim, event_id)
+            elif not self._store_claim(event_id):
+                with self._lock:
+                    self.duplicates += 1
+                    self.shared_duplicates += 1
+                return False
+        with self._lock:
+            self.claimed += 1
+        return True
+
+    def release(self, event_id):
+        """處理失敗時放掉，讓 LINE 的重送可以再試一次"""
+        self._seen.pop(event_id)
+        if self.store is not None:
+            try:
+                self.store.release(event_id)
+            except Exception as e:
+                log.warning("⚠️ 事件去重表刪除失敗", event_id=event_id, error=str(e))
+
+    def note(self, event_id, work):
+        """記下這個事件做了哪種昂貴工作（例如 deepseek），重複時拿來統計省下多少"""
+        record = self._seen.get(event_id)
+        if record is not None:
+            record["work"] = work
+
+    def work(self, event_id):
+        record = self._seen.get(event_id)
+        return record["work"] if record else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "claimed": self.claimed,
+                "duplicates": self.duplicates,
+                "shared_duplicates": self.shared_duplicates,
+                "store_errors": self.store_errors,
+                "tracked": len(self._seen),
+                "shared": self.store is not None,
+            }
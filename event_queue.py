@@ -0,0 +1,216 @@
+# event_queue.py - Webhook 背景處理佇列（先回 200，再慢慢處理）
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from log import get_logger
+
+log = get_logger(__name__)
+
+RECOVER_PAGE_SIZE = 200
+
+
+def _pid_alive(pid):
+    """同一台機器上的 process 還在不在（SQLite 佇列只會在同機 worker 之間共用）"""
+    if pid is None or pid == os.getpid():
+        # 自己的 pid 出現在表裡只可能是上一個用過這個 pid 的 process 留下的
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class EventQueue:
+    """有界的 webhook 佇列 + worker pool，可選 SQLite 持久化（重啟不掉事件）
+
+    多個 worker 共用同一個 SQLite 檔時，每列記下 owner（寫入的 pid）；
+    啟動時只接手 owner 已經不在的列，不會把別的 worker 正在處理的事件再跑一次
+    """
+
+    def __init__(self, process_func, maxsize=1000, workers=4, sqlite_path=None):
+        self.process_func = process_func
+        self.maxsize = maxsize
+        self.workers = workers
+        self.sqlite_path = sqlite_path
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._started = False
+        self._pid = None
+
+        # 背壓統計
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.busy_workers = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    # ---------- 啟動（lazy，fork 之後才開 thread / 連線）----------
+    def start(self):
+        with self._lock:
+            if self._started and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.maxsize)
+            self._threads = []
+            self._pid = os.getpid()
+            if self.sqlite_path:
+                self._open_db()
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"webhook-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            if self._db is not None:
+                # 認領在持有 self._lock 時完成，submit() 還進不來；之後寫入的列 id 一定大於 max_id
+                claimed, max_id = self._claim_orphans()
+                if claimed:
+                    # 接手的列可能比佇列容量多，交給背景 thread 分頁慢慢排入（worker 已經在消化）
+                    log.info("♻️ 從 SQLite 復原未處理事件", count=claimed)
+                    threading.Thread(target=self._recover, args=(max_id,), name="webhook-recover",
+                                     daemon=True).start()
+            self._started = True
+            log.info("✅ Webhook 背景佇列已啟動", workers=self.workers, maxsize=self.maxsize)
+
+    def _open_db(self):
+        self._db = sqlite3.connect(self.sqlite_path, timeout=30, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS webhook_queue ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, body TEXT NOT NULL, "
+            "signature TEXT NOT NULL, received_at REAL NOT NULL, owner INTEGER)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(webhook_queue)")}
+        if "owner" not in columns:  # 舊版的表沒有 owner，留下的列視為無主
+            self._db.execute("ALTER TABLE webhook_queue ADD COLUMN owner INTEGER")
+        self._db.commit()
+
+    def _claim_orphans(self):
+        """把 owner 已經不在的列改成自己的；UPDATE ... WHERE owner = 舊值 是原子的，兩個 worker 不會搶到同一列
+
+        回傳 (認領筆數, 認領當下的最大 id)；復原只排入 id <= max_id 的列，
+        之後 submit() 寫入的列（owner 也是自己）由 submit() 自己排入，不會被重複處理
+        """
+        me = os.getpid()
+        claimed = 0
+        try:
+            with self._db_lock:
+                max_id = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM webhook_queue").fetchone()[0]
+                owners = [row[0] for row in self._db.execute(
+                    "SELECT DISTINCT owner FROM webhook_queue WHERE id <= ?", (max_id,))]
+                for owner in owners:
+                    if _pid_alive(owner):
+                        continue
+                    if owner is None:
+                        cur = self._db.execute(
+                            "UPDATE webhook_queue SET owner = ? WHERE owner IS NULL AND id <= ?", (me, max_id))
+                    else:
+                        cur = self._db.execute(
+                            "UPDATE webhook_queue SET owner = ? WHERE owner = ? AND id <= ?", (me, owner, max_id))
+                    claimed += cur.rowcount
+                self._db.commit()
+        except Exception:
+            log.exception("❌ 認領 webhook 佇列失敗")
+            return 0, 0
+        return claimed, max_id
+
+    def _recover(self, max_id):
+        """接手已結束 process 沒處理完的事件，分頁排回佇列（佇列滿就等 worker 消化）"""
+        try:
+            last_id = 0
+            while True:
+                with self._db_lock:
+                    rows = self._db.execute(
+                        "SELECT id, body, signature, received_at FROM webhook_queue "
+                        "WHERE owner = ? AND id > ? AND id <= ? ORDER BY id LIMIT ?",
+                        (os.getpid(), last_id, max_id, RECOVER_PAGE_SIZE)
+                    ).fetchall()
+                for row in rows:
+                    self._queue.put(row)
+                    last_id = row[0]
+                if len(rows) < RECOVER_PAGE_SIZE:
+                    return
+        except Exception:
+            log.exception("❌ 復原 webhook 佇列失敗")
+
+    # ---------- 入列 ----------
+    def submit(self, body, signature):
+        """放入佇列；滿了回傳 False，讓呼叫端自行決定（例如同步處理）"""
+        self.start()
+        received_at = time.time()
+        row_id = None
+        if self._db is not None:
+            with self._db_lock:
+                cur = self._db.execute(
+                    "INSERT INTO webhook_queue (body, signature, received_at, owner) VALUES (?, ?, ?, ?)",
+                    (body, signature, received_at, os.getpid())
+                )
+                self._db.commit()
+                row_id = cur.lastrowid
+        try:
+            self._queue.put_nowait((row_id, body, signature, received_at))
+        except queue.Full:
+            self._delete(row_id)
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def _delete(self, row_id):
+        if row_id is None or self._db is None:
+            return
+        with self._db_lock:
+            self._db.execute("DELETE FROM webhook_queue WHERE id = ?", (row_id,))
+            self._db.commit()
+
+    # ---------- Worker ----------
+    def _worker(self):
+        while True:
+            row_id, body, signature, received_at = self._queue.get()
+            wait = time.time() - received_at
+            with self._lock:
+                self.busy_workers += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            try:
+                self.process_func(body, signature)
+                with self._lock:
+                    self.processed += 1
+            except Exception:
+                log.exception("❌ 背景處理 webhook 失敗")
+                with self._lock:
+                    self.failed += 1
+            finally:
+                self._delete(row_id)
+                with self._lock:
+                    self.busy_workers -= 1
+                self._queue.task_done()
+
+    def stats(self):
+        with self._lock:
+            done = self.processed + self.failed
+            return {
+                "depth": self._queue.qsize(),
+                "maxsize": self.maxsize,
+                "workers": self.workers,
+                "busy_workers": self.busy_workers,
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "max_depth": self.max_depth,
+                "avg_wait_ms": round(self.total_wait / done * 1000, 1) if done else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 1),
+                "durable": self._db is not None,
+            }
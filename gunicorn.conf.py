@@ -0,0 +1,30 @@
+# gunicorn.conf.py - 正式環境啟動設定：gunicorn -c gunicorn.conf.py
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+wsgi_app = "app:create_app()"
+
+# webhook 大多在等 DeepSeek / LINE / Supabase，用 thread 撐併發比開很多 process 省記憶體
+worker_class = "gthread"
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 20
+keepalive = 5
+
+# master 先匯入一次再 fork，worker 啟動只剩 fork 的成本；
+# app 匯入時不建連線、不開 thread（都在 post_worker_init 之後才做），所以 preload 是安全的
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+
+# 每個 worker 都會開排程器，推播靠租約表協調；各 worker 記憶體裡的表彼此看不到。
+# 有 Supabase 就用 Supabase 的租約表（需先執行 sql/push_leases.sql），多台機器也只推一次；
+# 沒有的話退回同機共用的 SQLite 檔，只能協調同一台機器上的 worker
+if os.getenv('SUPABASE_URL') and os.getenv('SUPABASE_KEY'):
+    os.environ.setdefault('PUSH_LEASE_BACKEND', 'supabase')
+else:
+    os.environ.setdefault('PUSH_LEASE_BACKEND', 'sqlite')
+
+
+def post_worker_init(worker):
+    import app
+    app.init_worker()
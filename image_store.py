@@ -0,0 +1,293 @@
+# image_store.py - 用戶圖片落地暫存（分塊寫檔、總容量上限、TTL + LRU 淘汰）與背景下載 worker
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from log import get_logger
+
+log = get_logger(__name__)
+
+
+class ImageTooLarge(Exception):
+    """單張圖片超過 max_file_bytes，寫到一半就放棄"""
+
+
+class ImageStore:
+    """key -> 磁碟上的檔案；記憶體裡只留路徑與大小，不留圖片內容
+
+    同一個目錄可能有好幾個 worker 在寫，各自的記帳只管自己的檔案；
+    容量上限靠定期掃整個目錄（依 mtime 刪過期、再從最舊刪到容量以內）來保證
+    """
+
+    def __init__(self, directory=None, max_bytes=200 * 1024 * 1024, max_files=1000,
+                 ttl=3600, max_file_bytes=20 * 1024 * 1024, sweep_interval=10):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "dpbot-images")
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.ttl = ttl
+        self.max_file_bytes = max_file_bytes
+        self.sweep_interval = sweep_interval
+        self._files = OrderedDict()  # key -> (path, size, stored_at)
+        self._total = 0
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._last_sweep = 0.0
+
+        self.stored = 0
+        self.evicted = 0
+        self.expired = 0
+        self.too_large = 0
+        self.bytes_written = 0
+        self.swept = 0
+        self.dir_bytes = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.sweep()
+
+    def sweep(self):
+        """掃整個目錄（包含其他 worker、已結束 process 的檔案）：刪過期的，再從最舊的刪到總容量以內"""
+        with self._sweep_lock:
+            self._last_sweep = time.monotonic()
+            now = time.time()
+            entries = []
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                # 寫到一半的 .part 只有超過 TTL（寫入的 process 多半已經死了）才刪
+                if now - st.st_mtime >= self.ttl:
+                    self._unlink([path])
+                    self.swept += 1
+                elif name.endswith(".img"):
+                    entries.append((st.st_mtime, st.st_size, path))
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            count = len(entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes and count <= self.max_files:
+                    break
+                self._unlink([path])
+                self.swept += 1
+                total -= size
+                count -= 1
+            self.dir_bytes = total
+
+        # 被刪掉的檔案（可能是別的 worker 刪的）從自己的記帳拿掉
+        with self._lock:
+            for key, (path, size, _) in list(self._files.items()):
+                if not os.path.exists(path):
+                    del self._files[key]
+                    self._total -= size
+
+    def _maybe_sweep(self):
+        if time.monotonic() - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+
+    def _path(self, key):
+        safe = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in key)
+        return os.path.join(self.directory, f"{os.getpid()}-{safe}.img")
+
+    def save(self, key, chunks):
+        """把 chunks（bytes 的 iterable）一塊一塊寫進檔案，回傳路徑"""
+        path = self._path(key)
+        partial = path + ".part"
+        size = 0
+        try:
+            with open(partial, "wb") as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_file_bytes:
+                        raise ImageTooLarge(f"{key} 超過 {self.max_file_bytes} bytes")
+                    f.write(chunk)
+            os.replace(partial, path)
+        except ImageTooLarge:
+            with self._lock:
+                self.too_large += 1
+            raise
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+        with self._lock:
+            old = self._files.pop(key, None)
+            if old:
+                self._total -= old[1]
+            self._files[key] = (path, size, time.monotonic())
+            self._total += size
+            self.stored += 1
+            self.bytes_written += size
+            victims = self._evict_locked()
+        self._unlink(victims)
+        self._maybe_sweep()
+        return path
+
+    def _evict_locked(self):
+        victims = []
+        now = time.monotonic()
+        # 先丟過期的（最舊的在前面）
+        while self._files:
+            key, (path, size, stored_at) = next(iter(self._files.items()))
+            if now - stored_at < self.ttl:
+                break
+            self._files.popitem(last=False)
+            self._total -= size
+            self.expired += 1
+            victims.append(path)
+        # 再依 LRU 丟到容量以內
+        while self._files and (self._total > self.max_bytes or len(self._files) > self.max_files):
+            _, (path, size, _) = self._files.popitem(last=False)
+            self._total -= size
+            self.evicted += 1
+            victims.append(path)
+        return victims
+
+    @staticmethod
+    def _unlink(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, key):
+        """回傳檔案路徑（並標記為最近使用）；不存在或過期回傳 None"""
+        with self._lock:
+            item = self._files.get(key)
+            if item is None:
+                return None
+            path, size, stored_at = item
+            if time.monotonic() - stored_at >= self.ttl:
+                del self._files[key]
+                self._total -= size
+                self.expired += 1
+                expired = path
+            else:
+                self._files.move_to_end(key)
+                try:
+                    os.utime(path)  # 目錄掃描依 mtime 判斷新舊，讀取也算使用
+                except OSError:
+                    pass
+                return path
+        self._unlink([expired])
+        return None
+
+    def remove(self, key):
+        with self._lock:
+            item = self._files.pop(key, None)
+            if item:
+                self._total -= item[1]
+        if item:
+            self._unlink([item[0]])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files": len(self._files),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "stored": self.stored,
+                "evicted": self.evicted,
+                "expired": self.expired,
+                "too_large": self.too_large,
+                "bytes_written": self.bytes_written,
+                "swept": self.swept,
+                "dir_bytes": self.dir_bytes,
+            }
+
+
+def _close_content(content):
+    """LINE 的 MessageContent 沒有 close()；往下找到 requests 的 response 關掉，連線才會回到連線池"""
+    target = content
+    for _ in range(3):
+        close = getattr(target, "close", None)
+        if callable(close):
+            close()
+            return
+        target = getattr(target, "response", None)
+        if target is None:
+            return
+
+
+class ImagePipeline:
+    """有界佇列 + worker：下載圖片（分塊）→ 存進 ImageStore → 交給 analyze_func"""
+
+    def __init__(self, store, fetch_func, analyze_func=None, workers=2, maxsize=100, chunk_size=64 * 1024):
+        # fetch_func(message_id) 回傳有 iter_content(chunk_size) 的物件（LINE 的 MessageContent）
+        # analyze_func(user_id, message_id, path) 之後接影像辨識用，可為 None
+        self.store = store
+        self.fetch_func = fetch_func
+        self.analyze_func = analyze_func
+        self.workers = workers
+        self.maxsize = maxsize
+        self.chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._pid = None
+
+        self.submitted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.maxsize)
+            for i in range(self.workers):
+                threading.Thread(target=self._worker, name=f"image-worker-{i}", daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, user_id, message_id):
+        """放進佇列；滿了回傳 False（這張圖就不下載）"""
+        self.start()
+        try:
+            self._queue.put_nowait((user_id, message_id))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def _worker(self):
+        while True:
+            user_id, message_id = self._queue.get()
+            try:
+                content = self.fetch_func(message_id)
+                try:
+                    path = self.store.save(message_id, content.iter_content(chunk_size=self.chunk_size))
+                finally:
+                    # 超過大小上限時 body 只讀了一半，不關掉的話這條連線一直佔著
+                    _close_content(content)
+                if self.analyze_func:
+                    self.analyze_func(user_id, message_id, path)
+                with self._lock:
+                    self.processed += 1
+            except Exception as e:
+                log.warning("⚠️ 圖片下載 / 處理失敗", user_id=user_id, message_id=message_id, error=str(e))
+                with self._lock:
+                    self.failed += 1
+            finally:
+                self._queue.task_done()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "depth": self._queue.qsize(),
+                "maxsize": self.maxsize,
+                "workers": self.workers,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "processed": self.processed,
+                "failed": self.failed,
+                "store": self.store.stats(),
+            }
@@ -0,0 +1,57 @@
+# keyword_index.py - 關鍵字 Aho-Corasick 自動機（一次掃描找出所有命中）
+from collections import deque
+
+
+class KeywordIndex:
+    """把多組關鍵字表編成一個自動機，掃一遍文字就回傳每組命中的關鍵字"""
+
+    def __init__(self, groups):
+        # groups: {組名: 關鍵字列表}，同一個字可以屬於多組
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self.size = 0
+        for group, keywords in groups.items():
+            for keyword in keywords:
+                self._add(keyword, group)
+        self._build()
+
+    def _add(self, keyword, group):
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((group, keyword))
+        self.size += 1
+
+    def _build(self):
+        todo = deque(self._goto[0].values())
+        while todo:
+            state = todo.popleft()
+            for ch, nxt in self._goto[state].items():
+                todo.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def scan(self, text):
+        """回傳 {組名: set(命中關鍵字)}"""
+        hits = {}
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for group, keyword in out[state]:
+                    hits.setdefault(group, set()).add(keyword)
+        return hits
@@ -0,0 +1,43 @@
+# lazy_client.py - 延遲建立的外部 client（第一次用到才建；fork 之後自動重建）
+import os
+import threading
+
+
+class LazyClient:
+    """把 factory() 建出來的物件包起來，屬性存取都轉給它
+
+    gunicorn --preload 時 master 只匯入程式，不會建連線；每個 worker 第一次用到時各自建立，
+    不會有 fork 前後共用 socket 的問題。enabled=False 時 bool(client) 為 False（沿用 `if supabase:` 寫法）
+    """
+
+    def __init__(self, factory, enabled=True, name=None):
+        self._factory = factory
+        self._enabled = enabled
+        self._name = name or getattr(factory, "__name__", "client")
+        self._instance = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if not self._enabled:
+            raise RuntimeError(f"{self._name} 未設定")
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._instance = self._factory()
+                    self._pid = os.getpid()
+        return self._instance
+
+    def created(self):
+        """這個 process 是否已經建立過（給 /stats 看）"""
+        return self._pid == os.getpid()
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __bool__(self):
+        return self._enabled
+
+    def __repr__(self):
+        state = "created" if self.created() else "lazy"
+        return f"<LazyClient {self._name} {state if self._enabled else 'disabled'}>"
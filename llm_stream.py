@@ -0,0 +1,94 @@
+# llm_stream.py - DeepSeek 串流回應（SSE）解析：字數到了就在句尾切斷
+import json
+import threading
+import time
+
+SENTENCE_ENDINGS = "。！？!?～\n"
+
+
+def read_stream(response, char_budget, hard_cap=None, started_at=None, usage=None):
+    """邊收邊組字；超過 char_budget 且剛好是句尾就停止，最多不超過 hard_cap
+
+    回傳 (text, 首字延遲秒數, 是否提前切斷)；呼叫端負責關閉 response
+    usage 傳入 dict 時，串流最後的 usage 區塊會寫進去（提前切斷就收不到）
+    """
+    started_at = started_at or time.monotonic()
+    hard_cap = hard_cap or int(char_budget * 1.5)
+    parts = []
+    length = 0
+    ttft = None
+    # SSE 規定是 UTF-8；Content-Type 沒帶 charset 時 requests 會猜 ISO-8859-1，中文會變亂碼
+    response.encoding = "utf-8"
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        payload = line[5:].strip()
+        if payload == "[DONE]":
+            break
+        chunk = json.loads(payload)
+        if usage is not None and chunk.get("usage"):
+            usage.update(chunk["usage"])
+        choices = chunk.get("choices") or []
+        if not choices:
+            continue
+        delta = choices[0].get("delta", {}).get("content") or ""
+        if not delta:
+            continue
+        if ttft is None:
+            ttft = time.monotonic() - started_at
+        parts.append(delta)
+        length += len(delta)
+        if length >= char_budget:
+            text = "".join(parts).rstrip()
+            if text and text[-1] in SENTENCE_ENDINGS:
+                return text, ttft, True
+            if length >= hard_cap:
+                return cut_at_sentence(text, char_budget, hard_cap), ttft, True
+    return "".join(parts).strip(), ttft, False
+
+
+def cut_at_sentence(text, min_length, max_length=None):
+    """切在 max_length 以內最後一個句尾（至少保留 min_length 的一半）；找不到就硬切在 max_length"""
+    if max_length is not None:
+        text = text[:max_length]
+    cut = max(text.rfind(ch) for ch in SENTENCE_ENDINGS)
+    if cut + 1 >= min_length // 2:
+        return text[:cut + 1].strip()
+    return text.strip()
+
+
+class LatencyStats:
+    """各模式的首字延遲 / 總延遲統計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def record(self, mode, ttft, total, cut_early=False):
+        with self._lock:
+            d = self._data.setdefault(mode, {
+                "count": 0, "ttft_sum": 0.0, "ttft_max": 0.0,
+                "total_sum": 0.0, "total_max": 0.0, "cut_early": 0
+            })
+            d["count"] += 1
+            if ttft is not None:
+                d["ttft_sum"] += ttft
+                d["ttft_max"] = max(d["ttft_max"], ttft)
+            d["total_sum"] += total
+            d["total_max"] = max(d["total_max"], total)
+            if cut_early:
+                d["cut_early"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                mode: {
+                    "count": d["count"],
+                    "ttft_avg_ms": round(d["ttft_sum"] / d["count"] * 1000, 1),
+                    "ttft_max_ms": round(d["ttft_max"] * 1000, 1),
+                    "total_avg_ms": round(d["total_sum"] / d["count"] * 1000, 1),
+                    "total_max_ms": round(d["total_max"] * 1000, 1),
+                    "cut_early": d["cut_early"],
+                }
+                for mode, d in self._data.items()
+            }
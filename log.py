@@ -0,0 +1,132 @@
+# log.py - 非阻塞的結構化 log（JSON 一行一筆，經由佇列交給背景 thread 寫出）
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """DEBUG 只留 rate 比例（逐則訊息的除錯 log 量太大）"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """佇列滿了就丟掉並計數，絕不讓請求 / 推播 thread 等待 stdout"""
+
+    def __init__(self, maxsize, target):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.target = target
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_listener(self):
+        # 背景 thread 不會跟著 fork，換了 process 就重開一個
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+                self._listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def prepare(self, record):
+        # 先在呼叫端把例外轉成文字，其餘格式化交給背景 thread
+        if record.exc_info:
+            record.fields = {**(getattr(record, "fields", None) or {}),
+                             "exc": logging.Formatter().formatException(record.exc_info)}
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        if self._listener and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+
+
+class StructuredLogger:
+    """logger.info("訊息", user_id=..., mode=...)：額外欄位會寫進 JSON"""
+
+    def __init__(self, logger):
+        self._logger = logger
+
+    def _log(self, level, msg, fields, exc_info=False):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, msg, extra={"fields": fields}, exc_info=exc_info)
+
+    def debug(self, msg, **fields):
+        self._log(logging.DEBUG, msg, fields)
+
+    def info(self, msg, **fields):
+        self._log(logging.INFO, msg, fields)
+
+    def warning(self, msg, **fields):
+        self._log(logging.WARNING, msg, fields)
+
+    def error(self, msg, **fields):
+        self._log(logging.ERROR, msg, fields)
+
+    def exception(self, msg, **fields):
+        self._log(logging.ERROR, msg, fields, exc_info=True)
+
+
+_handler = None
+
+
+def setup_logging(level="INFO", debug_sample_rate=1.0, queue_size=10000, stream=None):
+    """把 root logger 接到非阻塞 JSON handler；重複呼叫只會設定一次"""
+    global _handler
+    if _handler is not None:
+        return _handler
+    target = logging.StreamHandler(stream or sys.stdout)
+    target.setFormatter(JsonFormatter())
+    _handler = NonBlockingQueueHandler(queue_size, target)
+    _handler.addFilter(SampleFilter(debug_sample_rate))
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(level)
+    atexit.register(_handler.stop)
+    return _handler
+
+
+def get_logger(name):
+    return StructuredLogger(logging.getLogger(name))
@@ -0,0 +1,110 @@
+# push_fanout.py - 每日推播 multicast 分批發送（並行 + 限速 + 429 退避重試）
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from linebot.exceptions import LineBotApiError
+
+from log import get_logger
+
+log = get_logger(__name__)
+
+MULTICAST_LIMIT = 500  # LINE multicast 每次最多 500 人
+
+
+class RateLimiter:
+    """簡單的 token bucket，每秒最多 rate 次"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _retry_after(error):
+    headers = getattr(error, 'headers', None) or {}
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def multicast_fanout(line_bot_api, user_ids, messages, on_delivered=None,
+                     chunk_size=MULTICAST_LIMIT, concurrency=4, rate_per_sec=50,
+                     max_retries=5, base_delay=1.0, should_continue=None):
+    """把同一則訊息 multicast 給 user_ids；每批成功後呼叫 on_delivered(批次 user_ids)
+
+    should_continue() 回傳 False 時（例如租約被接手）剩下的批次不送，計入 skipped
+    回傳 {'sent': 成功人數, 'failed': [失敗的 user_id], 'skipped': 未送人數, 'requests': API 呼叫次數, 'retries': 重試次數}
+    """
+    limiter = RateLimiter(rate_per_sec)
+    lock = threading.Lock()
+    result = {'sent': 0, 'failed': [], 'skipped': 0, 'requests': 0, 'retries': 0}
+
+    def send_chunk(chunk):
+        if should_continue and not should_continue():
+            with lock:
+                result['skipped'] += len(chunk)
+            return
+        # 同一批重試用同一個 retry key，LINE 會擋掉重複送出（回 409）
+        retry_key = str(uuid.uuid4())
+        for attempt in range(max_retries + 1):
+            limiter.acquire()
+            with lock:
+                result['requests'] += 1
+                if attempt:
+                    result['retries'] += 1
+            try:
+                line_bot_api.multicast(chunk, messages, retry_key=retry_key)
+                break
+            except LineBotApiError as e:
+                if e.status_code == 409:
+                    break  # 上一次其實已經送達
+                retryable = e.status_code == 429 or e.status_code >= 500
+                if not retryable or attempt == max_retries:
+                    log.error("❌ multicast 失敗", recipients=len(chunk), status=e.status_code, error=str(e))
+                    with lock:
+                        result['failed'].extend(chunk)
+                    return
+                delay = _retry_after(e) or base_delay * (2 ** attempt)
+            except Exception as e:
+                if attempt == max_retries:
+                    log.error("❌ multicast 失敗", recipients=len(chunk), error=str(e))
+                    with lock:
+                        result['failed'].extend(chunk)
+                    return
+                delay = base_delay * (2 ** attempt)
+            time.sleep(delay + random.uniform(0, delay / 2))
+
+        with lock:
+            result['sent'] += len(chunk)
+        if on_delivered:
+            try:
+                on_delivered(chunk)
+            except Exception as e:
+                log.warning("⚠️ 推播已送達但更新紀錄失敗", recipients=len(chunk), error=str(e))
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="multicast") as pool:
+        list(pool.map(send_chunk, chunked(list(user_ids), chunk_size)))
+    return result
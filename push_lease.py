@@ -0,0 +1,295 @@
+# push_lease.py - 多 worker / 多機協調每日推播：以資料表租約（lease）分配 shard
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+from log import get_logger
+
+log = get_logger(__name__)
+
+PAYLOAD_SHARD = -1  # 存放整個 job 共用資料（例如今日知識）的特殊列
+KEY_SPACE = 16 ** 4  # LINE user_id = "U" + 32 位 hex，用前 4 位切 shard
+
+
+def or_filter(query, filters):
+    """PostgREST 的 or=(a,b) 條件；requirements 釘住的 postgrest-py 0.10/0.11 沒有 .or_()，直接加查詢參數"""
+    query.params = query.params.add("or", f"({filters})")
+    return query
+
+
+def worker_id():
+    """host:pid:亂數，辨識是哪個 worker 拿到租約"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def shard_bounds(shard, num_shards):
+    """shard 對應的 user_id 範圍 [lo, hi)；第一片 lo=None、最後一片 hi=None（不漏掉格式怪的 id）"""
+    lo = None if shard == 0 else "U" + format(shard * KEY_SPACE // num_shards, "04x")
+    hi = None if shard == num_shards - 1 else "U" + format((shard + 1) * KEY_SPACE // num_shards, "04x")
+    return lo, hi
+
+
+class SQLiteLeaseBackend:
+    """本機 SQLite 版租約表（單機多 worker，或測試時當 Postgres 的替身）"""
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._local = threading.local()
+        self._memory_conn = None
+        self._memory_pid = None
+        self._lock = threading.Lock()
+        self._conn()
+
+    @staticmethod
+    def _create_table(conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS push_leases ("
+            "job TEXT NOT NULL, shard INTEGER NOT NULL, owner TEXT, expires_at REAL, "
+            "done INTEGER NOT NULL DEFAULT 0, cursor TEXT, payload TEXT, "
+            "PRIMARY KEY (job, shard))"
+        )
+
+    def _conn(self):
+        if self.path == ":memory:":
+            # fork 出來的 process 不能沿用 master 的連線，各自開一個（本來就不共用）
+            if self._memory_conn is None or self._memory_pid != os.getpid():
+                self._memory_conn = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+                self._memory_pid = os.getpid()
+                self._create_table(self._memory_conn)
+            return self._memory_conn
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._create_table(conn)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _tx(self, func):
+        with self._lock:
+            conn = self._conn()
+            if conn.in_transaction:
+                conn.commit()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn)
+                conn.execute("COMMIT")
+                return result
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def ensure_shards(self, job, num_shards):
+        self._tx(lambda c: c.executemany(
+            "INSERT OR IGNORE INTO push_leases (job, shard) VALUES (?, ?)",
+            [(job, s) for s in range(num_shards)]
+        ))
+
+    def claim(self, job, owner, lease_seconds):
+        def tx(c):
+            now = time.time()
+            rows = c.execute(
+                "SELECT shard, cursor FROM push_leases WHERE job = ? AND shard >= 0 AND done = 0 "
+                "AND (owner IS NULL OR expires_at < ?)", (job, now)
+            ).fetchall()
+            if not rows:
+                return None
+            shard, cursor = random.choice(rows)
+            c.execute(
+                "UPDATE push_leases SET owner = ?, expires_at = ? WHERE job = ? AND shard = ?",
+                (owner, now + lease_seconds, job, shard)
+            )
+            return shard, cursor
+        return self._tx(tx)
+
+    def renew(self, job, shard, owner, lease_seconds, cursor=None):
+        def tx(c):
+            cur = c.execute(
+                "UPDATE push_leases SET expires_at = ?, cursor = COALESCE(?, cursor) "
+                "WHERE job = ? AND shard = ? AND owner = ? AND done = 0",
+                (time.time() + lease_seconds, cursor, job, shard, owner)
+            )
+            return cur.rowcount == 1
+        return self._tx(tx)
+
+    def complete(self, job, shard, owner):
+        def tx(c):
+            cur = c.execute(
+                "UPDATE push_leases SET done = 1, expires_at = NULL "
+                "WHERE job = ? AND shard = ? AND owner = ?", (job, shard, owner)
+            )
+            return cur.rowcount == 1
+        return self._tx(tx)
+
+    def shared_payload(self, job, factory):
+        """整個 job 共用的資料：第一個寫入的 worker 決定，其他人讀同一份"""
+        row = self._tx(lambda c: c.execute(
+            "SELECT payload FROM push_leases WHERE job = ? AND shard = ?", (job, PAYLOAD_SHARD)
+        ).fetchone())
+        if row:
+            return row[0]
+        value = factory()
+        self._tx(lambda c: c.execute(
+            "INSERT OR IGNORE INTO push_leases (job, shard, done, payload) VALUES (?, ?, 1, ?)",
+            (job, PAYLOAD_SHARD, value)
+        ))
+        return self._tx(lambda c: c.execute(
+            "SELECT payload FROM push_leases WHERE job = ? AND shard = ?", (job, PAYLOAD_SHARD)
+        ).fetchone())[0]
+
+    def remaining(self, job):
+        return self._tx(lambda c: c.execute(
+            "SELECT COUNT(*) FROM push_leases WHERE job = ? AND shard >= 0 AND done = 0", (job,)
+        ).fetchone()[0])
+
+    def progress(self, job):
+        rows = self._tx(lambda c: c.execute(
+            "SELECT shard, owner, done, cursor FROM push_leases WHERE job = ? AND shard >= 0 ORDER BY shard",
+            (job,)
+        ).fetchall())
+        return [{"shard": s, "owner": o, "done": bool(d), "cursor": cur} for s, o, d, cur in rows]
+
+
+class SupabaseLeaseBackend:
+    """Supabase（Postgres）版租約表，靠 PostgREST 帶條件的 UPDATE 做 compare-and-set"""
+
+    def __init__(self, client, table="push_leases"):
+        self.client = client
+        self.table = table
+
+    @staticmethod
+    def _ts(seconds_from_now=0):
+        return (datetime.now(timezone.utc) + timedelta(seconds=seconds_from_now)).isoformat()
+
+    def ensure_shards(self, job, num_shards):
+        rows = [{"job": job, "shard": s, "done": False} for s in range(num_shards)]
+        self.client.table(self.table).upsert(rows, on_conflict="job,shard", ignore_duplicates=True).execute()
+
+    def claim(self, job, owner, lease_seconds):
+        now = self._ts()
+        free = f"owner.is.null,expires_at.lt.{now}"
+        candidates = or_filter(self.client.table(self.table).select("shard").eq("job", job)
+                               .eq("done", False).gte("shard", 0), free).execute().data
+        random.shuffle(candidates)
+        for row in candidates:
+            # 只有條件仍成立時才會更新到；回傳空代表被別的 worker 搶走
+            won = or_filter(self.client.table(self.table)
+                            .update({"owner": owner, "expires_at": self._ts(lease_seconds)})
+                            .eq("job", job).eq("shard", row["shard"]).eq("done", False), free)\
+                .execute().data
+            if won:
+                return won[0]["shard"], won[0].get("cursor")
+        return None
+
+    def renew(self, job, shard, owner, lease_seconds, cursor=None):
+        fields = {"expires_at": self._ts(lease_seconds)}
+        if cursor is not None:
+            fields["cursor"] = cursor
+        data = self.client.table(self.table).update(fields)\
+            .eq("job", job).eq("shard", shard).eq("owner", owner).eq("done", False).execute().data
+        return bool(data)
+
+    def complete(self, job, shard, owner):
+        data = self.client.table(self.table).update({"done": True, "expires_at": None})\
+            .eq("job", job).eq("shard", shard).eq("owner", owner).execute().data
+        return bool(data)
+
+    def shared_payload(self, job, factory):
+        def read():
+            rows = self.client.table(self.table).select("payload")\
+                .eq("job", job).eq("shard", PAYLOAD_SHARD).execute().data
+            return rows[0]["payload"] if rows else None
+
+        value = read()
+        if value is not None:
+            return value
+        self.client.table(self.table).upsert(
+            {"job": job, "shard": PAYLOAD_SHARD, "done": True, "payload": factory()},
+            on_conflict="job,shard", ignore_duplicates=True
+        ).execute()
+        return read()
+
+    def remaining(self, job):
+        return len(self.client.table(self.table).select("shard")
+                   .eq("job", job).gte("shard", 0).eq("done", False).execute().data)
+
+    def progress(self, job):
+        return self.client.table(self.table).select("shard,owner,done,cursor")\
+            .eq("job", job).gte("shard", 0).order("shard").execute().data
+
+
+class LeaseLost(Exception):
+    """租約被別的 worker 接手了，停止處理這個 shard"""
+
+
+class ShardLease:
+    """處理 shard 期間的租約：背景定期續約，也可以順便寫入進度 cursor"""
+
+    def __init__(self, backend, job, shard, owner, lease_seconds, cursor=None):
+        self.backend = backend
+        self.job = job
+        self.shard = shard
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.cursor = cursor
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                if not self.backend.renew(self.job, self.shard, self.owner, self.lease_seconds):
+                    self.lost = True
+                    return
+            except Exception as e:
+                log.warning("⚠️ 續約失敗", shard=self.shard, error=str(e))
+
+    def checkpoint(self, cursor):
+        """記錄進度；如果租約已經不是自己的就丟 LeaseLost"""
+        if self.lost or not self.backend.renew(self.job, self.shard, self.owner, self.lease_seconds, cursor):
+            self.lost = True
+            raise LeaseLost(f"shard {self.shard} 租約已被接手")
+        self.cursor = cursor
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+
+
+def run_sharded(backend, job, num_shards, process_shard, owner=None, lease_seconds=60):
+    """反覆領取還沒完成的 shard 來處理，直到全部做完
+
+    別人手上的 shard 還沒做完時會繼續等，租約過期（對方當掉）就接手。
+    process_shard(shard, bounds, lease) 負責實際工作；lease.checkpoint(cursor) 可記錄進度
+    """
+    owner = owner or worker_id()
+    backend.ensure_shards(job, num_shards)
+    processed = []
+    while True:
+        claimed = backend.claim(job, owner, lease_seconds)
+        if claimed is None:
+            if not backend.remaining(job):
+                break
+            time.sleep(lease_seconds / 3)
+            continue
+        shard, cursor = claimed
+        try:
+            with ShardLease(backend, job, shard, owner, lease_seconds, cursor) as lease:
+                process_shard(shard, shard_bounds(shard, num_shards), lease)
+                if lease.lost:
+                    raise LeaseLost(f"shard {shard} 租約已被接手")
+            backend.complete(job, shard, owner)
+            processed.append(shard)
+        except LeaseLost as e:
+            log.warning("⚠️ 租約已被接手", shard=shard, error=str(e))
+    return processed
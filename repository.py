@@ -0,0 +1,136 @@
+# repository.py - users / subscribers 資料存取：不再「先查再寫」，通常每個操作一趟 PostgREST（upsert / UPDATE / RPC）
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+
+from log import get_logger
+
+log = get_logger(__name__)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _missing_function(error):
+    """PostgREST 找不到函式（PGRST202 / 404）：多半是還沒執行對應的 sql 檔"""
+    return getattr(error, "code", None) in ("PGRST202", 404) or "PGRST202" in str(error)
+
+
+def _first(data):
+    """PostgREST 回傳單列（RPC 回傳 composite）或多列（upsert return=representation）都收"""
+    if isinstance(data, list):
+        return data[0] if data else None
+    return data or None
+
+
+class UserRepository:
+    """包住 supabase client；錯誤照樣往外丟，由呼叫端決定要記 log 還是退回預設值
+
+    use_rpc=True 代表已執行 sql/users_rpc.sql：除了 follow_user RPC，也設定了 created_at / subscribed_at 等欄位的預設值，
+    寫入只送 user_id 和要改的欄位，一個 upsert 就好。沒執行過的資料庫沒有這些預設值，
+    新建資料列時要自己帶上建立時間（見 _write）
+    """
+
+    def __init__(self, client, use_rpc=False):
+        self.client = client
+        self.use_rpc = use_rpc
+        self._touch_rpc = True  # touch_last_active 是否可用（sql/last_active.sql）
+        self._lock = threading.Lock()
+        self.round_trips = Counter()
+        self.rpc_fallbacks = 0
+
+    def _count(self, op, n=1):
+        with self._lock:
+            self.round_trips[op] += n
+
+    def _write(self, op, table, user_id, fields, create_fields, likely_new=False):
+        """寫入一列並回傳；資料列不存在就建立，存在就只改 fields
+
+        有資料庫預設值時一個 upsert 搞定。沒有的話 upsert 帶 create_fields 會蓋掉既有資料列的建立時間，
+        所以拆成 UPDATE 和 INSERT ... ON CONFLICT DO NOTHING，依 likely_new 先試比較可能成功的那個：
+        通常一趟；猜錯兩趟；兩個都落空（剛好被別的 worker 建立 / 刪除）再試一次第一個
+        """
+        if self.use_rpc:
+            self._count(op)
+            return _first(self.client.table(table)
+                          .upsert(dict(fields, user_id=user_id), on_conflict="user_id").execute().data)
+
+        def update():
+            self._count(op)
+            return _first(self.client.table(table).update(fields).eq("user_id", user_id).execute().data)
+
+        def insert():
+            self._count(op)
+            row = dict(create_fields, **fields, user_id=user_id)
+            return _first(self.client.table(table)
+                          .upsert(row, on_conflict="user_id", ignore_duplicates=True).execute().data)
+
+        first, second = (insert, update) if likely_new else (update, insert)
+        return first() or second() or first()
+
+    def get_or_create(self, user_id, likely_new=False):
+        """不存在就建立、存在就只更新 last_active（名字、城市不動），回傳完整資料列"""
+        now = _now()
+        return self._write("get_or_create", "users", user_id, {"last_active": now},
+                           {"created_at": now}, likely_new)
+
+    def update(self, user_id, fields):
+        """改名字 / 城市；資料列還沒建立時會建立，不會默默更新到 0 列"""
+        now = _now()
+        return self._write("update", "users", user_id, fields, {"created_at": now, "last_active": now})
+
+    def touch_many(self, rows):
+        """批次寫回 last_active（LastActiveBuffer 用）；UPDATE 語意，不會替沒有資料列的用戶建出空殼列"""
+        if self._touch_rpc:
+            try:
+                self._count("touch_many")
+                self.client.rpc("touch_last_active", {"p_rows": rows}).execute()
+                return
+            except Exception as e:
+                if not _missing_function(e):
+                    raise
+                self._touch_rpc = False
+                log.warning("⚠️ touch_last_active RPC 不存在，改為逐筆 UPDATE", error=str(e))
+        for row in rows:
+            self._count("touch_one")
+            self.client.table("users").update({"last_active": row["last_active"]})\
+                .eq("user_id", row["user_id"]).execute()
+
+    def subscribe(self, user_id, likely_new=False):
+        """新訂閱或重新訂閱；subscribed_at 只在第一次建立時填入，重新訂閱不會改掉"""
+        return self._write("subscribe", "subscribers", user_id, {"is_active": True},
+                           {"subscribed_at": _now()}, likely_new)
+
+    def unsubscribe(self, user_id):
+        self._count("unsubscribe")
+        self.client.table("subscribers").update({"is_active": False}).eq("user_id", user_id).execute()
+
+    def follow(self, user_id, create_user=True):
+        """加好友：建立用戶 + 訂閱；有 RPC 就一趟，沒有就各寫一次（已知用戶存在時只剩訂閱）。回傳 users 資料列"""
+        if self.use_rpc:
+            try:
+                self._count("follow_rpc")
+                return _first(self.client.rpc("follow_user", {"p_user_id": user_id}).execute().data)
+            except Exception as e:
+                with self._lock:
+                    self.rpc_fallbacks += 1
+                if _missing_function(e):
+                    # 還沒執行 sql/users_rpc.sql：之後都改走 upsert，不再每次多浪費一趟
+                    self.use_rpc = False
+                    log.warning("⚠️ follow_user RPC 不存在，之後改用 upsert", error=str(e))
+                else:
+                    # 逾時、連線錯誤等暫時性問題：只有這次改用 upsert，下次照樣先試 RPC
+                    log.warning("⚠️ follow_user RPC 失敗，這次改用 upsert", error=str(e))
+        # 快取裡沒有的用戶多半是第一次加好友，先試 INSERT；已知用戶是封鎖後再加回，先試 UPDATE
+        user = self.get_or_create(user_id, likely_new=True) if create_user else None
+        self.subscribe(user_id, likely_new=create_user)
+        return user
+
+    def stats(self):
+        with self._lock:
+            return {
+                "use_rpc": self.use_rpc,
+                "rpc_fallbacks": self.rpc_fallbacks,
+                "round_trips": dict(self.round_trips),
+            }
@@ -0,0 +1,6 @@
+-- 對話記憶（CONVERSATION_BACKEND=supabase 時使用）：記憶體放不下的用戶最近幾輪問答
+create table if not exists conversations (
+    user_id    text        primary key,
+    turns      jsonb       not null,              -- [["user", "..."], ["assistant", "..."], ...]
+    updated_at timestamptz not null default now()
+);
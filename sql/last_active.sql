@@ -0,0 +1,12 @@
+-- last_active 批次寫回（LastActiveBuffer 每次 flush 一趟）
+-- 只更新已存在的用戶、只往後更新；沒有 users 資料列的 user_id 直接略過，不會建出空殼列
+create or replace function touch_last_active(p_rows jsonb)
+returns void
+language sql
+as $$
+    update users u
+    set last_active = r.last_active
+    from jsonb_to_recordset(p_rows) as r(user_id text, last_active timestamptz)
+    where u.user_id = r.user_id
+      and (u.last_active is null or u.last_active < r.last_active);
+$$;
@@ -0,0 +1,11 @@
+-- 每日推播分片租約（PUSH_LEASE_BACKEND=supabase 時使用）
+create table if not exists push_leases (
+    job        text        not null,            -- 例如 daily_push:2026-10-18
+    shard      integer     not null,            -- -1 = 整個 job 共用資料（payload）
+    owner      text,                            -- host:pid:亂數
+    expires_at timestamptz,                     -- 過期後其他 worker 可以接手
+    done       boolean     not null default false,
+    cursor     text,                            -- 分片處理進度
+    payload    text,
+    primary key (job, shard)
+);
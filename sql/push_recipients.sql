@@ -0,0 +1,6 @@
+-- 每日推播的訂閱者掃描（PUSH_PER_CITY=1 時使用）：訂閱狀態和 users.city 一次讀回，
+-- 08:00 推播時不必再每批回頭查 users；沒有這個 view 時會自動改回逐批查詢
+create or replace view push_recipients as
+select s.user_id, s.is_active, s.last_push_date, u.city
+from subscribers s
+left join users u on u.user_id = s.user_id;
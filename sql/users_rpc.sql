@@ -0,0 +1,28 @@
+-- users / subscribers 改用 upsert 後需要的欄位預設值，以及加好友一趟完成的 RPC
+-- 執行後設定 SUPABASE_RPC=1：程式以此判斷預設值已在，upsert 只送 user_id 和要改的欄位，新建時其餘欄位吃預設值
+-- 沒執行也能跑：程式會在新建資料列時自己帶 created_at / subscribed_at，只是有些操作要多一趟
+alter table users alter column created_at set default now();
+alter table users alter column last_active set default now();
+alter table subscribers alter column subscribed_at set default now();
+alter table subscribers alter column is_active set default true;
+
+-- 建立（或更新 last_active）用戶並訂閱，回傳 users 資料列
+create or replace function follow_user(p_user_id text)
+returns users
+language plpgsql
+as $$
+declare
+    result users;
+begin
+    insert into users (user_id, last_active)
+    values (p_user_id, now())
+    on conflict (user_id) do update set last_active = excluded.last_active
+    returning * into result;
+
+    insert into subscribers (user_id, is_active)
+    values (p_user_id, true)
+    on conflict (user_id) do update set is_active = true;
+
+    return result;
+end;
+$$;
@@ -0,0 +1,8 @@
+-- 已處理的 webhookEventId（WEBHOOK_DEDUPE_BACKEND=supabase 時使用，多台共用去重）
+create table if not exists webhook_events (
+    event_id    text        primary key,
+    received_at timestamptz not null default now()
+);
+
+-- LINE 重送只會發生在短時間內，舊資料定期清掉即可（例如 pg_cron 每小時跑一次）
+-- delete from webhook_events where received_at < now() - interval '1 day';
@@ -0,0 +1,85 @@
+# ttl_cache.py - 執行緒安全的 LRU + TTL 快取（附命中統計）
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """最多 maxsize 筆、每筆 ttl 秒後過期的 LRU 快取"""
+
+    def __init__(self, maxsize=10000, ttl=300, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict  # on_evict(key, value)：因容量被擠掉時呼叫（在鎖外）
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        evicted = []
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False))
+                self.evictions += 1
+        if self.on_evict:
+            for old_key, (old_value, _) in evicted:
+                self.on_evict(old_key, old_value)
+
+    def update(self, key, fields):
+        """只更新已在快取中的 dict 欄位（write-through 用），不存在就略過"""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return False
+            value, expires_at = item
+            self._data[key] = ({**value, **fields}, expires_at)
+            return True
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+        return None if item is _MISSING else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,266 @@
+# upstream.py - 共用對外 HTTP 連線池（每個上游：keep-alive、併發上限、重試、斷路器）
+import os
+import random
+import threading
+import time
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+
+from log import get_logger
+
+log = get_logger(__name__)
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+class CircuitOpenError(Exception):
+    """斷路器打開中，直接拒絕，不佔用連線"""
+
+
+class UpstreamBusyError(Exception):
+    """同時進行的請求已達上限，等不到名額"""
+
+
+class CircuitBreaker:
+    """連續失敗 failure_threshold 次就打開，reset_timeout 秒後放一個試探請求（half-open）"""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.trips += 1
+                    log.warning("⚡ 斷路器打開", upstream=self.name, failures=self.failures)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+
+class Upstream:
+    """單一上游服務的連線池與保護機制"""
+
+    def __init__(self, name, max_concurrency=8, pool_size=None, acquire_timeout=5,
+                 retries=2, backoff=0.3, failure_threshold=5, reset_timeout=30, on_error=None):
+        self.name = name
+        self.on_error = on_error  # on_error(upstream 名稱, 錯誤種類)，給指標用
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size or max_concurrency
+        self.acquire_timeout = acquire_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.errors = 0
+        self.retried = 0
+        self.busy_rejects = 0
+        self.in_flight = 0
+
+    @property
+    def session(self):
+        # fork 之後重建，避免不同 worker 共用同一條 socket
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+                    self._pid = os.getpid()
+        return self._session
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        """發送請求；5xx 或連線錯誤算失敗。非冪等請求不重試
+
+        stream=True 時回傳的 response 會一直佔著併發名額，直到 body 讀完或 close()；
+        斷路器也等 body 讀完才記成功（讀到一半斷線記失敗）
+        """
+        method = method.upper()
+        stream = kwargs.get("stream", False)
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = 1 + (self.retries if idempotent else 0)
+
+        for attempt in range(attempts):
+            if not self._slots.acquire(timeout=self.acquire_timeout):
+                with self._lock:
+                    self.busy_rejects += 1
+                self._report("busy")
+                raise UpstreamBusyError(f"{self.name} 併發已滿（{self.max_concurrency}）")
+            if not self.breaker.allow():
+                self._slots.release()
+                self._report("circuit_open")
+                raise CircuitOpenError(f"{self.name} 斷路器打開中")
+            with self._lock:
+                self.requests += 1
+                self.in_flight += 1
+                if attempt:
+                    self.retried += 1
+            held = False
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.RequestException:
+                self.breaker.record_failure()
+                with self._lock:
+                    self.errors += 1
+                self._report("connection")
+                if attempt == attempts - 1:
+                    raise
+            else:
+                if response.status_code < 500:
+                    if stream:
+                        held = True
+                        return self._hold_until_closed(response, ok=True)
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                with self._lock:
+                    self.errors += 1
+                self._report("5xx")
+                if attempt == attempts - 1:
+                    if stream:
+                        held = True
+                        return self._hold_until_closed(response, ok=False)
+                    return response
+                response.close()
+            finally:
+                if not held:
+                    self._release()
+            # 指數退避 + full jitter
+            time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def _hold_until_closed(self, response, ok):
+        """把名額綁在串流 response 上：body 讀完、讀取出錯或 close() 時才歸還（只歸還一次）"""
+        state = {"done": False, "failed": not ok}
+        guard = threading.Lock()
+        original_iter = response.iter_content
+        original_close = response.close
+
+        def finish():
+            with guard:
+                if state["done"]:
+                    return
+                state["done"] = True
+            if not state["failed"]:
+                self.breaker.record_success()
+            self._release()
+
+        def iter_content(*args, **kwargs):
+            try:
+                yield from original_iter(*args, **kwargs)
+            except requests.RequestException:
+                state["failed"] = True
+                self.breaker.record_failure()
+                with self._lock:
+                    self.errors += 1
+                self._report("connection")
+                finish()
+                raise
+            finish()
+
+        def close():
+            try:
+                original_close()
+            finally:
+                finish()
+
+        # content / json() / iter_lines 都經過 iter_content；`with response:` 也會呼叫 close()
+        response.iter_content = iter_content
+        response.close = close
+        weakref.finalize(response, finish)  # 呼叫端忘了 close 時，response 被回收也會歸還
+        return response
+
+    def _report(self, kind):
+        if self.on_error:
+            self.on_error(self.name, kind)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "retried": self.retried,
+                "busy_rejects": self.busy_rejects,
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "breaker": self.breaker.state,
+                "breaker_trips": self.breaker.trips,
+                "breaker_rejected": self.breaker.rejected,
+            }
+
+
+def make_line_http_client(upstream):
+    """產生給 LineBotApi(http_client=...) 用的類別，讓 LINE API 也走共用連線池"""
+
+    class LineHttpClient(RequestsHttpClient):
+        def get(self, url, headers=None, params=None, stream=False, timeout=None):
+            response = upstream.request("GET", url, headers=headers, params=params, stream=stream,
+                                        timeout=timeout or self.timeout)
+            return RequestsHttpResponse(response)
+
+        def post(self, url, headers=None, data=None, timeout=None):
+            response = upstream.request("POST", url, headers=headers, data=data,
+                                        timeout=timeout or self.timeout)
+            return RequestsHttpResponse(response)
+
+        def put(self, url, headers=None, data=None, timeout=None):
+            response = upstream.request("PUT", url, headers=headers, data=data,
+                                        timeout=timeout or self.timeout)
+            return RequestsHttpResponse(response)
+
+        def delete(self, url, headers=None, data=None, timeout=None):
+            response = upstream.request("DELETE", url, headers=headers, data=data,
+                                        timeout=timeout or self.timeout)
+            return RequestsHttpResponse(response)
+
+    return LineHttpClient
@@ -0,0 +1,101 @@
+# weather_cache.py - 各城市天氣快取（依預報時段過期、single-flight、過期資料有限度備援）
+import threading
+import time
+
+from log import get_logger
+
+log = get_logger(__name__)
+
+
+class WeatherCache:
+    """fetch_func(city_name) 回傳 (天氣 dict, 到期 epoch 秒)；同城市同時只會有一個請求在跑"""
+
+    def __init__(self, fetch_func, max_stale=3 * 3600, min_ttl=300, refresh_timeout=10):
+        self.fetch_func = fetch_func
+        self.min_ttl = min_ttl
+        self.max_stale = max_stale
+        self.refresh_timeout = refresh_timeout
+        self._entries = {}   # city -> (data, expires_at)
+        self._inflight = {}  # city -> threading.Event
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.fetch_errors = 0
+        self.coalesced = 0
+
+    def get(self, city):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(city)
+            if entry and now < entry[1]:
+                self.hits += 1
+                return entry[0]
+            usable_stale = entry if entry and now - entry[1] < self.max_stale else None
+            if usable_stale:
+                # 先回舊資料，背景更新
+                self.stale_hits += 1
+                leader = city not in self._inflight
+                if leader:
+                    self._inflight[city] = threading.Event()
+            else:
+                self.misses += 1
+                event = self._inflight.get(city)
+                leader = event is None
+                if leader:
+                    self._inflight[city] = threading.Event()
+                else:
+                    self.coalesced += 1
+
+        if usable_stale:
+            if leader:
+                threading.Thread(target=self._refresh, args=(city,), daemon=True).start()
+            return usable_stale[0]
+
+        if leader:
+            self._refresh(city)
+        else:
+            event.wait(self.refresh_timeout)
+
+        with self._lock:
+            entry = self._entries.get(city)
+        if entry and time.time() - entry[1] < self.max_stale:
+            return entry[0]
+        raise RuntimeError(f"{city} 天氣資料取得失敗")
+
+    def _refresh(self, city):
+        try:
+            with self._lock:
+                self.fetches += 1
+            data, expires_at = self.fetch_func(city)
+            # 時段快結束（或已結束）時至少快取 min_ttl，避免每則訊息都重抓
+            expires_at = max(expires_at, time.time() + self.min_ttl)
+            with self._lock:
+                self._entries[city] = (data, expires_at)
+        except Exception as e:
+            log.warning("天氣API錯誤", city=city, error=str(e))
+            with self._lock:
+                self.fetch_errors += 1
+        finally:
+            with self._lock:
+                event = self._inflight.pop(city, None)
+            if event:
+                event.set()
+
+    def put(self, city, data, expires_at):
+        with self._lock:
+            self._entries[city] = (data, expires_at)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cities": len(self._entries),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "fetches": self.fetches,
+                "fetch_errors": self.fetch_errors,
+                "coalesced": self.coalesced,
+            }
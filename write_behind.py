@@ -0,0 +1,129 @@
+# write_behind.py - last_active 寫回緩衝（同一用戶只留最新時間，定期批次寫回）
+import json
+import os
+import threading
+import time
+
+from log import get_logger
+
+log = get_logger(__name__)
+
+
+class LastActiveBuffer:
+    """累積 user_id -> last_active，達到筆數或時間門檻時一次寫回
+
+    寫入失敗時退避（interval 的倍數，最多 max_backoff 秒）；同一列失敗 max_attempts 次就丟掉，
+    一筆壞資料不會卡住所有人的 last_active
+    """
+
+    def __init__(self, flush_func, max_pending=500, interval=30, max_attempts=5, max_backoff=600):
+        # flush_func(rows) 負責實際寫入，rows = [{'user_id':..., 'last_active':...}]
+        self.flush_func = flush_func
+        self.max_pending = max_pending
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self._pending = {}
+        self._attempts = {}  # user_id -> 已失敗次數
+        self._failures = 0  # 連續失敗的批次數
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+        self._pid = None
+
+        self.writes_requested = 0
+        self.writes_coalesced = 0
+        self.rows_flushed = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.rows_dropped = 0
+        self.bytes_saved = 0
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="last-active-flusher", daemon=True)
+            self._thread.start()
+
+    def touch(self, user_id, timestamp):
+        """記錄一次活動；不碰網路"""
+        self._ensure_thread()
+        with self._lock:
+            self.writes_requested += 1
+            if user_id in self._pending:
+                # 被合併掉的那一次 UPDATE 原本要送的 body 大小
+                self.writes_coalesced += 1
+                self.bytes_saved += len(json.dumps({'last_active': self._pending[user_id]}))
+            self._pending[user_id] = timestamp
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self, force=False):
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                if not force and time.monotonic() < self._retry_at:
+                    return 0  # 退避中
+                batch, self._pending = self._pending, {}
+            rows = [{'user_id': uid, 'last_active': ts} for uid, ts in batch.items()]
+            try:
+                self.flush_func(rows)
+            except Exception as e:
+                log.warning("⚠️ last_active 批次寫入失敗", rows=len(rows), error=str(e))
+                with self._lock:
+                    self.flush_errors += 1
+                    self._failures += 1
+                    self._retry_at = time.monotonic() + min(self.interval * 2 ** (self._failures - 1), self.max_backoff)
+                    # 放回去等下次，較新的時間優先；失敗太多次的放棄
+                    for uid, ts in batch.items():
+                        attempts = self._attempts.get(uid, 0) + 1
+                        if attempts >= self.max_attempts:
+                            self._attempts.pop(uid, None)
+                            self.rows_dropped += 1
+                            continue
+                        self._attempts[uid] = attempts
+                        if uid not in self._pending:
+                            self._pending[uid] = ts
+                return 0
+            with self._lock:
+                self.flushes += 1
+                self.rows_flushed += len(rows)
+                self._failures = 0
+                self._retry_at = 0.0
+                for uid in batch:
+                    self._attempts.pop(uid, None)
+            return len(rows)
+
+    def close(self):
+        """程式結束前把剩下的寫完（由 atexit 呼叫）"""
+        self._closed = True
+        self._wakeup.set()
+        self.flush(force=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "writes_requested": self.writes_requested,
+                "writes_coalesced": self.writes_coalesced,
+                "rows_flushed": self.rows_flushed,
+                "flushes": self.flushes,
+                "flush_errors": self.flush_errors,
+                "rows_dropped": self.rows_dropped,
+                "bytes_saved": self.bytes_saved,
+            }